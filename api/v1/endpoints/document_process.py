@@ -1,378 +1,568 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status, BackgroundTasks
-from typing import Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Any, List, Optional, Set, Tuple
 import uuid
-import io
 import os
-import re
+import json
 import asyncio
-import random
+import time
 import logging
 
 from ..dependencies import Session, get_session, SUPABASE_URL, SUPABASE_KEY
 from supabase import create_client
-from src.pipeline import IngestionPipeline
+from src.jobs.IngestionWorker import complete_as_duplicate, duplicate_job_fields, update_processing_job
+from src.jobs.JobQueue import get_job_queue
+from src.jobs.ProgressBus import EVENT_FIELDS, TERMINAL_STATUSES, ProgressEvent, get_progress_bus
+from src.jobs.ProgressWriter import get_progress_writer
 from src.storage.SupabaseService import SupabaseService
+from src.storage.UploadSpool import MAX_BATCH_FILES, MAX_UPLOAD_BYTES, SpooledUpload, UploadTooLarge, keep_local_payload, spool_multipart_files, take_local_payload
+
+try:
+    import fitz as pymupdf  # type: ignore[import-not-found]  # PyMuPDF canonical import
+except ImportError:  # pragma: no cover - fallback for environments exposing pymupdf module
+    import pymupdf  # type: ignore[import-not-found]
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 
 logger = logging.getLogger("uvicorn.error")
 
+# Progress streams read processing_jobs only when the job is not running in this
+# process (standalone workers); this is how often they do.
+PROGRESS_FALLBACK_POLL_SECONDS = float(os.getenv("PROGRESS_FALLBACK_POLL_SECONDS", "10"))
 
-# Throttle concurrent ingestion jobs (helps avoid Gemini quota/rate bursts)
-_MAX_CONCURRENT_INGESTIONS = int(os.getenv("MAX_CONCURRENT_INGESTIONS", "2"))
-_INGESTION_SEMAPHORE = asyncio.Semaphore(_MAX_CONCURRENT_INGESTIONS)
+# job_id -> user_id for jobs whose ownership was already checked, so long-polls
+# served from the progress bus need no database read.
+_job_owners: "OrderedDict[str, str]" = OrderedDict()
+_JOB_OWNERS_MAX = 10000
 
+# Uploads still being stored; the job is queued when its upload finishes.
+_background_uploads: Set["asyncio.Task[None]"] = set()
 
-def _parse_retry_after_seconds(error_text: str) -> Optional[float]:
-    """Best-effort extraction of server-provided retry delays from Gemini errors."""
-    if not error_text:
-        return None
+# Files of one batch stored to storage at a time.
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", "4"))
 
-    # Examples we may see:
-    # - "Please retry in 41.466s."
-    # - "'retryDelay': '41s'"
-    m = re.search(r"retry in\s+(\d+(?:\.\d+)?)s", error_text, flags=re.IGNORECASE)
-    if m:
-        return float(m.group(1))
-    m = re.search(r"retryDelay\s*['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", error_text, flags=re.IGNORECASE)
-    if m:
-        return float(m.group(1))
-    return None
 
+def _remember_owner(job_id: str, user_id: str) -> None:
+    _job_owners[job_id] = user_id
+    _job_owners.move_to_end(job_id)
+    while len(_job_owners) > _JOB_OWNERS_MAX:
+        _job_owners.popitem(last=False)
 
-def _get_user_friendly_error(exception_str: str) -> tuple[str, str]:
+
+@router.post("/process", response_model=Dict[str, Any])
+async def process_document(
+    request: Request,
+    session: Session = Depends(get_session)
+) -> Dict[str, Any]:
     """
-    Convert technical errors to user-friendly messages.
-    Returns: (user_message, error_code)
+    Upload and queue a document for processing (multipart: a `file` part and an
+    optional `previous_document_id` field).
+    The file is streamed to disk as the body arrives, into the one spool file that is
+    hashed, stored and page-counted, rather than parsed into a form first.
+    Returns as soon as the upload is received, with a job_id for status tracking. The
+    PDF then goes to storage in the background (status "uploading", as a resumable
+    upload for large files) and the job is put on the durable ingestion queue, where
+    an ingestion worker picks it up.
+    With `previous_document_id` the file is ingested as a new version of that
+    document: unchanged pages are not re-annotated, and the new version replaces
+    the old one only once it is fully processed.
     """
-    error_lower = exception_str.lower()
+    content_type = request.headers.get("content-type", "")
+    if not content_type.lower().startswith("multipart/form-data"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a multipart/form-data upload."
+        )
     
-    # API Key errors
-    if "401" in exception_str or "invalid_api_key" in error_lower or "incorrect api key" in error_lower:
-        return ("AI service temporarily unavailable. Please try again later or contact support.", "api_key_invalid")
+    # Stream the file to disk, hashing it and enforcing the size limit on the way
+    # (UploadSizeLimitMiddleware already cut off bodies far over the limit)
+    fields: Dict[str, str] = {}
+    try:
+        uploads = await spool_multipart_files(content_type, request.stream(), 1, MAX_UPLOAD_BYTES, fields=fields)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)}MB."
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    # Rate limit / quota exhaustion
-    if "429" in exception_str or "rate_limit" in error_lower or "resource_exhausted" in error_lower or "quota" in error_lower:
-        # Gemini free-tier commonly returns RESOURCE_EXHAUSTED. Make this explicit.
-        if "resource_exhausted" in error_lower or "quota" in error_lower:
-            return (
-                "Upload rate limit reached while processing this PDF. Please wait a bit and retry, or upload fewer files at once.",
-                "quota_exhausted",
-            )
-        return ("Service is busy. Please wait a moment and try again.", "rate_limit")
+    if not uploads:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No file uploaded.")
+    filename, spool = uploads[0]
     
-    # File parsing errors
-    if "parsing" in error_lower or "pdf" in error_lower and "corrupt" in error_lower:
-        return ("Unable to read PDF file. The file may be corrupted or password-protected.", "file_corrupted")
+    # Validate file type
+    if not filename.lower().endswith('.pdf'):
+        spool.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file type. Only PDF files are supported."
+        )
     
-    # Embedding errors
-    if "embedding" in error_lower:
-        return ("Failed to process document content. Please try again.", "embedding_failed")
+    if spool.content_type and spool.content_type != 'application/pdf':
+        spool.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file type. PDF required."
+        )
     
-    # Network errors
-    if "connection" in error_lower or "timeout" in error_lower:
-        return ("Network connection issue. Please check your connection and retry.", "network_error")
+    # Initialize Supabase client
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
     
-    # Database errors
-    if "supabase" in error_lower or "database" in error_lower:
-        return ("Database error. Please try again or contact support.", "database_error")
+    previous_document_id = fields.get("previous_document_id") or None
+    if previous_document_id:
+        try:
+            await _check_previous_version(supabase_client, previous_document_id, session.user_id)
+        except BaseException:
+            spool.close()
+            raise
     
-    # Generic fallback
-    return ("An unexpected error occurred. Please try again.", "unknown_error")
+    return await _queue_spooled_upload(supabase_client, session, filename, spool, previous_document_id)
 
 
-async def _process_document_background(
-    job_id: uuid.UUID,
-    pdf_bytes: bytes,
-    user_id: uuid.UUID,
+async def _queue_spooled_upload(
+    supabase_client,
+    session: Session,
     filename: str,
-    doc_type: str,
-    token: str
-):
-    """Background task to process document and update job status."""
-    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    supabase_client.options.headers["Authorization"] = f"Bearer {token}"
-    acquired = False
-    
+    spool: SpooledUpload,
+    previous_document_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Creates the processing job for a spooled PDF and starts storing and queueing it
+    in the background. Takes ownership of `spool`.
+    """
     try:
-        await _INGESTION_SEMAPHORE.acquire()
-        acquired = True
-
+        # Create processing job record
+        job_id = uuid.uuid4()
         logger.info(
-            "processing_job_start job_id=%s filename=%s max_concurrent=%s",
+            "process_document_received job_id=%s filename=%s size_bytes=%s",
             str(job_id),
             filename,
-            _MAX_CONCURRENT_INGESTIONS,
+            spool.size,
         )
-
-        # Update to parsing status
-        supabase_client.table("processing_jobs").update({
-            "status": "parsing",
-            "current_step": "Reading PDF...",
-            "progress_percentage": 10
-        }).eq("id", str(job_id)).execute()
+        job_data = {
+            "id": str(job_id),
+            "user_id": session.user_id,
+            "filename": filename,
+            "status": "uploading",
+            "current_step": "Uploading file...",
+            "progress_percentage": 0,
+            "previous_document_id": previous_document_id
+        }
         
-        # Create file buffer from bytes
-        file_buffer = io.BytesIO(pdf_bytes)
+        response = await asyncio.to_thread(supabase_client.table("processing_jobs").insert(job_data).execute)
+        
+        if not response.data:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to create processing job"
+            )
         
-        # Initialize services
+        _remember_owner(str(job_id), session.user_id)
         supabase_service = SupabaseService(supabase_client)
-        pipeline = IngestionPipeline(supabase_service=supabase_service)
         
-        # Run pipeline with limited retries for transient quota bursts.
-        max_attempts = int(os.getenv("DOCUMENT_PROCESS_MAX_ATTEMPTS", "3"))
-        last_result: Optional[Dict[str, Any]] = None
-        last_error: Optional[Exception] = None
-
-        for attempt in range(1, max_attempts + 1):
-            try:
+        # Identical file already ingested: point the job at it instead of reprocessing
+        if os.getenv("DOCUMENT_DEDUP", "1") != "0":
+            existing = await asyncio.to_thread(supabase_service.find_document_by_hash, session.user_id, spool.content_hash)
+            if existing:
                 logger.info(
-                    "processing_job_attempt job_id=%s filename=%s attempt=%s/%s",
-                    str(job_id),
-                    filename,
-                    attempt,
-                    max_attempts,
-                )
-                last_result = await pipeline.run(
-                    pdf_file_buffer=file_buffer,
-                    user_id=user_id,
-                    original_filename=filename,
-                    doc_type=doc_type,
-                    job_id=job_id  # Pass job_id for progress updates
-                )
-
-                # If the pipeline itself reports a failure, decide if it's retryable.
-                if last_result.get("success"):
-                    break
-
-                msg = str(last_result.get("message", ""))
-                is_retryable = ("429" in msg) or ("resource_exhausted" in msg.lower()) or ("rate limit" in msg.lower())
-                if not is_retryable or attempt >= max_attempts:
-                    break
-
-                retry_after = _parse_retry_after_seconds(msg)
-                sleep_s = retry_after if retry_after is not None else min(2 ** attempt, 30)
-                sleep_s += random.uniform(0, 0.5)
-                supabase_client.table("processing_jobs").update({
-                    "status": "parsing",
-                    "current_step": f"Rate limited. Retrying (attempt {attempt + 1}/{max_attempts})...",
-                    "progress_percentage": 10
-                }).eq("id", str(job_id)).execute()
-                await asyncio.sleep(sleep_s)
-                file_buffer.seek(0)
-
-            except Exception as e:
-                last_error = e
-                msg = str(e)
-                is_retryable = ("429" in msg) or ("resource_exhausted" in msg.lower()) or ("rate limit" in msg.lower())
-                if not is_retryable or attempt >= max_attempts:
-                    break
-                retry_after = _parse_retry_after_seconds(msg)
-                sleep_s = retry_after if retry_after is not None else min(2 ** attempt, 30)
-                sleep_s += random.uniform(0, 0.5)
-                logger.warning(
-                    "processing_job_retry job_id=%s filename=%s sleep_s=%.2f reason=%s",
+                    "process_document_dedup_hit job_id=%s document_id=%s",
                     str(job_id),
-                    filename,
-                    sleep_s,
-                    ("quota" if "resource_exhausted" in msg.lower() else "rate_limit"),
+                    existing["id"],
                 )
-                await asyncio.sleep(sleep_s)
-                file_buffer.seek(0)
-
-        if last_result is None and last_error is not None:
-            raise last_error
-
-        result = last_result or {"success": False, "message": "Unknown processing error"}
+                await complete_as_duplicate(supabase_client, job_id, existing)
+                spool.close()
+                return {
+                    "success": True,
+                    "message": "Document already processed",
+                    "job_id": str(job_id),
+                    "filename": filename,
+                    "document_id": str(existing["id"]),
+                    "deduplicated": True
+                }
         
-        if result.get("success"):
-            logger.info(
-                "processing_job_success job_id=%s filename=%s document_id=%s",
-                str(job_id),
-                filename,
-                str(result.get("document_id")) if result.get("document_id") else None,
-            )
-            # Convert UUID to string for JSON serialization
-            result_data = {
-                "success": result.get("success"),
-                "message": result.get("message"),
-                "document_id": str(result.get("document_id")) if result.get("document_id") else None,
-                "chunk_count": result.get("chunk_count")
-            }
-            
-            # Mark as completed
-            supabase_client.table("processing_jobs").update({
-                "status": "completed",
-                "current_step": "Complete!",
-                "progress_percentage": 100,
-                "document_id": str(result.get("document_id")) if result.get("document_id") else None,
-                "result_data": result_data,
-                "completed_at": "now()"
-            }).eq("id", str(job_id)).execute()
-        else:
-            # Mark as failed with user-friendly error
-            user_error, error_code = _get_user_friendly_error(result.get("message", ""))
-            logger.error(
-                "processing_job_failed job_id=%s filename=%s error_code=%s",
-                str(job_id),
-                filename,
-                error_code,
-            )
-            supabase_client.table("processing_jobs").update({
-                "status": "failed",
-                "error_message": user_error,
-                "error_code": error_code,
-                "completed_at": "now()"
-            }).eq("id", str(job_id)).execute()
-            
-    except Exception as e:
-        # Mark as failed on exception with user-friendly error
-        error_str = str(e)
-        user_error, error_code = _get_user_friendly_error(error_str)
+        # The page count picks the queue lane and fair-share cost
+        page_count = await asyncio.to_thread(_count_pdf_pages, spool.path)
+        task = asyncio.create_task(_store_and_enqueue(
+            supabase_client, session, job_id, filename, spool, page_count, previous_document_id
+        ))
+        _background_uploads.add(task)
+        task.add_done_callback(_background_uploads.discard)
         
-        logger.exception(
-            "processing_job_exception job_id=%s filename=%s",
-            str(job_id),
-            filename,
-        )
+        return {
+            "success": True,
+            "message": "Document queued for processing",
+            "job_id": str(job_id),
+            "filename": filename
+        }
         
-        try:
-            supabase_client.table("processing_jobs").update({
-                "status": "failed",
-                "error_message": user_error,
-                "error_code": error_code,
-                "completed_at": "now()"
-            }).eq("id", str(job_id)).execute()
-        except:
-            pass  # If we can't even update the status, log it
-            print(f"[ERROR] Failed to update job status for {job_id}")
-    finally:
-        if acquired:
-            try:
-                _INGESTION_SEMAPHORE.release()
-            except Exception:
-                pass
+    except HTTPException:
+        spool.close()
+        raise
+    except Exception as e:
+        spool.close()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to queue document: {str(e)}"
+        )
 
 
-@router.post("/process", response_model=Dict[str, Any])
-async def process_document(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
+@router.post("/process-batch", response_model=Dict[str, Any])
+async def process_document_batch(
+    request: Request,
     session: Session = Depends(get_session)
 ) -> Dict[str, Any]:
     """
-    Upload and queue a document for processing.
-    Returns immediately with a job_id for status tracking.
+    Upload and queue many documents (multipart, one or more `files` parts) in one request.
+    Files are streamed to disk as the body arrives. All their jobs are created in one
+    insert under a shared batch_id; a file identical to a document the user already
+    ingested (or to an earlier file in the batch) is not processed again. Track the
+    whole batch with /batch-status/{batch_id}.
     """
-    # Validate file type
-    if not file.filename or not file.filename.lower().endswith('.pdf'):
+    content_type = request.headers.get("content-type", "")
+    if not content_type.lower().startswith("multipart/form-data"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid file type. Only PDF files are supported."
+            detail="Expected a multipart/form-data upload."
         )
     
-    if file.content_type and file.content_type != 'application/pdf':
+    # Stream every file to disk, hashing it and enforcing the size limit on the way
+    # (UploadSizeLimitMiddleware already cut off bodies far over the batch limit)
+    try:
+        uploads = await spool_multipart_files(content_type, request.stream(), MAX_BATCH_FILES, MAX_UPLOAD_BYTES)
+    except UploadTooLarge:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid file type. PDF required."
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)}MB."
         )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    # Validate file size (50MB limit)
-    MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB in bytes
-    file_content = await file.read()
-    if len(file_content) > MAX_FILE_SIZE:
+    if not uploads:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No files uploaded.")
+    invalid = [filename for filename, _ in uploads if not filename.lower().endswith('.pdf')]
+    if invalid:
+        _close_spools(uploads)
         raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail="File too large. Maximum size is 50MB."
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type. Only PDF files are supported: {', '.join(invalid)}"
         )
     
-    # Reset file pointer after reading
-    await file.seek(0)
-    
     # Initialize Supabase client
     supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
     supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
     
+    return await _queue_spooled_batch(supabase_client, session, uploads)
+
+
+async def _queue_spooled_batch(
+    supabase_client,
+    session: Session,
+    uploads: List[Tuple[str, SpooledUpload]],
+) -> Dict[str, Any]:
+    """
+    Creates the jobs for a batch of spooled PDFs in one insert and starts storing and
+    queueing them in the background. Takes ownership of the spools.
+    """
     try:
-        # Create processing job record
-        job_id = uuid.uuid4()
-        logger.info(
-            "process_document_received job_id=%s filename=%s size_bytes=%s",
-            str(job_id),
-            file.filename,
-            len(file_content),
-        )
-        job_data = {
-            "id": str(job_id),
-            "user_id": session.user_id,
-            "filename": file.filename,
-            "status": "pending",
-            "current_step": "Queued for processing...",
-            "progress_percentage": 0
-        }
+        batch_id = str(uuid.uuid4())
+        existing: Dict[str, Dict[str, Any]] = {}
+        if os.getenv("DOCUMENT_DEDUP", "1") != "0":
+            existing = await asyncio.to_thread(
+                SupabaseService(supabase_client).find_documents_by_hashes,
+                session.user_id,
+                [spool.content_hash for _, spool in uploads],
+            )
         
-        response = supabase_client.table("processing_jobs").insert(job_data).execute()
+        rows: List[Dict[str, Any]] = []
+        files: List[Dict[str, Any]] = []
+        job_for_hash: Dict[str, str] = {}
+        pending: List[Tuple[Dict[str, Any], SpooledUpload]] = []
+        for filename, spool in uploads:
+            content_hash = spool.content_hash
+            if content_hash in job_for_hash:
+                # Same file twice in the batch: both entries follow the first file's job
+                files.append({"filename": filename, "job_id": job_for_hash[content_hash], "duplicate_in_batch": True})
+                spool.close()
+                continue
+            
+            job_id = str(uuid.uuid4())
+            job_for_hash[content_hash] = job_id
+            row = {"id": job_id, "user_id": session.user_id, "batch_id": batch_id, "filename": filename, "progress_percentage": 0}
+            document = existing.get(content_hash)
+            if document:
+                rows.append({**row, **duplicate_job_fields(document)})
+                files.append({"filename": filename, "job_id": job_id, "document_id": str(document["id"]), "deduplicated": True})
+                spool.close()
+                continue
+            rows.append({**row, "status": "uploading", "current_step": "Uploading file..."})
+            files.append({"filename": filename, "job_id": job_id})
+            pending.append((row, spool))
         
+        logger.info(
+            "process_batch_received batch_id=%s files=%s new_jobs=%s size_bytes=%s",
+            batch_id,
+            len(uploads),
+            len(pending),
+            sum(spool.size for _, spool in pending),
+        )
+        # Deduplicated rows set more columns than new ones (dedup_hit, document_id, ...); a bulk
+        # insert sends the union of the keys, so unset ones must keep their defaults, not become NULL.
+        response = await asyncio.to_thread(
+            supabase_client.table("processing_jobs").insert(rows, default_to_null=False).execute
+        )
         if not response.data:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to create processing job"
+                detail="Failed to create processing jobs"
             )
+        for row in rows:
+            _remember_owner(row["id"], session.user_id)
         
-        # Queue background processing
-        background_tasks.add_task(
-            _process_document_background,
-            job_id=job_id,
-            pdf_bytes=file_content,
-            user_id=uuid.UUID(session.user_id),
-            filename=file.filename,
-            doc_type=file.filename.split('.')[-1],
-            token=session.token
+        # The page counts pick each job's queue lane and fair-share cost
+        page_counts = await asyncio.gather(
+            *(asyncio.to_thread(_count_pdf_pages, spool.path) for _, spool in pending)
         )
+        semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+        
+        async def store_and_enqueue(row: Dict[str, Any], spool: SpooledUpload, page_count: Optional[int]) -> None:
+            async with semaphore:
+                await _store_and_enqueue(
+                    supabase_client, session, uuid.UUID(row["id"]), row["filename"], spool, page_count, None
+                )
+        
+        async def store_batch() -> None:
+            await asyncio.gather(
+                *(store_and_enqueue(row, spool, page_count) for (row, spool), page_count in zip(pending, page_counts))
+            )
+        
+        task = asyncio.create_task(store_batch())
+        _background_uploads.add(task)
+        task.add_done_callback(_background_uploads.discard)
         
         return {
             "success": True,
-            "message": "Document queued for processing",
-            "job_id": str(job_id),
-            "filename": file.filename
+            "message": f"{len(files)} documents queued for processing",
+            "batch_id": batch_id,
+            "files": files
         }
         
     except HTTPException:
+        _close_spools(uploads)
         raise
     except Exception as e:
+        _close_spools(uploads)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to queue document: {str(e)}"
+            detail=f"Failed to queue documents: {str(e)}"
+        )
+
+
+def _close_spools(uploads: List[Tuple[str, SpooledUpload]]) -> None:
+    for _, spool in uploads:
+        spool.close()
+
+
+async def _store_and_enqueue(
+    supabase_client,
+    session: Session,
+    job_id: uuid.UUID,
+    filename: str,
+    spool: SpooledUpload,
+    page_count: Optional[int],
+    previous_document_id: Optional[str],
+) -> None:
+    """
+    Stores a spooled PDF so any worker can pick the job up, even after a restart, then queues the job.
+
+    The upload has to finish before the job is queued: a queued job can be claimed by
+    a worker on any host, or after this process restarts, and must never point at a
+    file that is not in storage yet. An embedded worker in this process gets the
+    spool handed over, so only standalone workers download the file again.
+    """
+    progress_writer = get_progress_writer()
+    kept_locally = False
+    
+    def report_upload(bytes_done: int, total_bytes: int) -> None:
+        progress_writer.write(supabase_client, job_id, {
+            "current_step": f"Uploading file ({bytes_done * 100 // max(total_bytes, 1)}%)..."
+        })
+    
+    try:
+        storage_path = await asyncio.to_thread(
+            SupabaseService(supabase_client).upload_pdf_to_storage,
+            spool.path,
+            uuid.UUID(session.user_id),
+            job_id,
+            filename,
+            report_upload,
+        )
+        if not storage_path:
+            logger.error("process_document_upload_failed job_id=%s filename=%s", str(job_id), filename)
+            await progress_writer.write_now(supabase_client, job_id, {
+                "status": "failed",
+                "error_message": "Failed to store the uploaded file. Please try again.",
+                "error_code": "upload_failed",
+                "completed_at": "now()"
+            })
+            return
+        
+        # Written before the job is queued so a fast worker's progress is never overwritten.
+        # The page count is kept on the job so a retry can re-enqueue it in the same lane.
+        await progress_writer.write_now(supabase_client, job_id, {
+            "status": "pending",
+            "current_step": "Queued for processing...",
+            "page_count": page_count
+        })
+        if os.getenv("INGESTION_EMBEDDED_WORKERS", "1") != "0":
+            keep_local_payload(storage_path, spool)
+            kept_locally = True
+        await _enqueue_job(
+            supabase_client,
+            job_id=str(job_id),
+            user_id=session.user_id,
+            filename=filename,
+            payload_path=storage_path,
+            page_count=page_count,
+            previous_document_id=previous_document_id
         )
+    except Exception as e:
+        logger.exception("process_document_enqueue_failed job_id=%s", str(job_id))
+        if kept_locally and take_local_payload(storage_path) is not None:
+            kept_locally = False  # never queued, so no worker will take it
+        try:
+            await progress_writer.write_now(supabase_client, job_id, {
+                "status": "failed",
+                "error_message": "Failed to queue the document. Please try again.",
+                "error_code": "enqueue_failed",
+                "completed_at": "now()"
+            })
+        except Exception:
+            logger.error("process_document_mark_failed_failed job_id=%s error=%s", str(job_id), e)
+    finally:
+        if not kept_locally:
+            spool.close()
+
+
+async def drain_background_uploads(timeout: float = 30.0) -> None:
+    """Waits (up to `timeout` seconds) for uploads still being stored, e.g. at shutdown."""
+    if _background_uploads:
+        await asyncio.wait(list(_background_uploads), timeout=timeout)
+
+
+def _job_queue_for(supabase_client):
+    """Ingestion queue for a request; the postgres backend writes as the uploader (RLS)."""
+    if os.getenv("INGESTION_QUEUE_BACKEND", "sqlite").strip().lower() == "postgres":
+        return get_job_queue(supabase_client)
+    return get_job_queue()
+
+
+async def _check_previous_version(supabase_client, previous_document_id: str, user_id: str) -> None:
+    """Rejects a `previous_document_id` that is not one of the user's completed documents."""
+    try:
+        uuid.UUID(previous_document_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid previous_document_id")
+    response = await asyncio.to_thread(
+        supabase_client.table("documents")
+        .select("id")
+        .eq("id", previous_document_id)
+        .eq("user_id", user_id)
+        .in_("status", list(SupabaseService.COMPLETED_STATUSES))
+        .limit(1)
+        .execute
+    )
+    if not response.data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Previous document version not found or not yet processed"
+        )
+
+
+def _count_pdf_pages(pdf_path: str) -> Optional[int]:
+    """Page count of an uploaded PDF, or None if it cannot be opened (the worker reports the error)."""
+    try:
+        with pymupdf.open(pdf_path, filetype="pdf") as pdf_document:
+            return pdf_document.page_count
+    except Exception:
+        return None
+
+
+async def _enqueue_job(
+    supabase_client,
+    job_id: str,
+    user_id: str,
+    filename: str,
+    payload_path: str,
+    page_count: Optional[int] = None,
+    previous_document_id: Optional[str] = None,
+) -> None:
+    """Puts a job on the ingestion queue."""
+    job_queue = _job_queue_for(supabase_client)
+    await asyncio.to_thread(
+        job_queue.enqueue,
+        job_id,
+        user_id,
+        filename,
+        filename.split('.')[-1],
+        payload_path,
+        page_count,
+        previous_document_id,
+    )
 
 
 @router.get("/processing-status/{job_id}", response_model=Dict[str, Any])
 async def get_processing_status(
     job_id: str,
+    since: Optional[int] = Query(None, ge=0, description="Long-poll: wait for a progress version newer than this."),
+    wait: float = Query(25.0, ge=0, le=60, description="Long-poll: seconds to wait for a newer version."),
     session: Session = Depends(get_session)
 ) -> Dict[str, Any]:
     """
     Get the current status of a document processing job.
-    Used by frontend to poll progress after upload.
+    Without `since`, returns the stored job row. With `since`, long-polls: returns as
+    soon as the job's progress version passes `since` (or after `wait` seconds with
+    the current state); pass back the returned `version` on the next call.
+    Prefer /processing-events/{job_id}, which streams every update over one request.
     """
     supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
     supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
     
     try:
-        response = supabase_client.table("processing_jobs")\
-            .select("*")\
-            .eq("id", job_id)\
-            .eq("user_id", session.user_id)\
-            .single()\
-            .execute()
+        if since is not None:
+            if _job_owners.get(job_id) != session.user_id:
+                row = await _fetch_job_row(supabase_client, job_id, session.user_id)
+                if row is None:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="Processing job not found"
+                    )
+            
+            bus = get_progress_bus()
+            deadline = time.monotonic() + wait
+            event = await _publish_stored_progress(supabase_client, job_id, session.user_id)
+            while event is None or event["version"] <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Jobs run by another process only reach this bus through their stored row
+                event = await bus.wait_for(job_id, since, timeout=min(remaining, PROGRESS_FALLBACK_POLL_SECONDS))
+                if event is None:
+                    event = await _publish_stored_progress(supabase_client, job_id, session.user_id)
+            if event is not None:
+                return _progress_payload(event)
         
-        if not response.data:
+        row = await _fetch_job_row(supabase_client, job_id, session.user_id)
+        
+        if not row:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Processing job not found"
             )
         
-        return response.data
+        return {**row, "version": since or 0}
         
     except HTTPException:
         raise
@@ -383,27 +573,219 @@ async def get_processing_status(
         )
 
 
+@router.get("/batch-status/{batch_id}", response_model=Dict[str, Any])
+async def get_batch_status(
+    batch_id: str,
+    session: Session = Depends(get_session)
+) -> Dict[str, Any]:
+    """
+    Get the combined status of a batch upload (one query over its jobs).
+    `progress_percentage` averages the jobs, counting finished ones as 100; `done`
+    is true once every job has completed or failed.
+    """
+    try:
+        uuid.UUID(batch_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid batch_id")
+    
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
+    
+    try:
+        response = await asyncio.to_thread(
+            supabase_client.table("processing_jobs")
+            .select("id, filename, status, current_step, progress_percentage, document_id, error_message, error_code")
+            .eq("batch_id", batch_id)
+            .eq("user_id", session.user_id)
+            .order("created_at")
+            .execute
+        )
+        jobs = response.data or []
+        if not jobs:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Batch not found"
+            )
+        
+        counts: Dict[str, int] = {}
+        for job in jobs:
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+            _remember_owner(job["id"], session.user_id)
+        finished = sum(counts.get(job_status, 0) for job_status in TERMINAL_STATUSES)
+        progress = sum(
+            100 if job["status"] in TERMINAL_STATUSES else (job.get("progress_percentage") or 0) for job in jobs
+        )
+        
+        return {
+            "batch_id": batch_id,
+            "total": len(jobs),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "in_progress": len(jobs) - finished,
+            "status_counts": counts,
+            "progress_percentage": round(progress / len(jobs)),
+            "done": finished == len(jobs),
+            "jobs": jobs
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch batch status: {str(e)}"
+        )
+
+
+@router.get("/processing-events/{job_id}")
+async def stream_processing_events(
+    job_id: str,
+    session: Session = Depends(get_session)
+) -> StreamingResponse:
+    """
+    Stream a processing job's progress as Server-Sent Events.
+    Sends the current state, then one `progress` event per change, and closes once
+    the job completes or fails. Jobs processed in this process push every update
+    straight from the pipeline; for jobs run by any other process (a standalone
+    worker or another uvicorn worker) the job row is re-read every
+    PROGRESS_FALLBACK_POLL_SECONDS without a newer event.
+    """
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
+    
+    row = await _fetch_job_row(supabase_client, job_id, session.user_id)
+    if row is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Processing job not found"
+        )
+    
+    return StreamingResponse(
+        _progress_event_stream(supabase_client, job_id, session.user_id, row),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _fetch_job_row(supabase_client, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """Reads a user's processing_jobs row (None if missing) and remembers its owner."""
+    query = supabase_client.table("processing_jobs")\
+        .select("*")\
+        .eq("id", job_id)\
+        .eq("user_id", user_id)\
+        .limit(1)
+    response = await asyncio.to_thread(query.execute)
+    if not response.data:
+        return None
+    _remember_owner(job_id, user_id)
+    return response.data[0]
+
+
+def _progress_fields(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: event.get(key) for key in EVENT_FIELDS}
+
+
+def _progress_payload(event: ProgressEvent) -> Dict[str, Any]:
+    """Full client-facing snapshot of a progress event."""
+    return {**_progress_fields(event), "job_id": event["job_id"], "version": event["version"]}
+
+
+async def _progress_event_stream(
+    supabase_client,
+    job_id: str,
+    user_id: str,
+    row: Dict[str, Any]
+) -> AsyncIterator[str]:
+    """Formats job progress as SSE frames until the job reaches a terminal status."""
+    bus = get_progress_bus()
+    if not bus.is_local(job_id):
+        bus.publish(job_id, _progress_fields(row))
+    current: ProgressEvent = bus.latest(job_id) or {**_progress_fields(row), "job_id": job_id, "version": 0}
+    since = current["version"]
+    
+    while True:
+        yield f"id: {current['version']}\nevent: progress\ndata: {json.dumps(_progress_payload(current), default=str)}\n\n"
+        if current.get("status") in TERMINAL_STATUSES:
+            return
+        
+        while True:
+            event = await bus.wait_for(job_id, since, timeout=PROGRESS_FALLBACK_POLL_SECONDS)
+            if event is None:
+                event = await _publish_stored_progress(supabase_client, job_id, user_id)
+            if event is not None and event["version"] > since:
+                current = event
+                since = event["version"]
+                break
+            yield ": keepalive\n\n"
+
+
+async def _publish_stored_progress(supabase_client, job_id: str, user_id: str) -> Optional[ProgressEvent]:
+    """
+    Publishes the stored job row to this process's progress bus unless the job is
+    processed here (then the bus is already ahead of the row); returns the latest event.
+    """
+    bus = get_progress_bus()
+    if not bus.is_local(job_id):
+        row = await _fetch_job_row(supabase_client, job_id, user_id)
+        if row is not None:
+            bus.publish(job_id, _progress_fields(row))
+    return bus.latest(job_id)
+
+
+@router.get("/queue-stats", response_model=Dict[str, Any])
+async def get_queue_stats(
+    session: Session = Depends(get_session)
+) -> Dict[str, Any]:
+    """
+    Get the caller's ingestion queue depth and wait times.
+    Jobs are scheduled fairly across users, so this reflects the caller's own backlog.
+    """
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
+    
+    try:
+        job_queue = _job_queue_for(supabase_client)
+        tenant_stats = await asyncio.to_thread(job_queue.tenant_stats, session.user_id)
+        own = tenant_stats[0] if tenant_stats else {
+            "user_id": session.user_id,
+            "weight": 1,
+            "queued": 0,
+            "leased": 0,
+            "oldest_wait_seconds": 0.0,
+            "avg_wait_seconds": None
+        }
+        return {
+            **own,
+            "small_doc_pages": job_queue.small_doc_pages
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch queue stats: {str(e)}"
+        )
+
+
 @router.post("/retry/{job_id}", response_model=Dict[str, Any])
 async def retry_failed_job(
-    background_tasks: BackgroundTasks,
     job_id: str,
     session: Session = Depends(get_session)
 ) -> Dict[str, Any]:
     """
     Retry a failed processing job.
-    Fetches the original file from storage and re-processes it.
+    Re-queues the job with the PDF already in storage.
     """
     supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
     supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
     
     try:
         # Get the failed job
-        job_response = supabase_client.table("processing_jobs")\
+        job_query = supabase_client.table("processing_jobs")\
             .select("*")\
             .eq("id", job_id)\
             .eq("user_id", session.user_id)\
-            .single()\
-            .execute()
+            .single()
+        job_response = await asyncio.to_thread(job_query.execute)
         
         if not job_response.data:
             raise HTTPException(
@@ -420,33 +802,20 @@ async def retry_failed_job(
                 detail=f"Cannot retry job with status: {job_data['status']}"
             )
         
-        # If document_id exists, get the file from storage
-        if job_data.get("document_id"):
-            doc_response = supabase_client.table("documents")\
-                .select("storage_path")\
-                .eq("id", job_data["document_id"])\
-                .single()\
-                .execute()
-            
-            if doc_response.data and doc_response.data.get("storage_path"):
-                # Download file from storage
-                storage_path = doc_response.data["storage_path"]
-                file_data = supabase_client.storage.from_("financial-pdfs").download(storage_path)
-                pdf_bytes = file_data
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Original file not found in storage. Please re-upload."
-                )
-        else:
+        # Find the stored PDF: the queued payload, else the saved document's file
+        storage_path = await _find_stored_pdf(supabase_client, job_data)
+        if not storage_path:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cannot retry - original file not found. Please re-upload."
             )
         
+        # Pages annotated by earlier attempts are checkpointed; the retry only annotates the rest
+        pages_reused = await asyncio.to_thread(SupabaseService(supabase_client).count_page_checkpoints, job_id)
+        
         # Reset job status for retry
         retry_count = job_data.get("retry_count", 0) + 1
-        supabase_client.table("processing_jobs").update({
+        await update_processing_job(supabase_client, job_id, {
             "status": "pending",
             "current_step": "Retrying...",
             "progress_percentage": 0,
@@ -454,24 +823,27 @@ async def retry_failed_job(
             "error_message": None,
             "error_code": None,
             "updated_at": "now()"
-        }).eq("id", job_id).execute()
-        
-        # Queue for reprocessing
-        background_tasks.add_task(
-            _process_document_background,
-            job_id=uuid.UUID(job_id),
-            pdf_bytes=pdf_bytes,
-            user_id=uuid.UUID(session.user_id),
-            filename=job_data["filename"],
-            doc_type=job_data["filename"].split('.')[-1],
-            token=session.token
-        )
+        })
+        
+        # Queue for reprocessing: reset the finished queue entry, or add one if it is gone
+        job_queue = _job_queue_for(supabase_client)
+        if not await asyncio.to_thread(job_queue.reenqueue, job_id, session.user_id):
+            await _enqueue_job(
+                supabase_client,
+                job_id=job_id,
+                user_id=session.user_id,
+                filename=job_data["filename"],
+                payload_path=storage_path,
+                page_count=job_data.get("page_count"),
+                previous_document_id=job_data.get("previous_document_id")
+            )
         
         return {
             "success": True,
             "message": "Job queued for retry",
             "job_id": job_id,
-            "retry_count": retry_count
+            "retry_count": retry_count,
+            "pages_reused": pages_reused
         }
         
     except HTTPException:
@@ -480,4 +852,22 @@ async def retry_failed_job(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to retry job: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+async def _find_stored_pdf(supabase_client, job_data: Dict[str, Any]) -> Optional[str]:
+    """Storage path of a job's PDF, or None if it is no longer available."""
+    job_queue = _job_queue_for(supabase_client)
+    queued = await asyncio.to_thread(job_queue.get, str(job_data["id"]))
+    if queued and queued.get("payload_path"):
+        return queued["payload_path"]
+    
+    if job_data.get("document_id"):
+        doc_query = supabase_client.table("documents")\
+            .select("storage_path")\
+            .eq("id", job_data["document_id"])\
+            .single()
+        doc_response = await asyncio.to_thread(doc_query.execute)
+        if doc_response.data and doc_response.data.get("storage_path"):
+            return doc_response.data["storage_path"]
+    return None
@@ -27,6 +27,7 @@ async def list_documents(session: Session = Depends(get_session)) -> List[Docume
         client.table("documents")
         .select("id, filename, user_id")
         .eq("user_id", session.user_id)
+        .not_.in_("status", ["staging", "superseded"])  # in-flight and replaced document versions
         .execute()
     )
     
@@ -0,0 +1,103 @@
+from typing import Dict, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.storage.UploadSpool import MAX_BATCH_FILES, MAX_UPLOAD_BYTES
+
+# Room for multipart boundaries, part headers and small form fields around the file.
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects oversize request bodies on upload routes with 413 while they stream in.
+
+    The upload endpoints stream `request.stream()` into spool files and stop each
+    file at MAX_UPLOAD_BYTES themselves; this guards the request as a whole. A
+    Content-Length over the route's limit is rejected before any of the body is
+    read, so the endpoint never starts spooling it. Bodies without one (chunked)
+    are counted and cut off as soon as they pass the limit, which also bounds the
+    total size of a batch.
+    """
+
+    def __init__(self, app: ASGIApp, limits: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            app: The wrapped application.
+            limits: Path suffix -> maximum body bytes for POSTs to matching paths
+                (default: /documents/process at MAX_UPLOAD_BYTES plus multipart overhead,
+                /documents/process-batch at MAX_BATCH_FILES times that).
+        """
+        self.app = app
+        self.limits = limits or {
+            "/documents/process": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+            "/documents/process-batch": MAX_BATCH_FILES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES),
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = self._limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope.get("headers") or []).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+
+        received = 0
+        rejected = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    rejected = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            if rejected:
+                return  # the app's error response for the aborted body is replaced by the 413
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+        if rejected and not response_started:
+            await self._reject(scope, receive, send, limit)
+
+    def _limit_for(self, scope: Scope) -> Optional[int]:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return None
+        path = scope["path"].rstrip("/")
+        for suffix, limit in self.limits.items():
+            if path.endswith(suffix):
+                return limit
+        return None
+
+    @staticmethod
+    async def _reject(scope: Scope, receive: Receive, send: Send, limit: int) -> None:
+        if limit > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+            detail = f"Upload too large. Maximum request size is {limit // (1024 * 1024)}MB."
+        else:
+            detail = f"File too large. Maximum size is {MAX_UPLOAD_BYTES // (1024 * 1024)}MB."
+        response = JSONResponse(
+            {"detail": detail},
+            status_code=413,
+            headers={"Connection": "close"},
+        )
+        await response(scope, receive, send)
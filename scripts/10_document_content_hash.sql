@@ -0,0 +1,14 @@
+-- Whole-document deduplication
+-- documents.content_hash is the SHA-256 of the uploaded PDF. Uploading a file the
+-- user has already ingested completes the new processing job against the existing
+-- document (processing_jobs.dedup_hit = true) without parsing or LLM calls.
+
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE INDEX IF NOT EXISTS documents_user_content_hash_idx
+    ON public.documents (user_id, content_hash)
+    WHERE content_hash IS NOT NULL;
+
+ALTER TABLE public.processing_jobs ADD COLUMN IF NOT EXISTS dedup_hit BOOLEAN NOT NULL DEFAULT false;
+
+SELECT 'Document content hash added successfully!' AS status;
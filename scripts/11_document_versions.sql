@@ -0,0 +1,187 @@
+-- Incremental re-ingestion of revised documents
+-- Run after 10_document_content_hash.sql.
+-- A revised file is ingested as a new 'staging' document that points at the
+-- version it replaces. Pages whose fingerprint (document_pages.page_hash) is
+-- unchanged reuse the previous version's annotation, and chunks whose text is
+-- unchanged reuse its embeddings. When the new version is complete,
+-- swap_document_version makes it live and retires the old one in one transaction,
+-- so search never sees both versions, or neither.
+
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS previous_version_id UUID REFERENCES public.documents(id) ON DELETE SET NULL;
+ALTER TABLE public.documents ADD COLUMN IF NOT EXISTS superseded_by UUID REFERENCES public.documents(id) ON DELETE SET NULL;
+
+CREATE TABLE IF NOT EXISTS public.document_pages (
+    document_id UUID NOT NULL REFERENCES public.documents(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL, -- 1-based, as in the "--- Page N Start ---" markers
+    page_hash TEXT NOT NULL,      -- SHA-256 of the page text and a low-resolution render
+    PRIMARY KEY (document_id, page_number)
+);
+
+ALTER TABLE public.document_pages ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can select their own document pages"
+    ON public.document_pages FOR SELECT
+    TO authenticated USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can insert their own document pages"
+    ON public.document_pages FOR INSERT
+    TO authenticated WITH CHECK (auth.uid() = user_id);
+
+ALTER TABLE public.ingestion_queue ADD COLUMN IF NOT EXISTS previous_document_id UUID;
+
+-- Search skips staged versions: their chunks are written before the swap.
+CREATE OR REPLACE FUNCTION match_chunks (
+  query_embedding vector(1536),
+  match_count int,
+  user_id uuid,
+  p_doc_specific_type text DEFAULT NULL,
+  p_company_name text DEFAULT NULL,
+  p_doc_year_start integer DEFAULT NULL,
+  p_doc_year_end integer DEFAULT NULL,
+  p_doc_quarter integer DEFAULT NULL,
+  p_report_date date DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  chunk_text text,
+  document_id uuid,
+  section_id uuid,
+  section_heading text,
+  chunk_index integer,
+  doc_specific_type text,
+  doc_year integer,
+  doc_quarter integer,
+  company_name text,
+  report_date date,
+  similarity_score float,
+  document_filename text
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT
+    c.id,
+    c.chunk_text,
+    c.document_id,
+    c.section_id,
+    c.section_heading,
+    c.chunk_index,
+    c.doc_specific_type,
+    c.doc_year,
+    c.doc_quarter,
+    c.company_name,
+    c.report_date,
+    (c.embedding <=> query_embedding) as similarity_score,
+    d.filename AS document_filename
+  FROM
+    chunks AS c
+  JOIN
+    documents AS d ON c.document_id = d.id
+  WHERE
+    c.user_id = match_chunks.user_id
+    AND d.status <> 'staging'
+    AND (p_doc_specific_type IS NULL OR c.doc_specific_type = p_doc_specific_type)
+    AND (
+      p_company_name IS NULL
+      OR trim(p_company_name) = ''
+      OR c.company_name ILIKE '%' || p_company_name || '%'
+    )
+    AND (p_doc_year_start IS NULL OR c.doc_year >= p_doc_year_start)
+    AND (p_doc_year_end IS NULL OR c.doc_year <= p_doc_year_end)
+    AND (p_doc_quarter IS NULL OR c.doc_quarter = p_doc_quarter)
+    AND (p_report_date IS NULL OR c.report_date = p_report_date)
+  ORDER BY
+    c.embedding <=> query_embedding
+  LIMIT
+    match_count;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION get_chunks_for_sections (
+  p_section_ids uuid[],
+  p_user_id uuid
+)
+RETURNS TABLE (
+  id uuid,
+  chunk_text text,
+  document_id uuid,
+  section_id uuid,
+  section_heading text,
+  chunk_index integer,
+  doc_specific_type text,
+  doc_year integer,
+  doc_quarter integer,
+  company_name text,
+  report_date date,
+  document_filename text
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT
+    c.id,
+    c.chunk_text,
+    c.document_id,
+    c.section_id,
+    c.section_heading,
+    c.chunk_index,
+    c.doc_specific_type,
+    c.doc_year,
+    c.doc_quarter,
+    c.company_name,
+    c.report_date,
+    d.filename AS document_filename
+  FROM
+    chunks AS c
+  JOIN
+    documents AS d ON c.document_id = d.id
+  WHERE
+    c.user_id = p_user_id
+    AND d.status <> 'staging'
+    AND c.section_id = ANY(p_section_ids)
+  ORDER BY
+    c.document_id, c.section_id, c.chunk_index;
+END;
+$$;
+
+-- Makes a staged version live and retires the one it replaces. Runs with the
+-- caller's rights, so RLS limits it to the caller's own documents.
+CREATE OR REPLACE FUNCTION swap_document_version(
+    p_previous_document_id UUID,
+    p_document_id UUID,
+    p_status TEXT
+)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Lock the old version so two revisions of it cannot both be swapped in.
+    PERFORM 1 FROM public.documents
+    WHERE id = p_previous_document_id AND superseded_by IS NULL
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    UPDATE public.documents SET status = p_status
+    WHERE id = p_document_id AND status = 'staging';
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    DELETE FROM public.chunks WHERE document_id = p_previous_document_id;
+    DELETE FROM public.sections WHERE document_id = p_previous_document_id;
+    DELETE FROM public.income_statement_summaries WHERE document_id = p_previous_document_id;
+
+    UPDATE public.documents
+    SET status = 'superseded', superseded_by = p_document_id
+    WHERE id = p_previous_document_id;
+
+    RETURN TRUE;
+END;
+$$;
+
+SELECT 'Document versions created successfully!' AS status;
@@ -0,0 +1,40 @@
+-- Page-level checkpoints for processing jobs
+-- Run after 11_document_versions.sql.
+-- Each page's annotation is saved here as soon as it succeeds. Retrying a failed
+-- job (or a worker re-running it after a crash) reuses every checkpointed page whose
+-- fingerprint still matches and only annotates the missing or failed ones. Rows
+-- are deleted when the job's document is saved.
+
+CREATE TABLE IF NOT EXISTS public.processing_job_pages (
+    job_id UUID NOT NULL REFERENCES public.processing_jobs(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL, -- 1-based
+    page_hash TEXT NOT NULL,      -- same fingerprint as document_pages.page_hash
+    markdown TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (job_id, page_number)
+);
+
+ALTER TABLE public.processing_job_pages ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view own processing job pages"
+    ON public.processing_job_pages
+    FOR SELECT
+    USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can create own processing job pages"
+    ON public.processing_job_pages
+    FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+CREATE POLICY "Users can update own processing job pages"
+    ON public.processing_job_pages
+    FOR UPDATE
+    USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can delete own processing job pages"
+    ON public.processing_job_pages
+    FOR DELETE
+    USING (auth.uid() = user_id);
+
+SELECT 'Processing job pages created successfully!' AS status;
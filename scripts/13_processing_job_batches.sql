@@ -0,0 +1,14 @@
+-- Batch uploads
+-- Run after 12_processing_job_pages.sql.
+-- POST /documents/process-batch creates one processing job per file, all sharing
+-- a batch_id, so /documents/batch-status/{batch_id} can report the whole batch
+-- from a single query.
+
+ALTER TABLE public.processing_jobs
+    ADD COLUMN IF NOT EXISTS batch_id UUID; -- NULL for single-file uploads
+
+CREATE INDEX IF NOT EXISTS idx_processing_jobs_batch_id
+    ON public.processing_jobs(batch_id)
+    WHERE batch_id IS NOT NULL;
+
+SELECT 'Processing job batches set up successfully!' AS status;
@@ -0,0 +1,76 @@
+-- Cluster-wide coordination (COORDINATION_BACKEND=postgres)
+-- Run after 13_processing_job_batches.sql.
+-- Lets every API and worker process share ingestion/page concurrency caps
+-- (INGESTION_CLUSTER_CONCURRENCY, PAGE_CLUSTER_CONCURRENCY) and LLM rate
+-- limiter budgets. Only the service role uses these tables.
+
+-- One row per held semaphore slot; a slot whose lease expires is free again,
+-- so a crashed worker's slots return on their own.
+CREATE TABLE IF NOT EXISTS public.coordination_slots (
+    name TEXT NOT NULL, -- semaphore name, e.g. ingestion
+    slot INTEGER NOT NULL, -- 0 .. limit-1
+    holder TEXT NOT NULL, -- worker id or host:pid
+    expires_at TIMESTAMPTZ NOT NULL,
+    acquired_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (name, slot)
+);
+
+-- Shared state documents (rate limiter buckets), updated with compare-and-swap on version.
+CREATE TABLE IF NOT EXISTS public.coordination_state (
+    name TEXT PRIMARY KEY, -- e.g. rate-gemini-gemini-2.0-flash
+    state JSONB NOT NULL DEFAULT '{}'::jsonb,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- RLS with no policies: only the service role can read or write.
+ALTER TABLE public.coordination_slots ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.coordination_state ENABLE ROW LEVEL SECURITY;
+
+-- Takes the lowest free slot of semaphore p_name, or returns NULL when all p_limit
+-- slots are held. Leases are rows rather than session advisory locks because
+-- PostgREST pools connections; the transaction-scoped advisory lock only
+-- serialises concurrent acquires of the same semaphore.
+CREATE OR REPLACE FUNCTION acquire_coordination_slot(
+    p_name TEXT,
+    p_limit INTEGER,
+    p_holder TEXT,
+    p_ttl_seconds INTEGER
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_slot INTEGER;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('coordination_slot:' || p_name));
+
+    SELECT s INTO v_slot
+    FROM generate_series(0, p_limit - 1) AS s
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM public.coordination_slots c
+        WHERE c.name = p_name
+          AND c.slot = s
+          AND c.expires_at > now()
+    )
+    ORDER BY s
+    LIMIT 1;
+
+    IF v_slot IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO public.coordination_slots (name, slot, holder, expires_at, acquired_at)
+    VALUES (p_name, v_slot, p_holder, now() + make_interval(secs => p_ttl_seconds), now())
+    ON CONFLICT (name, slot) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        expires_at = EXCLUDED.expires_at,
+        acquired_at = EXCLUDED.acquired_at;
+
+    RETURN v_slot;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION acquire_coordination_slot(TEXT, INTEGER, TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+
+SELECT 'Cluster coordination set up successfully!' AS status;
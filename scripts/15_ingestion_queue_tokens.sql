@@ -0,0 +1,10 @@
+-- Stop storing uploader tokens on queued ingestion jobs
+-- Run after 14_cluster_coordination.sql.
+-- Workers now always run with the service role and process each job for its
+-- user_id, so the uploader JWTs kept in ingestion_queue.auth_token (which could
+-- expire while a job waited and sat in the table in plaintext) are dropped.
+
+UPDATE public.ingestion_queue SET auth_token = NULL WHERE auth_token IS NOT NULL;
+ALTER TABLE public.ingestion_queue DROP COLUMN IF EXISTS auth_token;
+
+SELECT 'Ingestion queue tokens removed successfully!' AS status;
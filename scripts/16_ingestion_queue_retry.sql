@@ -0,0 +1,50 @@
+-- Retries go through a function instead of a row-level UPDATE policy
+-- Run after 15_ingestion_queue_tokens.sql.
+-- "Users can re-enqueue own jobs" let users rewrite any column of their own
+-- queue rows (page_count, status, attempts, available_at, leases), e.g. to jump
+-- the fair-share queue. Users may now only insert fresh queued rows and reset a
+-- finished job of their own through reenqueue_ingestion_job.
+
+DROP POLICY IF EXISTS "Users can re-enqueue own jobs" ON public.ingestion_queue;
+
+DROP POLICY IF EXISTS "Users can enqueue own jobs" ON public.ingestion_queue;
+CREATE POLICY "Users can enqueue own jobs"
+    ON public.ingestion_queue
+    FOR INSERT
+    WITH CHECK (
+        auth.uid() = user_id
+        AND status = 'queued'
+        AND attempts = 0
+        AND lease_owner IS NULL
+        AND lease_expires_at IS NULL
+    );
+
+-- Resets the caller's finished (done or failed) job back to queued; returns false
+-- when the caller has no such job. Only queue bookkeeping columns are reset.
+CREATE OR REPLACE FUNCTION reenqueue_ingestion_job(p_job_id UUID)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    UPDATE public.ingestion_queue
+    SET status = 'queued',
+        attempts = 0,
+        available_at = now(),
+        enqueued_at = now(),
+        lease_owner = NULL,
+        lease_expires_at = NULL,
+        claimed_at = NULL,
+        last_error = NULL
+    WHERE id = p_job_id
+      AND user_id = auth.uid()
+      AND status IN ('done', 'failed');
+    RETURN FOUND;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION reenqueue_ingestion_job(UUID) FROM PUBLIC, anon;
+GRANT EXECUTE ON FUNCTION reenqueue_ingestion_job(UUID) TO authenticated;
+
+SELECT 'Ingestion queue retry function created successfully!' AS status;
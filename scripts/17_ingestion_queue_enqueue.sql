@@ -0,0 +1,55 @@
+-- Enqueues go through a function instead of a row-level INSERT policy
+-- Run after 16_ingestion_queue_retry.sql.
+-- "Users can enqueue own jobs" only checked user_id and the queue bookkeeping
+-- columns, so a user could queue any payload_path, e.g. another user's
+-- '{user_id}/...' object, and the service-role worker would ingest it into the
+-- caller's account (and delete it on a dedup hit). Users may now only enqueue
+-- through enqueue_ingestion_job, which checks the payload and previous version
+-- belong to the caller and sets everything else server-side.
+
+DROP POLICY IF EXISTS "Users can enqueue own jobs" ON public.ingestion_queue;
+
+-- Queues the caller's processing job `p_job_id` for the PDF at `p_payload_path`
+-- (which must sit in the caller's '{user_id}/' storage folder). `p_page_count`
+-- only picks the queue lane and fair-share cost, and is clamped to at least 1.
+CREATE OR REPLACE FUNCTION enqueue_ingestion_job(
+    p_job_id UUID,
+    p_filename TEXT,
+    p_doc_type TEXT,
+    p_payload_path TEXT,
+    p_page_count INTEGER DEFAULT NULL,
+    p_previous_document_id UUID DEFAULT NULL
+)
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    v_user_id UUID := auth.uid();
+BEGIN
+    IF v_user_id IS NULL THEN
+        RAISE EXCEPTION 'Not authenticated' USING ERRCODE = '42501';
+    END IF;
+    IF p_payload_path NOT LIKE v_user_id::text || '/%' OR p_payload_path LIKE '%..%' THEN
+        RAISE EXCEPTION 'Payload must be in the caller''s storage folder' USING ERRCODE = '42501';
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM public.processing_jobs j WHERE j.id = p_job_id AND j.user_id = v_user_id) THEN
+        RAISE EXCEPTION 'Processing job not found' USING ERRCODE = '42501';
+    END IF;
+    IF p_previous_document_id IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM public.documents d WHERE d.id = p_previous_document_id AND d.user_id = v_user_id) THEN
+        RAISE EXCEPTION 'Previous document not found' USING ERRCODE = '42501';
+    END IF;
+
+    -- status, attempts, max_attempts, leases and timestamps take their column defaults
+    INSERT INTO public.ingestion_queue (id, user_id, filename, doc_type, payload_path, page_count, previous_document_id)
+    VALUES (p_job_id, v_user_id, p_filename, p_doc_type, p_payload_path,
+            GREATEST(COALESCE(p_page_count, 1), 1), p_previous_document_id);
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION enqueue_ingestion_job(UUID, TEXT, TEXT, TEXT, INTEGER, UUID) FROM PUBLIC, anon;
+GRANT EXECUTE ON FUNCTION enqueue_ingestion_job(UUID, TEXT, TEXT, TEXT, INTEGER, UUID) TO authenticated;
+
+SELECT 'Ingestion queue enqueue function created successfully!' AS status;
@@ -0,0 +1,13 @@
+-- Keep what a job was queued with on its processing job
+-- Run after 17_ingestion_queue_enqueue.sql.
+-- A retry whose ingestion_queue row is gone re-enqueues the job from its
+-- processing_jobs row. Without these columns a retried new version was queued
+-- as a standalone document (so the old version stayed live next to it) and in
+-- the default queue lane.
+
+ALTER TABLE public.processing_jobs
+    ADD COLUMN IF NOT EXISTS previous_document_id UUID REFERENCES public.documents(id) ON DELETE SET NULL; -- document this upload is a new version of
+ALTER TABLE public.processing_jobs
+    ADD COLUMN IF NOT EXISTS page_count INTEGER; -- pages of the uploaded PDF; NULL until it is stored
+
+SELECT 'Processing job versions set up successfully!' AS status;
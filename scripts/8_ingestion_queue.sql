@@ -0,0 +1,114 @@
+-- Durable ingestion job queue (INGESTION_QUEUE_BACKEND=postgres)
+-- The API enqueues one row per processing job; standalone workers
+-- (python -m src.jobs.worker) claim rows with a lease that they keep alive
+-- with heartbeats. Rows whose lease expires are reclaimed by the next claim.
+
+CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
+
+CREATE TABLE IF NOT EXISTS public.ingestion_queue (
+    id UUID PRIMARY KEY REFERENCES public.processing_jobs(id) ON DELETE CASCADE, -- same id as the processing job
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    doc_type TEXT NOT NULL,
+    payload_path TEXT NOT NULL, -- storage path of the uploaded PDF in the financial-pdfs bucket
+    auth_token TEXT, -- uploader's JWT; only used when workers run without the service role key
+    status TEXT NOT NULL DEFAULT 'queued', -- queued, leased, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0, -- claims so far (a crash mid-job costs one attempt)
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires_at TIMESTAMPTZ,
+    available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_queue_claim ON public.ingestion_queue(status, available_at);
+CREATE INDEX IF NOT EXISTS idx_ingestion_queue_lease ON public.ingestion_queue(status, lease_expires_at);
+
+-- RLS: users may enqueue and re-enqueue (retry) their own jobs; workers use the service role.
+ALTER TABLE public.ingestion_queue ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view own queued jobs" ON public.ingestion_queue;
+CREATE POLICY "Users can view own queued jobs"
+    ON public.ingestion_queue
+    FOR SELECT
+    USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can enqueue own jobs" ON public.ingestion_queue;
+CREATE POLICY "Users can enqueue own jobs"
+    ON public.ingestion_queue
+    FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can re-enqueue own jobs" ON public.ingestion_queue;
+CREATE POLICY "Users can re-enqueue own jobs"
+    ON public.ingestion_queue
+    FOR UPDATE
+    USING (auth.uid() = user_id);
+
+CREATE OR REPLACE FUNCTION update_ingestion_queue_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ingestion_queue_updated_at ON public.ingestion_queue;
+CREATE TRIGGER ingestion_queue_updated_at
+    BEFORE UPDATE ON public.ingestion_queue
+    FOR EACH ROW
+    EXECUTE FUNCTION update_ingestion_queue_updated_at();
+
+-- Leases the oldest available job (queued, or leased with an expired lease).
+-- SKIP LOCKED lets any number of workers claim concurrently without contention.
+CREATE OR REPLACE FUNCTION claim_ingestion_job(p_worker_id TEXT, p_lease_seconds INTEGER)
+RETURNS SETOF public.ingestion_queue
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE public.ingestion_queue q
+    SET status = 'leased',
+        attempts = q.attempts + 1,
+        lease_owner = p_worker_id,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    WHERE q.id = (
+        SELECT c.id
+        FROM public.ingestion_queue c
+        WHERE (c.status = 'queued' AND c.available_at <= now())
+           OR (c.status = 'leased' AND c.lease_expires_at < now())
+        ORDER BY c.available_at
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING q.*;
+END;
+$$;
+
+-- Extends a lease; returns false when the worker no longer owns the job.
+CREATE OR REPLACE FUNCTION heartbeat_ingestion_job(p_job_id UUID, p_worker_id TEXT, p_lease_seconds INTEGER)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE public.ingestion_queue
+    SET lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    WHERE id = p_job_id AND status = 'leased' AND lease_owner = p_worker_id;
+    RETURN FOUND;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION ingestion_queue_stats()
+RETURNS TABLE (status TEXT, job_count BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT q.status, COUNT(*) FROM public.ingestion_queue q GROUP BY q.status;
+$$;
+
+REVOKE EXECUTE ON FUNCTION claim_ingestion_job(TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION heartbeat_ingestion_job(UUID, TEXT, INTEGER) FROM PUBLIC, anon, authenticated;
+
+SELECT 'Ingestion queue created successfully!' AS status;
@@ -0,0 +1,118 @@
+-- Per-tenant fair scheduling and a small-document lane for the ingestion queue
+-- Run after 8_ingestion_queue.sql.
+-- Claims use weighted fair queuing across user_ids: each claim charges the job's
+-- page count / tenant weight to the tenant's virtual finish time, and the tenant
+-- with the earliest virtual start goes next. Small documents (and bulk documents
+-- that have waited too long) are claimed before other bulk documents.
+
+ALTER TABLE public.ingestion_queue ADD COLUMN IF NOT EXISTS page_count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE public.ingestion_queue ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ; -- last time a worker leased the job
+
+CREATE INDEX IF NOT EXISTS idx_ingestion_queue_user ON public.ingestion_queue(user_id, status);
+
+CREATE TABLE IF NOT EXISTS public.ingestion_tenants (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    weight DOUBLE PRECISION NOT NULL DEFAULT 1 CHECK (weight > 0), -- share of ingestion throughput relative to other tenants
+    virtual_finish DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS public.ingestion_fair_clock (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    virtual_time DOUBLE PRECISION NOT NULL
+);
+INSERT INTO public.ingestion_fair_clock (id, virtual_time) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+-- Scheduler state is only touched by workers (service role).
+ALTER TABLE public.ingestion_tenants ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.ingestion_fair_clock ENABLE ROW LEVEL SECURITY;
+
+DROP FUNCTION IF EXISTS claim_ingestion_job(TEXT, INTEGER);
+
+CREATE OR REPLACE FUNCTION claim_ingestion_job(
+    p_worker_id TEXT,
+    p_lease_seconds INTEGER,
+    p_small_doc_pages INTEGER DEFAULT 10,
+    p_bulk_max_wait_seconds INTEGER DEFAULT 300
+)
+RETURNS SETOF public.ingestion_queue
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_time DOUBLE PRECISION;
+    v_job_id UUID;
+    v_user_id UUID;
+    v_page_count INTEGER;
+    v_start DOUBLE PRECISION;
+    v_weight DOUBLE PRECISION;
+BEGIN
+    -- The clock row serialises claims; each claim is a couple of index lookups.
+    SELECT c.virtual_time INTO v_time FROM public.ingestion_fair_clock c WHERE c.id = 1 FOR UPDATE;
+
+    SELECT q.id, q.user_id, q.page_count, GREATEST(v_time, COALESCE(t.virtual_finish, 0)), COALESCE(t.weight, 1)
+    INTO v_job_id, v_user_id, v_page_count, v_start, v_weight
+    FROM public.ingestion_queue q
+    LEFT JOIN public.ingestion_tenants t ON t.user_id = q.user_id
+    WHERE (q.status = 'queued' AND q.available_at <= now())
+       OR (q.status = 'leased' AND q.lease_expires_at < now())
+    ORDER BY
+        CASE WHEN q.page_count <= p_small_doc_pages
+               OR q.enqueued_at < now() - make_interval(secs => p_bulk_max_wait_seconds) THEN 0 ELSE 1 END,
+        GREATEST(v_time, COALESCE(t.virtual_finish, 0)),
+        q.available_at
+    LIMIT 1
+    FOR UPDATE OF q SKIP LOCKED;
+
+    IF v_job_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO public.ingestion_tenants (user_id, virtual_finish)
+    VALUES (v_user_id, v_start + GREATEST(v_page_count, 1) / v_weight)
+    ON CONFLICT (user_id) DO UPDATE SET virtual_finish = EXCLUDED.virtual_finish;
+
+    UPDATE public.ingestion_fair_clock SET virtual_time = v_start WHERE id = 1;
+
+    RETURN QUERY
+    UPDATE public.ingestion_queue q
+    SET status = 'leased',
+        attempts = q.attempts + 1,
+        lease_owner = p_worker_id,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        claimed_at = now()
+    WHERE q.id = v_job_id
+    RETURNING q.*;
+END;
+$$;
+
+-- Queue depth and waits per tenant. Runs with the caller's rights, so users only
+-- see their own row while the service role sees every tenant.
+CREATE OR REPLACE FUNCTION ingestion_tenant_stats(p_user_id UUID DEFAULT NULL, p_window_seconds INTEGER DEFAULT 3600)
+RETURNS TABLE (
+    user_id UUID,
+    weight DOUBLE PRECISION,
+    queued BIGINT,
+    leased BIGINT,
+    oldest_wait_seconds DOUBLE PRECISION,
+    avg_wait_seconds DOUBLE PRECISION
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT q.user_id,
+           COALESCE(MAX(t.weight), 1),
+           COUNT(*) FILTER (WHERE q.status = 'queued'),
+           COUNT(*) FILTER (WHERE q.status = 'leased'),
+           COALESCE(MAX(EXTRACT(EPOCH FROM now() - q.enqueued_at)) FILTER (WHERE q.status = 'queued'), 0),
+           AVG(EXTRACT(EPOCH FROM q.claimed_at - q.enqueued_at))
+               FILTER (WHERE q.claimed_at >= now() - make_interval(secs => p_window_seconds))
+    FROM public.ingestion_queue q
+    LEFT JOIN public.ingestion_tenants t ON t.user_id = q.user_id
+    WHERE (p_user_id IS NULL OR q.user_id = p_user_id)
+      AND (q.status IN ('queued', 'leased') OR q.claimed_at >= now() - make_interval(secs => p_window_seconds))
+    GROUP BY q.user_id
+    ORDER BY 3 DESC;
+$$;
+
+REVOKE EXECUTE ON FUNCTION claim_ingestion_job(TEXT, INTEGER, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+
+SELECT 'Ingestion fairness created successfully!' AS status;
@@ -0,0 +1,97 @@
+"""Benchmark FinancialDocParser parse modes on a local PDF.
+
+Compares the render-per-page PNG path ("image") with native sub-PDF
+submission ("native_pdf") on bytes sent, wall time and CPU seconds per page.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_parse_modes path/to/report.pdf
+    python -m scripts.benchmark_parse_modes path/to/report.pdf --dry-run
+
+--dry-run swaps Gemini for a stub that answers instantly, which isolates the
+local cost of each mode (rendering/encoding vs. sub-PDF extraction) and the
+upload payload size without spending quota. The page annotation cache is
+disabled so every run does the full amount of work.
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import types as pytypes
+
+os.environ["PAGE_ANNOTATION_CACHE"] = "0"
+
+from src.services.FinancialDocParser import FinancialDocParser  # noqa: E402
+
+MODES = ("image", "native_pdf")
+
+
+class _StubModels:
+    """Answers annotation requests with placeholder markdown, honouring page markers."""
+
+    def generate_content(self, model, contents, config=None):
+        prompt = " ".join(c for c in contents if isinstance(c, str))
+        m = re.search(r"They are document pages ([\d, ]+)\.", prompt)
+        if m:
+            page_numbers = [int(n) for n in m.group(1).split(",")]
+            text = "\n".join(f"--- Page {n} Start ---\n# Page {n}\n--- Page {n} End ---" for n in page_numbers)
+        else:
+            text = "# Page"
+        return pytypes.SimpleNamespace(text=text, prompt_feedback=None, candidates=None)
+
+
+def _stub_gemini_client():
+    return pytypes.SimpleNamespace(client=pytypes.SimpleNamespace(models=_StubModels()))
+
+
+def run_mode(pdf_bytes: bytes, mode: str, dry_run: bool, pages_per_part: int) -> dict:
+    parser = FinancialDocParser(
+        gemini_client=_stub_gemini_client() if dry_run else None,
+        parse_mode=mode,
+        native_pages_per_part=pages_per_part,
+    )
+    result = parser.parse_pdf_to_markdown(io.BytesIO(pdf_bytes))
+    if result.get("error"):
+        raise RuntimeError(f"{mode} parse failed: {result['error']}")
+    stats = result.get("stats") or {}
+    pages = max(1, stats.get("pages_multimodal", result["page_count"]))
+    return {
+        "mode": mode,
+        "pages": pages,
+        "requests": stats.get("llm_requests", 0),
+        "bytes_sent": stats.get("bytes_sent", 0),
+        "bytes_per_page": stats.get("bytes_sent", 0) / pages,
+        "wall_per_page": stats.get("wall_seconds", 0.0) / pages,
+        "cpu_per_page": stats.get("cpu_seconds", 0.0) / pages,
+        "fallback_pages": stats.get("native_fallback_pages", 0),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf_path")
+    parser.add_argument("--dry-run", action="store_true", help="Use a stub instead of calling Gemini.")
+    parser.add_argument("--pages-per-part", type=int, default=4, help="Pages per sub-PDF in native_pdf mode.")
+    parser.add_argument("--routing", default="multimodal", choices=("multimodal", "auto"),
+                        help="Page routing; 'multimodal' (default) benchmarks every page through the model.")
+    args = parser.parse_args(argv)
+
+    os.environ["PDF_PAGE_ROUTING"] = args.routing
+    with open(args.pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+
+    rows = [run_mode(pdf_bytes, mode, args.dry_run, args.pages_per_part) for mode in MODES]
+
+    print()
+    print(f"{'mode':<12}{'pages':>7}{'requests':>10}{'bytes sent':>14}{'bytes/page':>13}{'wall s/page':>13}{'cpu s/page':>12}{'fallback':>10}")
+    for row in rows:
+        print(
+            f"{row['mode']:<12}{row['pages']:>7}{row['requests']:>10}{row['bytes_sent']:>14,}"
+            f"{row['bytes_per_page']:>13,.0f}{row['wall_per_page']:>13.3f}{row['cpu_per_page']:>12.3f}{row['fallback_pages']:>10}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
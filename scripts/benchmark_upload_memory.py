@@ -0,0 +1,216 @@
+"""Benchmark peak memory of POST /documents/process under concurrent large uploads.
+
+Sends N concurrent uploads of one generated PDF (default 20 x 50MB) through the
+FastAPI app in-process and reports the peak RSS of the process for two ways of
+handling the upload:
+
+    buffered  the previous handling: `await file.read()` of the whole file, then
+              hashing, page counting and the storage upload from in-memory copies
+    spooled   the current endpoint: the file is streamed to a SpooledUpload and
+              hashed, page counted and uploaded from that one file on disk
+
+Supabase is replaced by an in-process stub: storage uploads stream file objects
+in 1MB chunks the way httpx does and keep bytes payloads referenced for the
+duration of the request, and the spooled endpoint's resumable uploads go to the
+local storage backend (STORAGE_BACKEND=local). Each mode runs in a fresh
+subprocess, since peak RSS never goes down.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_upload_memory
+    python -m scripts.benchmark_upload_memory --uploads 20 --size-mb 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types as pytypes
+
+MODES = ("buffered", "spooled")
+
+
+def _make_pdf(path: str, size_mb: int) -> None:
+    """Writes a valid PDF of about `size_mb` MB (incompressible embedded file padding)."""
+    import fitz as pymupdf
+
+    doc = pymupdf.open()
+    for page_number in range(1, 6):
+        doc.new_page().insert_text((72, 72), f"Income statement page {page_number}", fontsize=12)
+    doc.embfile_add("padding.bin", os.urandom(size_mb * 1024 * 1024))
+    doc.save(path)
+    doc.close()
+
+
+class _StubQuery:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        return pytypes.SimpleNamespace(data=[{"id": "stub"}], count=0)
+
+
+class _StubDocumentsQuery(_StubQuery):
+    def execute(self):
+        return pytypes.SimpleNamespace(data=[], count=0)
+
+
+class _StubBucket:
+    def upload(self, path, file, file_options=None):
+        if isinstance(file, bytes):
+            payload = file  # httpx keeps an in-memory payload referenced until the request is sent
+            time.sleep(0.5)
+            del payload
+            return
+        while file.read(1024 * 1024):
+            time.sleep(0.01)  # network pacing, so uploads overlap
+
+    def remove(self, paths):
+        return None
+
+
+class _StubClient:
+    def __init__(self):
+        self.options = pytypes.SimpleNamespace(headers={})
+        self.storage = pytypes.SimpleNamespace(from_=lambda bucket: _StubBucket())
+
+    def table(self, name):
+        return _StubDocumentsQuery() if name == "documents" else _StubQuery()
+
+
+def _build_app(mode: str):
+    from fastapi import Depends, FastAPI, File, UploadFile
+
+    from api.v1 import dependencies
+    from api.v1.endpoints import document_process
+    from api.v1.upload_limits import UploadSizeLimitMiddleware
+    from src.storage.SupabaseService import SupabaseService
+
+    document_process.create_client = lambda url, key: _StubClient()
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware)
+    app.dependency_overrides[dependencies.get_session] = lambda: dependencies.Session(
+        user_id="00000000-0000-0000-0000-000000000001", token="stub"
+    )
+
+    if mode == "spooled":
+        app.include_router(document_process.router)
+        return app
+
+    @app.post("/documents/process")
+    async def process_buffered(file: UploadFile = File(...), session=Depends(dependencies.get_session)):
+        file_content = await file.read()
+        service = SupabaseService(_StubClient())
+        await asyncio.to_thread(SupabaseService.hash_content, file_content)
+        await asyncio.to_thread(
+            service.upload_pdf_to_storage, io.BytesIO(file_content), session.user_id, "job", file.filename
+        )
+        await asyncio.to_thread(_count_pages_in_memory, file_content)
+        return {"success": True}
+
+    return app
+
+
+def _count_pages_in_memory(pdf_bytes: bytes) -> int:
+    import fitz as pymupdf
+
+    with pymupdf.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        return pdf_document.page_count
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode: str, pdf_path: str, uploads: int) -> dict:
+    """Runs one mode in this process and returns its measurements."""
+    import httpx
+
+    app = _build_app(mode)
+    baseline_mb = _peak_rss_mb()
+
+    async def upload_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def upload_one(index: int):
+                with open(pdf_path, "rb") as pdf_file:
+                    response = await client.post(
+                        "/documents/process",
+                        files={"file": (f"report-{index}.pdf", pdf_file, "application/pdf")},
+                    )
+                return response.status_code
+
+            codes = await asyncio.gather(*(upload_one(index) for index in range(uploads)))
+            from api.v1.endpoints.document_process import drain_background_uploads
+            await drain_background_uploads(timeout=600)
+            return codes
+
+    start = time.perf_counter()
+    statuses = asyncio.run(upload_all())
+    return {
+        "mode": mode,
+        "uploads": uploads,
+        "statuses": sorted(set(statuses)),
+        "seconds": round(time.perf_counter() - start, 2),
+        "baseline_rss_mb": round(baseline_mb, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=20, help="Concurrent uploads (default 20).")
+    parser.add_argument("--size-mb", type=int, default=50, help="Size of each upload in MB (default 50).")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)  # child process
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("SUPABASE_URL", "http://stub")
+    os.environ.setdefault("SUPABASE_ANON_KEY", "stub")
+    os.environ["INGESTION_QUEUE_BACKEND"] = "sqlite"
+    os.environ.setdefault("INGESTION_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "benchmark_upload_queue.sqlite3"))
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ.setdefault("MAX_UPLOAD_BYTES", str((args.size_mb + 1) * 1024 * 1024))
+
+    if args.mode:
+        with tempfile.TemporaryDirectory() as storage_root:
+            os.environ["STORAGE_LOCAL_ROOT"] = storage_root
+            os.environ["RESUMABLE_UPLOAD_STATE_DIR"] = os.path.join(storage_root, ".uploads")
+            print(json.dumps(run_mode(args.mode, args.pdf, args.uploads)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf_path = os.path.join(workdir, "report.pdf")
+        _make_pdf(pdf_path, args.size_mb)
+        with open(pdf_path, "rb") as pdf_file:
+            digest = hashlib.sha256(pdf_file.read()).hexdigest()[:12]
+        print(f"Uploading {args.uploads} x {os.path.getsize(pdf_path) / (1024 * 1024):.1f}MB (sha256 {digest}...)")
+
+        results = []
+        for mode in MODES:
+            completed = subprocess.run(
+                [sys.executable, "-m", "scripts.benchmark_upload_memory", "--mode", mode, "--pdf", pdf_path,
+                 "--uploads", str(args.uploads), "--size-mb", str(args.size_mb)],
+                capture_output=True, text=True, check=True, env=os.environ.copy(),
+            )
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10} {'status':<8} {'seconds':>8} {'baseline MB':>12} {'peak RSS MB':>12}")
+    for result in results:
+        statuses = ",".join(str(code) for code in result["statuses"])
+        print(f"{result['mode']:<10} {statuses:<8} {result['seconds']:>8} {result['baseline_rss_mb']:>12} {result['peak_rss_mb']:>12}")
+    buffered, spooled = results
+    print(f"Peak RSS reduced by {buffered['peak_rss_mb'] - spooled['peak_rss_mb']:.0f}MB "
+          f"({buffered['peak_rss_mb'] / max(spooled['peak_rss_mb'], 1):.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
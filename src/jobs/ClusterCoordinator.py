@@ -0,0 +1,249 @@
+# src/jobs/ClusterCoordinator.py
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, TypeVar, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+T = TypeVar("T")
+
+# Contains name, slot, holder and, for the file backend, the open lock file descriptor
+SlotLease = Dict[str, Any]
+
+
+class FileCoordinator:
+    """
+    Coordination between the processes of one host (e.g. uvicorn --workers 4) through lock files.
+
+    A slot of a named semaphore is an exclusive `flock` on `<directory>/<name>.<n>.slot`;
+    the kernel drops it when its holder exits, so a crashed worker never leaks a
+    slot. Shared state (rate limiter buckets) is a JSON file updated under a lock.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: Lock and state files (env COORDINATION_DIR, default <tmp>/stackrag_coordination).
+                Every process to coordinate must use the same directory.
+        """
+        if fcntl is None:
+            raise RuntimeError("The file coordination backend needs fcntl (POSIX).")
+        self.directory = directory or os.getenv("COORDINATION_DIR") or os.path.join(tempfile.gettempdir(), "stackrag_coordination")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def acquire_slot(self, name: str, limit: int, holder: str, ttl_seconds: float) -> Optional[SlotLease]:
+        """Takes a free slot of semaphore `name` (held until released or the process exits), or returns None."""
+        for slot in range(limit):
+            fd = os.open(os.path.join(self.directory, f"{name}.{slot}.slot"), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return {"name": name, "slot": slot, "holder": holder, "fd": fd}
+        return None
+
+    def renew_slot(self, lease: SlotLease, ttl_seconds: float) -> bool:
+        return True  # held for as long as the process lives
+
+    def release_slot(self, lease: SlotLease) -> None:
+        fd = lease.pop("fd", None)
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def update_state(self, name: str, update: Callable[[Dict[str, Any]], T]) -> T:
+        """Runs `update` on the shared state `name` (mutating it in place) as one atomic step; returns its result."""
+        path = os.path.join(self.directory, f"{name}.state.json")
+        with open(os.path.join(self.directory, f"{name}.state.lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(path) as state_file:
+                        state = json.load(state_file)
+                except (OSError, ValueError):
+                    state = {}
+                result = update(state)
+                with open(path + ".tmp", "w") as state_file:
+                    json.dump(state, state_file)
+                os.replace(path + ".tmp", path)
+                return result
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class SupabaseCoordinator:
+    """
+    Coordination across hosts through Postgres (scripts/14_cluster_coordination.sql).
+
+    Semaphore slots are rows in `coordination_slots` that expire after a TTL unless
+    renewed, so a lost worker's slots free themselves. Shared state lives in
+    `coordination_state` and is updated with compare-and-swap on a version column.
+    Needs the service role key.
+    """
+
+    MAX_CAS_ATTEMPTS = 20
+
+    def __init__(self, supabase_client: Any):
+        self.client = supabase_client
+
+    def acquire_slot(self, name: str, limit: int, holder: str, ttl_seconds: float) -> Optional[SlotLease]:
+        response = self.client.rpc("acquire_coordination_slot", {
+            "p_name": name,
+            "p_limit": limit,
+            "p_holder": holder,
+            "p_ttl_seconds": int(ttl_seconds),
+        }).execute()
+        slot = response.data
+        if isinstance(slot, list):
+            slot = slot[0] if slot else None
+        if slot is None:
+            return None
+        return {"name": name, "slot": int(slot), "holder": holder}
+
+    def renew_slot(self, lease: SlotLease, ttl_seconds: float) -> bool:
+        response = self.client.table("coordination_slots")\
+            .update({"expires_at": self._timestamp(ttl_seconds)})\
+            .eq("name", lease["name"])\
+            .eq("slot", lease["slot"])\
+            .eq("holder", lease["holder"])\
+            .execute()
+        return bool(response.data)
+
+    def release_slot(self, lease: SlotLease) -> None:
+        self.client.table("coordination_slots")\
+            .delete()\
+            .eq("name", lease["name"])\
+            .eq("slot", lease["slot"])\
+            .eq("holder", lease["holder"])\
+            .execute()
+
+    def update_state(self, name: str, update: Callable[[Dict[str, Any]], T]) -> T:
+        """Runs `update` on the shared state `name` (mutating it in place) as one atomic step; returns its result."""
+        for _ in range(self.MAX_CAS_ATTEMPTS):
+            response = self.client.table("coordination_state").select("state, version").eq("name", name).execute()
+            if not response.data:
+                self.client.table("coordination_state")\
+                    .upsert({"name": name, "state": {}, "version": 0}, on_conflict="name", ignore_duplicates=True)\
+                    .execute()
+                continue
+            row = response.data[0]
+            state = row["state"] or {}
+            result = update(state)
+            written = self.client.table("coordination_state")\
+                .update({"state": state, "version": row["version"] + 1})\
+                .eq("name", name)\
+                .eq("version", row["version"])\
+                .execute()
+            if written.data:
+                return result
+        raise RuntimeError(f"Could not update coordination state {name}: too much contention.")
+
+    @staticmethod
+    def _timestamp(offset_seconds: float) -> str:
+        return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).isoformat()
+
+
+Coordinator = Union[FileCoordinator, SupabaseCoordinator]
+
+
+class ClusterSemaphore:
+    """A semaphore of `limit` slots shared by every process using the same coordinator."""
+
+    def __init__(
+        self,
+        coordinator: Coordinator,
+        name: str,
+        limit: int,
+        holder: str,
+        ttl_seconds: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        Args:
+            coordinator: Backend shared by the processes (see `get_coordinator`).
+            name: Semaphore name, e.g. "ingestion".
+            limit: Slots across all processes.
+            holder: Name of this process in lease rows, e.g. a worker id.
+            ttl_seconds: Lifetime of an unrenewed slot on the postgres backend (env COORDINATION_SLOT_TTL_SECONDS, default 300).
+            poll_interval: Seconds between attempts while every slot is taken (env COORDINATION_POLL_SECONDS, default 0.5).
+        """
+        self.coordinator = coordinator
+        self.name = name
+        self.limit = max(1, limit)
+        self.holder = holder
+        self.ttl_seconds = ttl_seconds or float(os.getenv("COORDINATION_SLOT_TTL_SECONDS", "300"))
+        self.poll_interval = poll_interval or float(os.getenv("COORDINATION_POLL_SECONDS", "0.5"))
+
+    def try_acquire(self) -> Optional[SlotLease]:
+        return self.coordinator.acquire_slot(self.name, self.limit, self.holder, self.ttl_seconds)
+
+    def acquire(self) -> SlotLease:
+        """Blocks until a slot is free."""
+        while True:
+            lease = self.try_acquire()
+            if lease is not None:
+                return lease
+            time.sleep(self.poll_interval)
+
+    def renew(self, lease: SlotLease) -> bool:
+        return self.coordinator.renew_slot(lease, self.ttl_seconds)
+
+    def release(self, lease: SlotLease) -> None:
+        try:
+            self.coordinator.release_slot(lease)
+        except Exception as e:
+            # The slot expires on its own (postgres) or is freed at exit (file)
+            print(f"Warning: Failed to release {self.name} slot {lease.get('slot')}: {e}")
+
+
+_shared_coordinator: Optional[Coordinator] = None
+_shared_coordinator_lock = threading.Lock()
+
+
+def get_coordinator() -> Optional[Coordinator]:
+    """
+    Returns the process-wide coordinator for COORDINATION_BACKEND, or None when limits are per process.
+
+    "none" (default) keeps every limit per process. "file" coordinates the processes
+    of one host; "postgres" coordinates every host through Supabase and needs
+    SUPABASE_SERVICE_ROLE_KEY.
+    """
+    global _shared_coordinator
+    backend = os.getenv("COORDINATION_BACKEND", "none").strip().lower()
+    if backend in ("", "none"):
+        return None
+    with _shared_coordinator_lock:
+        if _shared_coordinator is None:
+            if backend == "file":
+                _shared_coordinator = FileCoordinator()
+            elif backend == "postgres":
+                service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+                if not service_key:
+                    raise ValueError("SUPABASE_SERVICE_ROLE_KEY must be set for the postgres coordination backend.")
+                from supabase import create_client
+                _shared_coordinator = SupabaseCoordinator(create_client(os.environ["SUPABASE_URL"], service_key))
+            else:
+                raise ValueError(f"Unsupported coordination backend: {backend}")
+        return _shared_coordinator
+
+
+def get_cluster_semaphore(name: str, limit_env: str, holder: Optional[str] = None) -> Optional[ClusterSemaphore]:
+    """
+    Cluster-wide semaphore `name` limited by the env variable `limit_env`, if a coordinator is
+    configured and the variable is set; otherwise None (per-process limits apply).
+    """
+    limit = os.getenv(limit_env)
+    coordinator = get_coordinator()
+    if coordinator is None or not limit:
+        return None
+    return ClusterSemaphore(coordinator, name, int(limit), holder or f"{socket.gethostname()}:{os.getpid()}")
@@ -0,0 +1,448 @@
+# src/jobs/IngestionWorker.py
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from supabase import create_client
+
+from src.jobs.ClusterCoordinator import SlotLease, get_cluster_semaphore
+from src.jobs.JobQueue import QueuedJob, get_job_queue
+from src.jobs.ProgressBus import get_progress_bus
+from src.jobs.ProgressWriter import get_progress_writer
+from src.llm.CircuitBreaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from src.pipeline import IngestionPipeline
+from src.storage.SupabaseService import SupabaseService
+from src.storage.UploadSpool import take_local_payload
+
+logger = logging.getLogger("uvicorn.error")
+
+# Providers the ingestion pipeline depends on (page annotation and metadata, embeddings)
+INGESTION_PROVIDERS = ("gemini", "openai")
+
+
+def get_user_friendly_error(exception_str: str) -> tuple[str, str]:
+    """
+    Convert technical errors to user-friendly messages.
+    Returns: (user_message, error_code)
+    """
+    error_lower = exception_str.lower()
+
+    # API Key errors
+    if "401" in exception_str or "invalid_api_key" in error_lower or "incorrect api key" in error_lower:
+        return ("AI service temporarily unavailable. Please try again later or contact support.", "api_key_invalid")
+
+    # Rate limit / quota exhaustion
+    if "429" in exception_str or "rate_limit" in error_lower or "resource_exhausted" in error_lower or "quota" in error_lower:
+        # Gemini free-tier commonly returns RESOURCE_EXHAUSTED. Make this explicit.
+        if "resource_exhausted" in error_lower or "quota" in error_lower:
+            return (
+                "Upload rate limit reached while processing this PDF. Please wait a bit and retry, or upload fewer files at once.",
+                "quota_exhausted",
+            )
+        return ("Service is busy. Please wait a moment and try again.", "rate_limit")
+
+    # File parsing errors
+    if "parsing" in error_lower or "pdf" in error_lower and "corrupt" in error_lower:
+        return ("Unable to read PDF file. The file may be corrupted or password-protected.", "file_corrupted")
+
+    # Embedding errors
+    if "embedding" in error_lower:
+        return ("Failed to process document content. Please try again.", "embedding_failed")
+
+    # Network errors
+    if "connection" in error_lower or "timeout" in error_lower:
+        return ("Network connection issue. Please check your connection and retry.", "network_error")
+
+    # Database errors
+    if "supabase" in error_lower or "database" in error_lower:
+        return ("Database error. Please try again or contact support.", "database_error")
+
+    # Generic fallback
+    return ("An unexpected error occurred. Please try again.", "unknown_error")
+
+
+async def update_processing_job(supabase_client, job_id, fields: Dict[str, Any]) -> None:
+    """
+    Publishes a job update to progress subscribers and writes it to processing_jobs,
+    together with any buffered pipeline progress, before returning.
+    """
+    await get_progress_writer().write_now(supabase_client, job_id, fields)
+
+
+def duplicate_job_fields(document: Dict[str, Any]) -> Dict[str, Any]:
+    """processing_jobs fields for a job completed by an identical document the user already ingested."""
+    return {
+        "status": "completed",
+        "current_step": "Already processed",
+        "progress_percentage": 100,
+        "document_id": str(document["id"]),
+        "dedup_hit": True,
+        "result_data": {
+            "success": True,
+            "message": "Identical document already processed; reused its results.",
+            "document_id": str(document["id"]),
+            "deduplicated": True,
+            "duplicate_of_filename": document.get("filename")
+        },
+        "completed_at": "now()"
+    }
+
+
+async def complete_as_duplicate(supabase_client, job_id, document: Dict[str, Any]) -> None:
+    """Completes a job by pointing it at an identical document the user already ingested."""
+    await update_processing_job(supabase_client, job_id, duplicate_job_fields(document))
+
+
+class IngestionWorker:
+    """
+    Claims ingestion jobs from the durable job queue and runs the pipeline on them.
+    Requires SUPABASE_SERVICE_ROLE_KEY: jobs are processed for their `user_id`
+    with the service role, so no uploader token is stored with the job.
+
+    Runs `concurrency` job slots. Each claimed job holds a lease that is renewed by
+    a heartbeat every `lease_seconds / 3`; if the worker dies, the lease runs out
+    and another worker reclaims the job. If a heartbeat finds the lease was lost,
+    processing of that job is abandoned so two workers never finish the same job.
+
+    With INGESTION_CLUSTER_CONCURRENCY and a COORDINATION_BACKEND set, each slot also
+    takes a cluster-wide slot before claiming, capping jobs in flight across every
+    worker process rather than per process.
+
+    While a provider's circuit breaker is open, slots stop claiming, and a job that
+    fails because of the outage is parked back on the queue until the circuit may
+    close instead of failing or retrying. Parking does not use up an attempt.
+    """
+
+    def __init__(
+        self,
+        job_queue: Optional[Any] = None,
+        concurrency: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+        worker_id: Optional[str] = None,
+        pipeline_factory: Optional[Callable[[SupabaseService], IngestionPipeline]] = None,
+    ):
+        """
+        Settings default to INGESTION_WORKER_* environment variables.
+
+        Args:
+            job_queue: Queue to claim from; defaults to INGESTION_QUEUE_BACKEND.
+            concurrency: Jobs processed at once (default MAX_CONCURRENT_INGESTIONS, else 4).
+            lease_seconds: Lease length renewed by heartbeats (default 120).
+            poll_interval: Seconds between claim attempts when the queue is empty (default 2).
+            worker_id: Lease owner name; defaults to host:pid:random.
+            pipeline_factory: Builds the pipeline for a job's Supabase service.
+        """
+        self._service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+        if not self._service_key:
+            raise ValueError("SUPABASE_SERVICE_ROLE_KEY must be set for ingestion workers.")
+        self.job_queue = job_queue or get_job_queue()
+        self.concurrency = max(1, concurrency or int(os.getenv("INGESTION_WORKER_CONCURRENCY", os.getenv("MAX_CONCURRENT_INGESTIONS", "4"))))
+        self.lease_seconds = lease_seconds or float(os.getenv("INGESTION_WORKER_LEASE_SECONDS", "120"))
+        self.poll_interval = poll_interval or float(os.getenv("INGESTION_WORKER_POLL_SECONDS", "2"))
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.pipeline_factory = pipeline_factory or (lambda supabase_service: IngestionPipeline(supabase_service=supabase_service))
+        self.cluster_slots = get_cluster_semaphore("ingestion", "INGESTION_CLUSTER_CONCURRENCY", self.worker_id)
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """
+        Stops claiming new jobs; `run_forever` returns once the jobs in progress are
+        finished. If its task is cancelled first, those jobs are abandoned mid-pipeline
+        and reclaimed by another worker when their leases expire.
+        """
+        self._stopping.set()
+
+    async def run_forever(self) -> None:
+        logger.info("ingestion_worker_start worker_id=%s concurrency=%s", self.worker_id, self.concurrency)
+        await asyncio.gather(*(self._slot_loop() for _ in range(self.concurrency)))
+        logger.info("ingestion_worker_stopped worker_id=%s", self.worker_id)
+
+    async def _slot_loop(self) -> None:
+        while not self._stopping.is_set():
+            open_circuit = self._open_circuit()
+            if open_circuit is not None:
+                await self._idle(max(self.poll_interval, open_circuit.retry_after()))
+                continue
+            slot_lease = None
+            job = None
+            try:
+                if self.cluster_slots is not None:
+                    slot_lease = await asyncio.to_thread(self.cluster_slots.try_acquire)
+                if self.cluster_slots is None or slot_lease is not None:
+                    job = await asyncio.to_thread(self.job_queue.claim, self.worker_id, self.lease_seconds)
+            except Exception:
+                logger.exception("ingestion_worker_claim_failed worker_id=%s", self.worker_id)
+            if job is None:
+                if slot_lease is not None:
+                    await asyncio.to_thread(self.cluster_slots.release, slot_lease)
+                await self._idle(self.poll_interval)
+                continue
+            # Progress streams in this process can rely on the bus for this job
+            get_progress_bus().mark_local(job["id"])
+            try:
+                await self.process_job(job, slot_lease)
+            finally:
+                get_progress_bus().unmark_local(job["id"])
+                if slot_lease is not None:
+                    await asyncio.to_thread(self.cluster_slots.release, slot_lease)
+
+    async def _idle(self, seconds: float) -> None:
+        """Sleeps for `seconds` or until the worker is stopped."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    @staticmethod
+    def _open_circuit() -> Optional[CircuitBreaker]:
+        """The open ingestion provider circuit that stays open longest, if any."""
+        open_breakers = [breaker for breaker in map(get_circuit_breaker, INGESTION_PROVIDERS) if breaker.is_open()]
+        return max(open_breakers, key=lambda breaker: breaker.retry_after(), default=None)
+
+    def _supabase_client(self):
+        # Jobs act for their uploader through the service role: every read and write
+        # is scoped by the job's user_id, so no user token has to outlive the request.
+        return create_client(os.environ["SUPABASE_URL"], self._service_key)
+
+    async def process_job(self, job: QueuedJob, slot_lease: Optional[SlotLease] = None) -> None:
+        """
+        Runs one claimed job under a heartbeat and records the outcome on the job and queue rows.
+        The heartbeat also renews `slot_lease`, the job's cluster slot, if any.
+        """
+        job_id = str(job["id"])
+        supabase_client = self._supabase_client()
+
+        if job["attempts"] > job["max_attempts"]:
+            logger.error("processing_job_abandoned job_id=%s attempts=%s", job_id, job["attempts"] - 1)
+            error = "Processing was interrupted repeatedly. Please retry."
+            await update_processing_job(supabase_client, job_id, {
+                "status": "failed",
+                "error_message": error,
+                "error_code": "worker_lost",
+                "completed_at": "now()"
+            })
+            await asyncio.to_thread(self.job_queue.fail, job_id, self.worker_id, error)
+            return
+
+        work = asyncio.create_task(self._run_job(job, supabase_client))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, work, slot_lease))
+        try:
+            outcome = await work
+        except CircuitOpenError as e:
+            await self._park_job(job, supabase_client, e)
+            return
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled():
+                # The heartbeat found another worker holds the lease now; leave the job to it.
+                logger.warning("processing_job_lease_lost job_id=%s worker_id=%s", job_id, self.worker_id)
+                return
+            work.cancel()
+            raise
+        finally:
+            heartbeat.cancel()
+
+        if outcome is None:
+            await asyncio.to_thread(self.job_queue.complete, job_id, self.worker_id)
+        else:
+            await asyncio.to_thread(self.job_queue.fail, job_id, self.worker_id, outcome)
+
+    async def _park_job(self, job: QueuedJob, supabase_client, error: CircuitOpenError) -> None:
+        """Puts a job back on the queue until its provider's circuit may close, without charging the attempt."""
+        job_id = str(job["id"])
+        delay = error.retry_after + random.uniform(0, self.poll_interval)
+        logger.warning("processing_job_parked job_id=%s provider=%s delay_s=%.1f", job_id, error.provider, delay)
+        await update_processing_job(supabase_client, job_id, {
+            "status": "pending",
+            "current_step": "AI service temporarily unavailable. Processing will resume automatically...",
+        })
+        await asyncio.to_thread(self.job_queue.requeue, job_id, self.worker_id, delay, str(error), max(0, job["attempts"] - 1))
+
+    async def _heartbeat(self, job_id: str, work: asyncio.Task, slot_lease: Optional[SlotLease] = None) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if slot_lease is not None:
+                try:
+                    if not await asyncio.to_thread(self.cluster_slots.renew, slot_lease):
+                        # Expired and possibly reassigned; the job keeps running, the cap is briefly exceeded
+                        logger.warning("ingestion_cluster_slot_lost job_id=%s slot=%s", job_id, slot_lease["slot"])
+                except Exception:
+                    logger.exception("ingestion_cluster_slot_renew_failed job_id=%s", job_id)
+            try:
+                held = await asyncio.to_thread(self.job_queue.heartbeat, job_id, self.worker_id, self.lease_seconds)
+            except Exception:
+                logger.exception("processing_job_heartbeat_failed job_id=%s", job_id)
+                continue
+            if not held:
+                work.cancel()
+                return
+
+    async def _run_job(self, job: QueuedJob, supabase_client) -> Optional[str]:
+        """
+        Processes a job and updates its processing_jobs row.
+
+        Returns:
+            None on success, otherwise the failure message.
+
+        Raises:
+            CircuitOpenError: The job failed while an ingestion provider is down; it should be parked.
+        """
+        job_id = uuid.UUID(str(job["id"]))
+        filename = job["filename"]
+        try:
+            logger.info(
+                "processing_job_start job_id=%s filename=%s attempt=%s worker_id=%s",
+                str(job_id),
+                filename,
+                job["attempts"],
+                self.worker_id,
+            )
+
+            # The service role can read every user's files, so only touch the job owner's folder.
+            payload_path = job["payload_path"]
+            if not payload_path.startswith(f"{job['user_id']}/") or ".." in payload_path.split("/"):
+                logger.error("processing_job_payload_rejected job_id=%s user_id=%s", str(job_id), job["user_id"])
+                await update_processing_job(supabase_client, job_id, {
+                    "status": "failed",
+                    "error_message": "The uploaded file could not be found. Please upload it again.",
+                    "error_code": "invalid_payload",
+                    "completed_at": "now()"
+                })
+                return f"Payload {payload_path} is outside the folder of user {job['user_id']}"
+
+            # Update to parsing status
+            await update_processing_job(supabase_client, job_id, {
+                "status": "parsing",
+                "current_step": "Reading PDF...",
+                "progress_percentage": 10
+            })
+
+            supabase_service = SupabaseService(supabase_client)
+            # The upload's own spool when it was queued by this process, else streamed to a
+            # temp file (hashed on the way); the parser opens it by path
+            pdf_spool = take_local_payload(payload_path)
+            if pdf_spool is None:
+                pdf_spool = await asyncio.to_thread(supabase_service.download_pdf_to_spool, payload_path)
+            try:
+                # An identical upload may have finished while this one was queued
+                content_hash = pdf_spool.content_hash
+                if os.getenv("DOCUMENT_DEDUP", "1") != "0":
+                    existing = await asyncio.to_thread(supabase_service.find_document_by_hash, job["user_id"], content_hash)
+                    if existing:
+                        logger.info("processing_job_dedup_hit job_id=%s document_id=%s", str(job_id), existing["id"])
+                        await complete_as_duplicate(supabase_client, job_id, existing)
+                        if existing.get("storage_path") != job["payload_path"]:
+                            await asyncio.to_thread(supabase_service.delete_pdf_from_storage, job["payload_path"])
+                        return None
+
+                result = await self._run_pipeline(job, job_id, pdf_spool.path, supabase_client, content_hash)
+            finally:
+                await asyncio.to_thread(pdf_spool.close)
+            if not result.get("success"):
+                open_circuit = self._open_circuit()
+                if open_circuit is not None:
+                    raise CircuitOpenError(open_circuit.name, open_circuit.retry_after())
+
+            if result.get("success"):
+                logger.info(
+                    "processing_job_success job_id=%s filename=%s document_id=%s",
+                    str(job_id),
+                    filename,
+                    str(result.get("document_id")) if result.get("document_id") else None,
+                )
+                # Convert UUID to string for JSON serialization
+                result_data = {
+                    "success": result.get("success"),
+                    "message": result.get("message"),
+                    "document_id": str(result.get("document_id")) if result.get("document_id") else None,
+                    "chunk_count": result.get("chunk_count"),
+                    "pages_resumed": result.get("pages_resumed"),
+                    "parse_stats": result.get("parse_stats"),
+                    "stage_timings": result.get("stage_timings")
+                }
+
+                # Mark as completed
+                await update_processing_job(supabase_client, job_id, {
+                    "status": "completed",
+                    "current_step": "Complete!",
+                    "progress_percentage": 100,
+                    "document_id": str(result.get("document_id")) if result.get("document_id") else None,
+                    "result_data": result_data,
+                    "completed_at": "now()"
+                })
+                return None
+
+            # Mark as failed with user-friendly error
+            user_error, error_code = get_user_friendly_error(result.get("message", ""))
+            logger.error(
+                "processing_job_failed job_id=%s filename=%s error_code=%s",
+                str(job_id),
+                filename,
+                error_code,
+            )
+            await update_processing_job(supabase_client, job_id, {
+                "status": "failed",
+                "error_message": user_error,
+                "error_code": error_code,
+                "completed_at": "now()"
+            })
+            return str(result.get("message", ""))
+
+        except (asyncio.CancelledError, CircuitOpenError):
+            raise
+        except Exception as e:
+            open_circuit = self._open_circuit()
+            if open_circuit is not None:
+                raise CircuitOpenError(open_circuit.name, open_circuit.retry_after()) from e
+            # Mark as failed on exception with user-friendly error
+            error_str = str(e)
+            user_error, error_code = get_user_friendly_error(error_str)
+
+            logger.exception(
+                "processing_job_exception job_id=%s filename=%s",
+                str(job_id),
+                filename,
+            )
+
+            try:
+                await update_processing_job(supabase_client, job_id, {
+                    "status": "failed",
+                    "error_message": user_error,
+                    "error_code": error_code,
+                    "completed_at": "now()"
+                })
+            except Exception:
+                print(f"[ERROR] Failed to update job status for {job_id}")
+            return error_str
+
+    async def _run_pipeline(
+        self,
+        job: QueuedJob,
+        job_id: uuid.UUID,
+        pdf_path: str,
+        supabase_client,
+        content_hash: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Runs the pipeline once. Rate limits are retried per call by the LLM rate
+        limiter, so one that reaches this level outlasted its longest wait (e.g. a
+        daily quota) and fails the job; a user retry resumes from the page checkpoints.
+        """
+        supabase_service = SupabaseService(supabase_client)
+        pipeline = self.pipeline_factory(supabase_service)
+        logger.info("processing_job_attempt job_id=%s filename=%s attempt=%s", str(job_id), job["filename"], job["attempts"])
+        return await pipeline.run(
+            pdf_file_buffer=pdf_path,
+            user_id=uuid.UUID(str(job["user_id"])),
+            original_filename=job["filename"],
+            doc_type=job["doc_type"],
+            job_id=job_id,  # Pass job_id for progress updates
+            storage_path=job["payload_path"],
+            content_hash=content_hash,
+            previous_document_id=uuid.UUID(str(job["previous_document_id"])) if job.get("previous_document_id") else None
+        )
@@ -0,0 +1,494 @@
+# src/jobs/JobQueue.py
+
+import datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+QueuedJob = Dict[str, Any]  # Contains 'id', 'user_id', 'filename', 'doc_type', 'payload_path', 'page_count', 'previous_document_id',
+                            # 'status', 'attempts', 'max_attempts', 'lease_owner', 'lease_expires_at', 'last_error'
+TenantStats = Dict[str, Any]  # Contains 'user_id', 'weight', 'queued', 'leased', 'oldest_wait_seconds', 'avg_wait_seconds'
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class SQLiteJobQueue:
+    """
+    Durable ingestion job queue in a local SQLite file.
+
+    Usable without any database server; every API and worker process on the host
+    shares the same file. Workers claim a job by taking a lease that they extend
+    with heartbeats. A job whose lease expires (its worker crashed or hung) becomes
+    claimable again, and each claim counts as an attempt.
+
+    Claims are fair across tenants (user_id): weighted fair queuing charges each
+    claim its page count divided by the tenant's weight against a per-tenant virtual
+    finish time, and the tenant furthest behind goes next. Documents of at most
+    `small_doc_pages` pages, and bulk documents that have waited longer than
+    `bulk_max_wait_seconds`, are claimed before the rest.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_attempts: Optional[int] = None,
+        small_doc_pages: Optional[int] = None,
+        bulk_max_wait_seconds: Optional[float] = None,
+    ):
+        """
+        Args:
+            db_path: Queue database file (env INGESTION_QUEUE_PATH).
+            max_attempts: Claims allowed per job before it is failed (env INGESTION_QUEUE_MAX_ATTEMPTS, default 3).
+            small_doc_pages: Largest page count for the priority lane (env INGESTION_SMALL_DOC_PAGES, default 10).
+            bulk_max_wait_seconds: Wait after which a bulk job joins the priority lane (env INGESTION_BULK_MAX_WAIT_SECONDS, default 300).
+        """
+        self.db_path = db_path or os.getenv(
+            "INGESTION_QUEUE_PATH",
+            os.path.join(tempfile.gettempdir(), "stackrag_ingestion_queue.sqlite3"),
+        )
+        self.max_attempts = max_attempts or int(os.getenv("INGESTION_QUEUE_MAX_ATTEMPTS", "3"))
+        self.small_doc_pages = small_doc_pages or int(os.getenv("INGESTION_SMALL_DOC_PAGES", "10"))
+        self.bulk_max_wait_seconds = bulk_max_wait_seconds or float(os.getenv("INGESTION_BULK_MAX_WAIT_SECONDS", "300"))
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Autocommit mode so claims can take an explicit write lock with BEGIN IMMEDIATE.
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_queue (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                doc_type TEXT NOT NULL,
+                payload_path TEXT NOT NULL,
+                page_count INTEGER NOT NULL DEFAULT 1,
+                previous_document_id TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                available_at REAL NOT NULL,
+                enqueued_at REAL NOT NULL,
+                claimed_at REAL,
+                updated_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(ingestion_queue)")}
+        if "page_count" not in columns:
+            self._conn.execute("ALTER TABLE ingestion_queue ADD COLUMN page_count INTEGER NOT NULL DEFAULT 1")
+        if "claimed_at" not in columns:
+            self._conn.execute("ALTER TABLE ingestion_queue ADD COLUMN claimed_at REAL")
+        if "previous_document_id" not in columns:
+            self._conn.execute("ALTER TABLE ingestion_queue ADD COLUMN previous_document_id TEXT")
+        if "auth_token" in columns:
+            # Queues created before workers required the service role key stored uploader JWTs
+            self._conn.execute("UPDATE ingestion_queue SET auth_token = NULL WHERE auth_token IS NOT NULL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_queue_claim ON ingestion_queue(status, available_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_queue_user ON ingestion_queue(user_id, status)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingestion_tenants (
+                user_id TEXT PRIMARY KEY,
+                weight REAL NOT NULL DEFAULT 1,
+                virtual_finish REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ingestion_fair_clock (id INTEGER PRIMARY KEY CHECK (id = 1), virtual_time REAL NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO ingestion_fair_clock (id, virtual_time) VALUES (1, 0)")
+        print(f"SQLiteJobQueue initialized at {self.db_path}")
+
+    def enqueue(
+        self,
+        job_id: str,
+        user_id: str,
+        filename: str,
+        doc_type: str,
+        payload_path: str,
+        page_count: Optional[int] = None,
+        previous_document_id: Optional[str] = None,
+    ) -> None:
+        """
+        Adds a job, or resets an existing job with the same id back to queued (used by retries).
+
+        `page_count` sets the job's lane and fair-share cost; when omitted on a
+        re-enqueue, the previously recorded count is kept. `previous_document_id`
+        marks the job as a new version of that document and is likewise kept.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO ingestion_queue (id, user_id, filename, doc_type, payload_path, page_count,
+                                             previous_document_id, status, attempts, max_attempts, available_at,
+                                             enqueued_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    payload_path = excluded.payload_path, status = excluded.status,
+                    page_count = CASE WHEN ? IS NULL THEN ingestion_queue.page_count ELSE excluded.page_count END,
+                    previous_document_id = COALESCE(excluded.previous_document_id, ingestion_queue.previous_document_id),
+                    attempts = 0, lease_owner = NULL, lease_expires_at = NULL, available_at = excluded.available_at,
+                    enqueued_at = excluded.enqueued_at, claimed_at = NULL, updated_at = excluded.updated_at, last_error = NULL
+                """,
+                (job_id, user_id, filename, doc_type, payload_path, max(1, page_count or 1),
+                 previous_document_id, QUEUED, self.max_attempts, now, now, now, page_count),
+            )
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[QueuedJob]:
+        """
+        Leases the next available job to `worker_id`.
+
+        Queued jobs and jobs whose lease has expired are both claimable. The priority
+        lane goes first; within a lane the tenant with the earliest virtual start
+        time wins, and a tenant's own jobs are taken oldest first.
+
+        Returns:
+            The claimed job, or None when nothing is available.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                virtual_time = self._conn.execute("SELECT virtual_time FROM ingestion_fair_clock WHERE id = 1").fetchone()[0]
+                row = self._conn.execute(
+                    """
+                    SELECT q.id, q.user_id, q.page_count, MAX(?, COALESCE(t.virtual_finish, 0)) AS virtual_start,
+                           COALESCE(t.weight, 1) AS weight
+                    FROM ingestion_queue q
+                    LEFT JOIN ingestion_tenants t ON t.user_id = q.user_id
+                    WHERE (q.status = ? AND q.available_at <= ?) OR (q.status = ? AND q.lease_expires_at < ?)
+                    ORDER BY CASE WHEN q.page_count <= ? OR q.enqueued_at < ? THEN 0 ELSE 1 END,
+                             virtual_start ASC,
+                             q.available_at ASC
+                    LIMIT 1
+                    """,
+                    (virtual_time, QUEUED, now, LEASED, now, self.small_doc_pages, now - self.bulk_max_wait_seconds),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    """
+                    INSERT INTO ingestion_tenants (user_id, virtual_finish) VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET virtual_finish = excluded.virtual_finish
+                    """,
+                    (row["user_id"], row["virtual_start"] + max(1, row["page_count"]) / row["weight"]),
+                )
+                self._conn.execute("UPDATE ingestion_fair_clock SET virtual_time = ? WHERE id = 1", (row["virtual_start"],))
+                self._conn.execute(
+                    """
+                    UPDATE ingestion_queue
+                    SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires_at = ?, claimed_at = ?, updated_at = ?
+                    WHERE id = ?
+                    """,
+                    (LEASED, worker_id, now + lease_seconds, now, now, row["id"]),
+                )
+                job = self._conn.execute("SELECT * FROM ingestion_queue WHERE id = ?", (row["id"],)).fetchone()
+                self._conn.execute("COMMIT")
+                return dict(job)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extends the lease. Returns False if the worker no longer holds it."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ingestion_queue SET lease_expires_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (now + lease_seconds, now, job_id, LEASED, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def reenqueue(self, job_id: str, user_id: str) -> bool:
+        """Resets the user's finished (done or failed) job back to queued for a retry. False if there is none."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE ingestion_queue SET status = ?, attempts = 0, available_at = ?, enqueued_at = ?, "
+                "lease_owner = NULL, lease_expires_at = NULL, claimed_at = NULL, updated_at = ?, last_error = NULL "
+                "WHERE id = ? AND user_id = ? AND status IN (?, ?)",
+                (QUEUED, now, now, now, job_id, user_id, DONE, FAILED),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str) -> None:
+        self._finish(job_id, worker_id, DONE, None)
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        """Marks a job permanently failed."""
+        self._finish(job_id, worker_id, FAILED, error)
+
+    def requeue(
+        self,
+        job_id: str,
+        worker_id: str,
+        delay_seconds: float = 0.0,
+        error: Optional[str] = None,
+        attempts: Optional[int] = None,
+    ) -> None:
+        """
+        Releases the lease and makes the job claimable again after `delay_seconds`.
+        `attempts` overwrites the claim count, e.g. to not charge a parked job for the claim.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingestion_queue SET status = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                "available_at = ?, updated_at = ?, last_error = ?, attempts = COALESCE(?, attempts) "
+                "WHERE id = ? AND lease_owner = ?",
+                (QUEUED, now + delay_seconds, now, error, attempts, job_id, worker_id),
+            )
+
+    def _finish(self, job_id: str, worker_id: str, status: str, error: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE ingestion_queue SET status = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                "updated_at = ?, last_error = ? WHERE id = ? AND lease_owner = ?",
+                (status, time.time(), error, job_id, worker_id),
+            )
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingestion_queue WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def stats(self) -> Dict[str, int]:
+        """Job counts per status."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM ingestion_queue GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def set_tenant_weight(self, user_id: str, weight: float) -> None:
+        """Gives a tenant `weight` times the default share of ingestion throughput."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingestion_tenants (user_id, weight) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET weight = excluded.weight",
+                (user_id, weight),
+            )
+
+    def tenant_stats(self, user_id: Optional[str] = None, window_seconds: float = 3600) -> List[TenantStats]:
+        """
+        Queue depth and wait times per tenant.
+
+        Args:
+            user_id: Restrict to one tenant.
+            window_seconds: Claims within this window are averaged into 'avg_wait_seconds'.
+
+        Returns:
+            One entry per tenant with queued or recently claimed jobs.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT q.user_id,
+                       COALESCE(MAX(t.weight), 1) AS weight,
+                       SUM(q.status = ?) AS queued,
+                       SUM(q.status = ?) AS leased,
+                       MAX(CASE WHEN q.status = ? THEN ? - q.enqueued_at END) AS oldest_wait_seconds,
+                       AVG(CASE WHEN q.claimed_at >= ? THEN q.claimed_at - q.enqueued_at END) AS avg_wait_seconds
+                FROM ingestion_queue q
+                LEFT JOIN ingestion_tenants t ON t.user_id = q.user_id
+                WHERE (? IS NULL OR q.user_id = ?) AND (q.status IN (?, ?) OR q.claimed_at >= ?)
+                GROUP BY q.user_id
+                ORDER BY queued DESC
+                """,
+                (QUEUED, LEASED, QUEUED, now, now - window_seconds, user_id, user_id, QUEUED, LEASED, now - window_seconds),
+            ).fetchall()
+        return [
+            {
+                **dict(row),
+                "oldest_wait_seconds": round(row["oldest_wait_seconds"] or 0.0, 3),
+                "avg_wait_seconds": round(row["avg_wait_seconds"], 3) if row["avg_wait_seconds"] is not None else None,
+            }
+            for row in rows
+        ]
+
+
+class SupabaseJobQueue:
+    """
+    Durable ingestion job queue in the Postgres `ingestion_queue` table.
+
+    Shared by API and worker processes on any number of machines. Claims and
+    heartbeats go through the `claim_ingestion_job` / `heartbeat_ingestion_job`
+    functions (scripts/8_ingestion_queue.sql), which use FOR UPDATE SKIP LOCKED so
+    concurrent workers never claim the same job. Claim order follows the same
+    tenant-fair, priority-lane policy as SQLiteJobQueue (scripts/9_ingestion_fairness.sql).
+    """
+
+    TABLE = "ingestion_queue"
+
+    def __init__(
+        self,
+        supabase_client: Any,
+        max_attempts: Optional[int] = None,
+        small_doc_pages: Optional[int] = None,
+        bulk_max_wait_seconds: Optional[float] = None,
+    ):
+        """
+        Args:
+            supabase_client: Supabase client; workers need the service role key.
+            max_attempts: Claims allowed per job before it is failed (env INGESTION_QUEUE_MAX_ATTEMPTS, default 3).
+            small_doc_pages: Largest page count for the priority lane (env INGESTION_SMALL_DOC_PAGES, default 10).
+            bulk_max_wait_seconds: Wait after which a bulk job joins the priority lane (env INGESTION_BULK_MAX_WAIT_SECONDS, default 300).
+        """
+        self.client = supabase_client
+        self.max_attempts = max_attempts or int(os.getenv("INGESTION_QUEUE_MAX_ATTEMPTS", "3"))
+        self.small_doc_pages = small_doc_pages or int(os.getenv("INGESTION_SMALL_DOC_PAGES", "10"))
+        self.bulk_max_wait_seconds = bulk_max_wait_seconds or float(os.getenv("INGESTION_BULK_MAX_WAIT_SECONDS", "300"))
+
+    @staticmethod
+    def _timestamp(offset_seconds: float = 0.0) -> str:
+        return (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=offset_seconds)).isoformat()
+
+    def enqueue(
+        self,
+        job_id: str,
+        user_id: str,
+        filename: str,
+        doc_type: str,
+        payload_path: str,
+        page_count: Optional[int] = None,
+        previous_document_id: Optional[str] = None,
+    ) -> None:
+        """
+        Adds a job; retries of an existing job go through `reenqueue`.
+        Goes through `enqueue_ingestion_job` (scripts/17_ingestion_queue_enqueue.sql),
+        which takes the owner from the caller's token and only accepts a
+        `payload_path` in their storage folder, so `user_id` is not sent.
+        """
+        self.client.rpc("enqueue_ingestion_job", {
+            "p_job_id": job_id,
+            "p_filename": filename,
+            "p_doc_type": doc_type,
+            "p_payload_path": payload_path,
+            "p_page_count": page_count,
+            "p_previous_document_id": previous_document_id,
+        }).execute()
+
+    def claim(self, worker_id: str, lease_seconds: float) -> Optional[QueuedJob]:
+        response = self.client.rpc("claim_ingestion_job", {
+            "p_worker_id": worker_id,
+            "p_lease_seconds": int(lease_seconds),
+            "p_small_doc_pages": self.small_doc_pages,
+            "p_bulk_max_wait_seconds": int(self.bulk_max_wait_seconds),
+        }).execute()
+        rows: List[QueuedJob] = response.data or []
+        if not rows:
+            return None
+        # Users create the rows, so the attempt limit is the worker's setting, not the row's.
+        return {**rows[0], "max_attempts": self.max_attempts}
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        response = self.client.rpc("heartbeat_ingestion_job", {
+            "p_job_id": job_id,
+            "p_worker_id": worker_id,
+            "p_lease_seconds": int(lease_seconds),
+        }).execute()
+        return bool(response.data)
+
+    def reenqueue(self, job_id: str, user_id: str) -> bool:
+        """
+        Resets the user's finished job back to queued for a retry. False if there is none.
+        Goes through `reenqueue_ingestion_job` (scripts/16_ingestion_queue_retry.sql),
+        which checks ownership with the caller's token, so `user_id` is not sent.
+        """
+        response = self.client.rpc("reenqueue_ingestion_job", {"p_job_id": job_id}).execute()
+        return bool(response.data)
+
+    def complete(self, job_id: str, worker_id: str) -> None:
+        self._finish(job_id, worker_id, {"status": DONE, "last_error": None})
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> None:
+        self._finish(job_id, worker_id, {"status": FAILED, "last_error": error})
+
+    def requeue(
+        self,
+        job_id: str,
+        worker_id: str,
+        delay_seconds: float = 0.0,
+        error: Optional[str] = None,
+        attempts: Optional[int] = None,
+    ) -> None:
+        fields: Dict[str, Any] = {
+            "status": QUEUED,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "available_at": self._timestamp(delay_seconds),
+            "last_error": error,
+        }
+        if attempts is not None:
+            fields["attempts"] = attempts
+        self.client.table(self.TABLE).update(fields).eq("id", job_id).eq("lease_owner", worker_id).execute()
+
+    def _finish(self, job_id: str, worker_id: str, fields: Dict[str, Any]) -> None:
+        self.client.table(self.TABLE).update({
+            **fields,
+            "lease_owner": None,
+            "lease_expires_at": None,
+        }).eq("id", job_id).eq("lease_owner", worker_id).execute()
+
+    def get(self, job_id: str) -> Optional[QueuedJob]:
+        response = self.client.table(self.TABLE).select("*").eq("id", job_id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    def stats(self) -> Dict[str, int]:
+        response = self.client.rpc("ingestion_queue_stats", {}).execute()
+        return {row["status"]: row["job_count"] for row in (response.data or [])}
+
+    def set_tenant_weight(self, user_id: str, weight: float) -> None:
+        self.client.table("ingestion_tenants").upsert({"user_id": user_id, "weight": weight}).execute()
+
+    def tenant_stats(self, user_id: Optional[str] = None, window_seconds: float = 3600) -> List[TenantStats]:
+        """Queue depth and wait times per tenant (callers without the service role only see their own)."""
+        response = self.client.rpc("ingestion_tenant_stats", {
+            "p_user_id": user_id,
+            "p_window_seconds": int(window_seconds),
+        }).execute()
+        return response.data or []
+
+
+_shared_sqlite_queue: Optional[SQLiteJobQueue] = None
+_shared_sqlite_queue_lock = threading.Lock()
+
+
+def get_job_queue(supabase_client: Any = None):
+    """
+    Returns the queue for INGESTION_QUEUE_BACKEND.
+
+    "sqlite" (default) is a process-wide queue on a local file. "postgres" uses the
+    Supabase `ingestion_queue` table through `supabase_client` (e.g. the uploader's
+    client when enqueueing); without one, a client is created with
+    SUPABASE_SERVICE_ROLE_KEY, which claiming jobs requires.
+    """
+    global _shared_sqlite_queue
+    backend = os.getenv("INGESTION_QUEUE_BACKEND", "sqlite").strip().lower()
+    if backend == "sqlite":
+        with _shared_sqlite_queue_lock:
+            if _shared_sqlite_queue is None:
+                _shared_sqlite_queue = SQLiteJobQueue()
+            return _shared_sqlite_queue
+    if backend == "postgres":
+        if supabase_client is None:
+            service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+            if not service_key:
+                raise ValueError("SUPABASE_SERVICE_ROLE_KEY must be set for ingestion workers using the postgres queue backend.")
+            from supabase import create_client
+            supabase_client = create_client(os.environ["SUPABASE_URL"], service_key)
+        return SupabaseJobQueue(supabase_client)
+    raise ValueError(f"Unsupported ingestion queue backend: {backend}")
@@ -0,0 +1,102 @@
+# src/jobs/PageCheckpointWriter.py
+
+import atexit
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class PageCheckpointWriter:
+    """
+    Background writer for per-page annotation checkpoints (`processing_job_pages`).
+
+    The parser reports each page as soon as its annotation succeeds, from page
+    scheduler threads, so `write` only buffers the row. A background thread upserts
+    each job's buffered pages in one request every `flush_interval` seconds;
+    `flush_job` writes a job's pages before returning (the pipeline calls it when
+    parsing ends, so a failed job's checkpoints are durable before it is marked
+    failed). A retry of the job reuses every checkpointed page whose fingerprint
+    still matches instead of annotating it again.
+    """
+
+    TABLE = "processing_job_pages"
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        """
+        Args:
+            flush_interval: Seconds between background flushes (env PAGE_CHECKPOINT_FLUSH_SECONDS, default 2).
+        """
+        self.flush_interval = flush_interval or float(os.getenv("PAGE_CHECKPOINT_FLUSH_SECONDS", "2"))
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[Any, List[Dict[str, Any]]]] = {}
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._counts = {"pages": 0, "db_writes": 0, "failed_writes": 0}
+
+    def write(self, supabase_client: Any, job_id: Any, user_id: Any, page_num: int, page_hash: str, markdown: str) -> None:
+        """Queues one annotated page (0-based `page_num`) for the next flush. Never blocks on I/O."""
+        row = {
+            "job_id": str(job_id),
+            "user_id": str(user_id),
+            "page_number": page_num + 1,
+            "page_hash": page_hash,
+            "markdown": markdown,
+        }
+        with self._lock:
+            _, rows = self._pending.get(str(job_id), (None, []))
+            rows.append(row)
+            self._pending[str(job_id)] = (supabase_client, rows)
+            self._counts["pages"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="page-checkpoint-writer", daemon=True)
+                self._thread.start()
+
+    def flush_job(self, job_id: Any) -> None:
+        """Writes the job's buffered pages now."""
+        with self._flush_lock:
+            with self._lock:
+                entry = self._pending.pop(str(job_id), None)
+            if entry is not None:
+                self._write_rows(str(job_id), *entry)
+
+    def flush(self) -> None:
+        """Writes every buffered page now."""
+        with self._lock:
+            job_ids = list(self._pending)
+        for job_id in job_ids:
+            self.flush_job(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counts, "pending_jobs": len(self._pending)}
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _write_rows(self, job_id: str, supabase_client: Any, rows: List[Dict[str, Any]]) -> None:
+        try:
+            supabase_client.table(self.TABLE).upsert(rows).execute()
+            with self._lock:
+                self._counts["db_writes"] += 1
+        except Exception as e:
+            # Checkpoints only save work on retry; losing some is never an error.
+            with self._lock:
+                self._counts["failed_writes"] += 1
+            print(f"Warning: Failed to checkpoint {len(rows)} pages for job {job_id}: {e}")
+
+
+_shared_page_checkpoint_writer: Optional[PageCheckpointWriter] = None
+_shared_page_checkpoint_writer_lock = threading.Lock()
+
+
+def get_page_checkpoint_writer() -> PageCheckpointWriter:
+    """Returns the process-wide page checkpoint writer; buffered pages are flushed at exit."""
+    global _shared_page_checkpoint_writer
+    with _shared_page_checkpoint_writer_lock:
+        if _shared_page_checkpoint_writer is None:
+            _shared_page_checkpoint_writer = PageCheckpointWriter()
+            atexit.register(_shared_page_checkpoint_writer.flush)
+        return _shared_page_checkpoint_writer
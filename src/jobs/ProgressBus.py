@@ -0,0 +1,148 @@
+# src/jobs/ProgressBus.py
+
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+ProgressEvent = Dict[str, Any]  # processing_jobs fields plus 'job_id' and 'version'
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+# processing_jobs columns clients see; timestamps like "now()" stay database-side.
+EVENT_FIELDS = (
+    "status",
+    "current_step",
+    "progress_percentage",
+    "document_id",
+    "error_message",
+    "error_code",
+    "retry_count",
+    "result_data",
+    "dedup_hit",
+)
+
+
+def _deliver(future: asyncio.Future, event: ProgressEvent) -> None:
+    if not future.done():
+        future.set_result(event)
+
+
+class ProgressBus:
+    """
+    In-process publish/subscribe for processing job progress.
+
+    Ingestion code publishes every progress change here before writing it to
+    `processing_jobs`, and the progress stream endpoints wait on it, so clients
+    get updates as they happen without polling the database. Each job keeps only
+    its latest state, stamped with a per-job version that increases with every
+    change; `wait_for(job_id, since)` returns as soon as the version passes `since`.
+    Publishing is safe from any thread or event loop.
+
+    Only jobs processed in this process (see `mark_local`) publish every step here;
+    for any other job readers must publish the stored row themselves, since the
+    process running it has its own bus.
+    """
+
+    def __init__(self, max_jobs: Optional[int] = None):
+        """
+        Args:
+            max_jobs: Jobs whose latest state is kept, least recently updated evicted first (env PROGRESS_BUS_MAX_JOBS, default 10000).
+        """
+        self.max_jobs = max_jobs or int(os.getenv("PROGRESS_BUS_MAX_JOBS", "10000"))
+        self._lock = threading.Lock()
+        self._latest: "OrderedDict[str, ProgressEvent]" = OrderedDict()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+        self._local: Dict[str, int] = {}
+
+    def publish(self, job_id: Any, fields: Dict[str, Any]) -> Optional[ProgressEvent]:
+        """
+        Merges the EVENT_FIELDS in `fields` into the job's state and wakes its subscribers.
+
+        Returns:
+            The new event, or None when `fields` changed nothing.
+        """
+        job_id = str(job_id)
+        fields = {key: value for key, value in fields.items() if key in EVENT_FIELDS}
+        if not fields:
+            return None
+        with self._lock:
+            previous = self._latest.get(job_id, {})
+            if previous and all(previous.get(key) == value for key, value in fields.items()):
+                return None
+            event = {**previous, **fields, "job_id": job_id, "version": previous.get("version", 0) + 1}
+            self._latest[job_id] = event
+            self._latest.move_to_end(job_id)
+            while len(self._latest) > self.max_jobs:
+                self._latest.popitem(last=False)
+            waiters = self._waiters.pop(job_id, [])
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_deliver, future, event)
+            except RuntimeError:  # subscriber's loop already closed
+                pass
+        return event
+
+    def mark_local(self, job_id: Any) -> None:
+        """Records that this process is processing the job, so its events here are complete."""
+        with self._lock:
+            self._local[str(job_id)] = self._local.get(str(job_id), 0) + 1
+
+    def unmark_local(self, job_id: Any) -> None:
+        with self._lock:
+            job_id = str(job_id)
+            remaining = self._local.get(job_id, 0) - 1
+            if remaining > 0:
+                self._local[job_id] = remaining
+            else:
+                self._local.pop(job_id, None)
+
+    def is_local(self, job_id: Any) -> bool:
+        with self._lock:
+            return str(job_id) in self._local
+
+    def latest(self, job_id: Any) -> Optional[ProgressEvent]:
+        with self._lock:
+            return self._latest.get(str(job_id))
+
+    async def wait_for(self, job_id: Any, since: int = 0, timeout: Optional[float] = None) -> Optional[ProgressEvent]:
+        """
+        Waits for a job event newer than version `since`.
+
+        Returns:
+            The latest event, or None if nothing newer arrived within `timeout` seconds.
+        """
+        job_id = str(job_id)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            event = self._latest.get(job_id)
+            if event is not None and event["version"] > since:
+                return event
+            future = loop.create_future()
+            self._waiters.setdefault(job_id, []).append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if not future.done() or future.cancelled():
+                with self._lock:
+                    waiters = self._waiters.get(job_id, [])
+                    if (loop, future) in waiters:
+                        waiters.remove((loop, future))
+                    if not waiters:
+                        self._waiters.pop(job_id, None)
+
+
+_shared_progress_bus: Optional[ProgressBus] = None
+_shared_progress_bus_lock = threading.Lock()
+
+
+def get_progress_bus() -> ProgressBus:
+    """Returns the process-wide progress bus."""
+    global _shared_progress_bus
+    with _shared_progress_bus_lock:
+        if _shared_progress_bus is None:
+            _shared_progress_bus = ProgressBus()
+        return _shared_progress_bus
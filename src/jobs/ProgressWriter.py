@@ -0,0 +1,106 @@
+# src/jobs/ProgressWriter.py
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from src.jobs.ProgressBus import ProgressBus, get_progress_bus
+
+_LOCK_STRIPES = 64
+
+
+class ProgressWriter:
+    """
+    Coalescing, non-blocking writer for `processing_jobs` progress.
+
+    `write` publishes the update to the progress bus at once (so streams see every
+    step, down to single pages) and only buffers the database write. Buffered
+    updates for a job are merged, and a background thread flushes each job's
+    latest state with one UPDATE every `flush_interval` seconds, so the number of
+    writes is bounded by time rather than by how often progress changes.
+    `write_now` is for states that must be durable before continuing (job start,
+    terminal states): it merges anything still buffered and writes immediately.
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None, progress_bus: Optional[ProgressBus] = None):
+        """
+        Args:
+            flush_interval: Seconds between background flushes (env PROGRESS_FLUSH_SECONDS, default 2).
+            progress_bus: Bus updates are published to; defaults to the process-wide bus.
+        """
+        self.flush_interval = flush_interval or float(os.getenv("PROGRESS_FLUSH_SECONDS", "2"))
+        self.progress_bus = progress_bus or get_progress_bus()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        # Serialises database writes per job so a slow flush can never land after a newer write.
+        self._job_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self._thread: Optional[threading.Thread] = None
+        self._counts = {"updates": 0, "db_writes": 0, "failed_writes": 0}
+
+    def write(self, supabase_client: Any, job_id: Any, fields: Dict[str, Any]) -> None:
+        """Publishes `fields` for the job now and queues them for the next flush. Never blocks on I/O."""
+        job_id = str(job_id)
+        self.progress_bus.publish(job_id, fields)
+        with self._lock:
+            _, pending = self._pending.get(job_id, (None, {}))
+            self._pending[job_id] = (supabase_client, {**pending, **fields})
+            self._counts["updates"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="progress-writer", daemon=True)
+                self._thread.start()
+
+    async def write_now(self, supabase_client: Any, job_id: Any, fields: Dict[str, Any]) -> None:
+        """Publishes `fields` and writes them, with anything buffered for the job, before returning."""
+        self.write(supabase_client, job_id, fields)
+        await asyncio.to_thread(self._flush_job, str(job_id), True)
+
+    def flush(self) -> None:
+        """Writes every buffered update now."""
+        with self._lock:
+            job_ids = list(self._pending)
+        for job_id in job_ids:
+            self._flush_job(job_id, False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counts, "pending_jobs": len(self._pending)}
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _flush_job(self, job_id: str, raise_errors: bool) -> None:
+        with self._job_locks[hash(job_id) % _LOCK_STRIPES]:
+            with self._lock:
+                entry = self._pending.pop(job_id, None)
+            if entry is None:
+                return
+            supabase_client, fields = entry
+            try:
+                supabase_client.table("processing_jobs").update(fields).eq("id", job_id).execute()
+                with self._lock:
+                    self._counts["db_writes"] += 1
+            except Exception as e:
+                with self._lock:
+                    self._counts["failed_writes"] += 1
+                if raise_errors:
+                    raise
+                print(f"Warning: Failed to write progress for job {job_id}: {e}")
+
+
+_shared_progress_writer: Optional[ProgressWriter] = None
+_shared_progress_writer_lock = threading.Lock()
+
+
+def get_progress_writer() -> ProgressWriter:
+    """Returns the process-wide progress writer; buffered updates are flushed at exit."""
+    global _shared_progress_writer
+    with _shared_progress_writer_lock:
+        if _shared_progress_writer is None:
+            _shared_progress_writer = ProgressWriter()
+            atexit.register(_shared_progress_writer.flush)
+        return _shared_progress_writer
@@ -0,0 +1,57 @@
+# src/jobs/worker.py
+"""Standalone ingestion worker.
+
+Claims jobs from the durable ingestion queue and processes them. Run as many
+of these as needed (on any host that can reach the queue) to scale ingestion
+throughput independently of the API replicas:
+
+    python -m src.jobs.worker --concurrency 4
+
+Set INGESTION_EMBEDDED_WORKERS=0 on the API when dedicated workers are used.
+`--stats` prints queue depth and wait times per tenant instead of processing.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+
+def main(argv=None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=None, help="Jobs processed at once (env INGESTION_WORKER_CONCURRENCY).")
+    parser.add_argument("--lease-seconds", type=float, default=None, help="Job lease length (env INGESTION_WORKER_LEASE_SECONDS).")
+    parser.add_argument("--stats", action="store_true", help="Print per-tenant queue depth and wait times, then exit.")
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        from src.jobs.JobQueue import get_job_queue
+        job_queue = get_job_queue()
+        print(json.dumps({"status": job_queue.stats(), "tenants": job_queue.tenant_stats()}, indent=2, default=str))
+        return 0
+
+    from src.jobs.IngestionWorker import IngestionWorker
+
+    async def run() -> None:
+        worker = IngestionWorker(concurrency=args.concurrency, lease_seconds=args.lease_seconds)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, worker.stop)
+            except NotImplementedError:  # pragma: no cover - Windows
+                pass
+        await worker.run_forever()
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
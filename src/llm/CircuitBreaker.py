@@ -0,0 +1,178 @@
+# src/llm/CircuitBreaker.py
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Status codes that mean the provider itself is failing, rather than the request
+OUTAGE_STATUS_CODES = (500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is unavailable (circuit open); retry in {retry_after:.0f}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+def is_outage_error(error: BaseException) -> bool:
+    """True for errors that indicate a provider outage: 5xx, UNAVAILABLE/overloaded, timeouts and connection failures."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    for attr in ("code", "status_code"):
+        if getattr(error, attr, None) in OUTAGE_STATUS_CODES:
+            return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    error_type = type(error).__name__.lower()
+    if "timeout" in error_type or "connect" in error_type:
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in ("503", "unavailable", "overloaded", "deadline_exceeded", "502 bad gateway"))
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker shared by every caller in the process.
+
+    Closed: calls go through; `failure_threshold` consecutive outage errors open
+    the circuit. Open: calls fail immediately with CircuitOpenError for
+    `open_seconds`. Half-open: one probe call is let through; success closes the
+    circuit, another outage error reopens it for twice as long (up to
+    `max_open_seconds`). Errors that show the provider is answering (429s, bad
+    requests) count as responses, not outages.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: Optional[int] = None,
+        open_seconds: Optional[float] = None,
+        max_open_seconds: Optional[float] = None,
+    ):
+        """
+        Args:
+            name: Provider name, e.g. "gemini".
+            failure_threshold: Consecutive outage errors that open the circuit (env LLM_BREAKER_FAILURES, default 5).
+            open_seconds: First open period (env LLM_BREAKER_OPEN_SECONDS, default 30).
+            max_open_seconds: Longest open period after repeated failed probes (env LLM_BREAKER_MAX_OPEN_SECONDS, default 300).
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "5")))
+        self.open_seconds = open_seconds or float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+        self.max_open_seconds = max(self.open_seconds, max_open_seconds or float(os.getenv("LLM_BREAKER_MAX_OPEN_SECONDS", "300")))
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._open_period = self.open_seconds
+        self._probe_started: Optional[float] = None
+        self._counts = {"opened": 0, "rejected": 0, "probes": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def is_open(self) -> bool:
+        """True while calls are rejected; False once a probe may go out."""
+        return self.retry_after() > 0
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a call through (0 when it would now)."""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN:
+                return max(0.0, self._open_until - now)
+            if self._state == self.HALF_OPEN and self._probe_in_flight_locked(now):
+                return max(0.0, self._probe_started + self.open_seconds - now)
+            return 0.0
+
+    def before_call(self) -> None:
+        """
+        Admits a call or raises CircuitOpenError. In half-open state only one caller
+        (the probe) is admitted until its outcome is recorded.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now >= self._open_until:
+                self._state = self.HALF_OPEN
+                self._probe_started = None
+            if self._state == self.HALF_OPEN and not self._probe_in_flight_locked(now):
+                self._probe_started = now
+                self._counts["probes"] += 1
+                print(f"Circuit for {self.name} half-open; sending a probe request.")
+                return
+            if self._state == self.CLOSED:
+                return
+            self._counts["rejected"] += 1
+            wait = self._open_until - now if self._state == self.OPEN else self._probe_started + self.open_seconds - now
+        raise CircuitOpenError(self.name, max(0.0, wait))
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                print(f"Circuit for {self.name} closed; provider is answering again.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._open_period = self.open_seconds
+            self._probe_started = None
+
+    def record_error(self, error: BaseException) -> None:
+        """Counts an outage error towards opening the circuit; any other error is a response."""
+        if isinstance(error, CircuitOpenError):
+            return
+        if not is_outage_error(error):
+            self.record_success()
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.HALF_OPEN:
+                self._open_period = min(self.max_open_seconds, self._open_period * 2)
+                self._open_locked(now, "probe failed")
+            elif self._state == self.CLOSED:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    self._open_locked(now, f"{self._failures} consecutive failures")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counts, "state": self._state, "consecutive_failures": self._failures}
+
+    def _open_locked(self, now: float, reason: str) -> None:
+        self._state = self.OPEN
+        self._open_until = now + self._open_period
+        self._probe_started = None
+        self._counts["opened"] += 1
+        print(f"Circuit for {self.name} opened ({reason}); rejecting calls for {self._open_period:.0f}s.")
+
+    def _probe_in_flight_locked(self, now: float) -> bool:
+        # A probe that never reports back (e.g. a cancelled call) stops blocking after open_seconds
+        return self._probe_started is not None and now - self._probe_started < self.open_seconds
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """Returns the process-wide breaker for a provider ("gemini" or "openai")."""
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(provider)
+        if breaker is None:
+            breaker = _circuit_breakers[provider] = CircuitBreaker(provider)
+        return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of every breaker created so far, keyed by provider."""
+    with _circuit_breakers_lock:
+        breakers = dict(_circuit_breakers)
+    return {provider: breaker.stats() for provider, breaker in breakers.items()}
@@ -5,6 +5,7 @@ from typing import List, Optional, Generator, Any
 from dotenv import load_dotenv
 from src.prompts.prompt_manager import PromptManager
 from src.config.gemini_config import DEFAULT_CHAT_MODEL
+from src.llm.RateLimiter import estimate_tokens, get_rate_limiter
 
 class GeminiClient:
     """Client for interacting with Google Gemini AI."""
@@ -68,10 +69,13 @@ class GeminiClient:
         """
         try:
             # Direct model call without chat history.
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=contents,
-                config=self.config
+            response = get_rate_limiter("gemini", self.model).call(
+                lambda: self.client.models.generate_content(
+                    model=self.model,
+                    contents=contents,
+                    config=self.config
+                ),
+                tokens=estimate_tokens(contents),
             )
             return response
         except Exception as e:
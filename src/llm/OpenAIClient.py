@@ -1,7 +1,8 @@
 import os
 from typing import List
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from src.llm.RateLimiter import PRIORITY_INTERACTIVE, estimate_tokens, get_rate_limiter
 from src.config.openai_config import EMBEDDING_MODEL
 
 
@@ -22,27 +23,42 @@ class OpenAIClient:
             api_key=self.api_key,
             # base_url="https://api.fireworks.ai/inference/v1",
         )
+        # Async client for callers running on the event loop (ingestion pipeline)
+        self.async_client = AsyncOpenAI(api_key=self.api_key)
 
         # Define the default embedding model
         self.embedding_model = EMBEDDING_MODEL # Or "nomic-ai/nomic-embed-text-v1.5" if using Fireworks base_url
+        # Quota shared with every other caller of this model in the process
+        self.rate_limiter = get_rate_limiter("openai", self.embedding_model)
 
         print(f"Initialized OpenAI client with model: {self.embedding_model}")
 
 
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def get_embeddings(self, texts: List[str], priority: str = PRIORITY_INTERACTIVE) -> List[List[float]]:
         """
         Gets embeddings for a list of texts.
 
         Args:
             texts: List of strings to embed.
+            priority: Rate limiter priority class; ingestion passes PRIORITY_BULK.
 
         Returns:
             List of embedding vectors.
         """
-        response = self.client.embeddings.create(
-            input=texts,
-            model=self.embedding_model
+        response = self.rate_limiter.call(
+            lambda: self.client.embeddings.create(input=texts, model=self.embedding_model),
+            tokens=estimate_tokens(texts),
+            priority=priority,
         )
         embeddings = [data.embedding for data in response.data]
 
-        return embeddings
\ No newline at end of file
+        return embeddings
+
+    async def aget_embeddings(self, texts: List[str], priority: str = PRIORITY_INTERACTIVE) -> List[List[float]]:
+        """Async variant of `get_embeddings` that does not block the event loop."""
+        response = await self.rate_limiter.acall(
+            lambda: self.async_client.embeddings.create(input=texts, model=self.embedding_model),
+            tokens=estimate_tokens(texts),
+            priority=priority,
+        )
+        return [data.embedding for data in response.data]
@@ -0,0 +1,448 @@
+# src/llm/RateLimiter.py
+
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from src.jobs.ClusterCoordinator import Coordinator, get_coordinator
+from src.llm.CircuitBreaker import CircuitBreaker, get_circuit_breaker
+
+T = TypeVar("T")
+
+# Provider quota defaults as (requests/min, tokens/min); 0 means unlimited.
+# Override per provider with <PROVIDER>_RPM / <PROVIDER>_TPM (e.g. GEMINI_RPM), or per
+# model with <PROVIDER>_<MODEL>_RPM, the model upper-cased with non-alphanumerics as "_"
+# (e.g. OPENAI_TEXT_EMBEDDING_3_SMALL_TPM).
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[int, int]] = {
+    "gemini": (1000, 1_000_000),
+    "openai": (3000, 1_000_000),
+}
+
+# Priority classes of LLM calls, highest first. A class waiting for budget holds back
+# every lower class, and lower classes leave headroom in the buckets (fractions of
+# the burst capacity) that only higher classes may spend, so chat stays responsive
+# while ingestion saturates the rest of the quota.
+PRIORITY_INTERACTIVE = "interactive"  # chat answers
+PRIORITY_METADATA = "metadata"  # per-document extraction
+PRIORITY_BULK = "bulk"  # page annotation, embeddings
+PRIORITIES: Tuple[str, ...] = (PRIORITY_INTERACTIVE, PRIORITY_METADATA, PRIORITY_BULK)
+DEFAULT_PRIORITY_HEADROOM: Dict[str, float] = {
+    PRIORITY_INTERACTIVE: 0.0,
+    PRIORITY_METADATA: 0.1,  # env LLM_PRIORITY_HEADROOM_METADATA
+    PRIORITY_BULK: 0.3,  # env LLM_PRIORITY_HEADROOM_BULK
+}
+
+# How long a caller held back by a higher-priority waiter sleeps before checking again.
+PREEMPTED_POLL_SECONDS = 0.05
+
+# Gemini bills every image (and PDF page) part at a flat token count.
+MEDIA_PART_TOKENS = 258
+
+
+def parse_retry_after_seconds(error_text: str) -> Optional[float]:
+    """Best-effort extraction of server-provided retry delays from Gemini errors."""
+    if not error_text:
+        return None
+
+    # Examples we may see:
+    # - "Please retry in 41.466s."
+    # - "'retryDelay': '41s'"
+    m = re.search(r"retry in\s+(\d+(?:\.\d+)?)s", error_text, flags=re.IGNORECASE)
+    if m:
+        return float(m.group(1))
+    m = re.search(r"retryDelay\s*['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", error_text, flags=re.IGNORECASE)
+    if m:
+        return float(m.group(1))
+    return None
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Server retry hint of a rate-limit error: Retry-After(-ms) headers, else the error text."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+    return parse_retry_after_seconds(str(error))
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED errors from the Gemini, OpenAI or pydantic-ai clients."""
+    for attr in ("code", "status_code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    text = str(error).lower()
+    return "resource_exhausted" in text or "rate limit" in text or "rate_limit" in text or "quota exceeded" in text or "429" in text
+
+
+def estimate_tokens(contents: Any) -> int:
+    """Rough input token count of request contents (text ~4 chars/token, media parts at a flat rate)."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    if isinstance(contents, (bytes, bytearray)) or getattr(contents, "inline_data", None) is not None:
+        return MEDIA_PART_TOKENS
+    text = getattr(contents, "text", None)
+    return estimate_tokens(text) if isinstance(text, str) else 0
+
+
+def response_tokens(response: Any) -> Optional[int]:
+    """Tokens a Gemini or OpenAI response was billed for, if it reports usage."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and getattr(usage, "total_token_count", None):
+        return int(usage.total_token_count)
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None):
+        return int(usage.total_tokens)
+    return None
+
+
+class RateLimiter:
+    """
+    Client-side limiter for one provider model: token buckets for requests/min and tokens/min.
+
+    Every caller acquires before sending a request, so concurrent pages, metadata
+    calls, embeddings and chat share one budget and stay under the quota instead of
+    discovering it through 429s. The rate adapts AIMD-style: each 429 cuts it by
+    `decrease_factor` (at most once per `decrease_cooldown` seconds, so a burst of
+    429s from one overload counts once) and pauses all callers for the server's
+    Retry-After hint; each success adds back `increase_fraction` of the configured
+    quota, climbing back to the ceiling.
+
+    Callers tag requests with a priority class (see PRIORITIES). Lower classes stop
+    short of their headroom in the buckets and yield while a higher class is
+    waiting, so queued bulk work is overtaken by chat instead of delaying it.
+
+    With a `coordinator` (see `get_coordinator`) the buckets and the adapted rate are
+    shared by every process using it, so the quota holds across API workers and
+    hosts rather than per process.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: Optional[float] = None,
+        min_rate_fraction: float = 0.05,
+        decrease_factor: float = 0.5,
+        increase_fraction: Optional[float] = None,
+        decrease_cooldown: float = 2.0,
+        max_retries: Optional[int] = None,
+        max_retry_wait: Optional[float] = None,
+        coordinator: Optional[Coordinator] = None,
+        priority_headroom: Optional[Dict[str, float]] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ):
+        """
+        Args:
+            name: Label for logs and stats, e.g. "gemini:gemini-2.0-flash".
+            requests_per_minute: Request quota; None or 0 means unlimited.
+            tokens_per_minute: Token quota; None or 0 means unlimited.
+            burst_seconds: Quota seconds that may be spent at once (env LLM_RATE_LIMIT_BURST_SECONDS, default 10).
+            min_rate_fraction: Floor for the adapted rate, as a fraction of the quota.
+            decrease_factor: Rate multiplier applied on a 429.
+            increase_fraction: Quota fraction added back per success (env LLM_RATE_LIMIT_INCREASE, default 0.02).
+            decrease_cooldown: Seconds after a decrease during which further 429s do not decrease again.
+            max_retries: Retries of a rate-limited call in `call`/`acall` (env LLM_RATE_LIMIT_RETRIES, default 3).
+            max_retry_wait: Longest Retry-After worth waiting for in `call`/`acall`; longer hints
+                (e.g. a daily quota) fail the call instead (env LLM_RATE_LIMIT_MAX_WAIT_SECONDS, default 60).
+            coordinator: Shares the limiter state between processes; None keeps it in this process.
+            priority_headroom: Bucket fraction each priority class must leave unspent
+                (default DEFAULT_PRIORITY_HEADROOM, env LLM_PRIORITY_HEADROOM_<CLASS>).
+            circuit_breaker: Provider breaker consulted and updated by `call`/`acall`.
+        """
+        self.name = name
+        self.requests_per_minute = requests_per_minute or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self.burst_seconds = burst_seconds or float(os.getenv("LLM_RATE_LIMIT_BURST_SECONDS", "10"))
+        self.min_rate_fraction = min_rate_fraction
+        self.decrease_factor = decrease_factor
+        self.increase_fraction = increase_fraction or float(os.getenv("LLM_RATE_LIMIT_INCREASE", "0.02"))
+        self.decrease_cooldown = decrease_cooldown
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+        self.max_retry_wait = max_retry_wait or float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+
+        self.priority_headroom = priority_headroom or {
+            priority: float(os.getenv(f"LLM_PRIORITY_HEADROOM_{priority.upper()}", headroom))
+            for priority, headroom in DEFAULT_PRIORITY_HEADROOM.items()
+        }
+        self.coordinator = coordinator
+        self.circuit_breaker = circuit_breaker
+        # Shared state is compared across processes, so it runs on wall-clock time
+        self._clock = time.monotonic if coordinator is None else time.time
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+        self._rate_fraction = 1.0  # last seen, for stats
+        self._counts = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "rate_limited": 0, "decreases": 0}
+        self._priority_waits = {priority: {"waited": 0, "wait_seconds": 0.0} for priority in PRIORITIES}
+
+    def acquire(self, tokens: int = 0, priority: str = PRIORITY_INTERACTIVE) -> float:
+        """Blocks until a request of `tokens` tokens fits the budget of `priority`; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            delay = self._reserve(tokens, priority)
+            if delay <= 0:
+                self._record_wait(waited, priority)
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def aacquire(self, tokens: int = 0, priority: str = PRIORITY_INTERACTIVE) -> float:
+        """Async variant of `acquire`."""
+        waited = 0.0
+        while True:
+            delay = await asyncio.to_thread(self._reserve, tokens, priority) if self.coordinator else self._reserve(tokens, priority)
+            if delay <= 0:
+                self._record_wait(waited, priority)
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def try_acquire(self, tokens: int = 0, priority: str = PRIORITY_INTERACTIVE) -> bool:
+        """Takes budget for a request only if it is available now; for optional requests such as hedges."""
+        return self._reserve(tokens, priority) <= 0
+
+    def record_success(self, reserved_tokens: int = 0, used_tokens: Optional[int] = None) -> None:
+        """Additive increase; settles the token bucket against the usage the response reported."""
+        def settle(state: Dict[str, Any]) -> None:
+            self._init_state(state)
+            state["fraction"] = min(1.0, state["fraction"] + self.increase_fraction)
+            if used_tokens is not None and self.tokens_per_minute:
+                capacity = self._capacity(self.tokens_per_minute)
+                state["token_level"] = max(-capacity, min(capacity, state["token_level"] + reserved_tokens - used_tokens))
+            self._rate_fraction = state["fraction"]
+
+        self._update_state(settle)
+
+    def record_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """Multiplicative decrease, and a pause for every caller until the server's retry hint passes."""
+        def throttle(state: Dict[str, Any]) -> bool:
+            self._init_state(state)
+            now = self._clock()
+            decreased = state["last_decrease"] is None or now - state["last_decrease"] >= self.decrease_cooldown
+            if decreased:
+                state["fraction"] = max(self.min_rate_fraction, state["fraction"] * self.decrease_factor)
+                state["last_decrease"] = now
+            # Empty the buckets so callers resume at the reduced rate rather than in a burst
+            state["request_level"] = min(state["request_level"], 0.0)
+            state["token_level"] = min(state["token_level"], 0.0)
+            state["paused_until"] = max(state["paused_until"], now + (retry_after if retry_after is not None else 1.0))
+            self._rate_fraction = state["fraction"]
+            return decreased
+
+        decreased = self._update_state(throttle)
+        with self._lock:
+            self._counts["rate_limited"] += 1
+            self._counts["decreases"] += int(decreased)
+        print(f"Rate limited by {self.name}; rate now {self._rate_fraction:.0%} of quota"
+              + (f", pausing {retry_after:.1f}s." if retry_after is not None else "."))
+
+    def call(self, fn: Callable[[], T], tokens: int = 0, priority: str = PRIORITY_INTERACTIVE) -> T:
+        """
+        Runs `fn` (one provider request) under the limiter, retrying it after a 429.
+
+        Raises:
+            CircuitOpenError without calling `fn` while the provider's circuit is open.
+            The rate-limit error once `max_retries` is used up or the server asks to wait
+            longer than `max_retry_wait`; any other error from `fn` immediately.
+        """
+        attempt = 0
+        while True:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.before_call()
+            self.acquire(tokens, priority)
+            try:
+                result = fn()
+            except Exception as e:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record_error(e)
+                if not self._should_retry(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_success()
+            self.record_success(tokens, response_tokens(result))
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], tokens: int = 0, priority: str = PRIORITY_INTERACTIVE) -> T:
+        """Async variant of `call`; `fn` returns a new awaitable per attempt."""
+        attempt = 0
+        while True:
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.before_call()
+            await self.aacquire(tokens, priority)
+            try:
+                result = await fn()
+            except Exception as e:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record_error(e)
+                if not is_rate_limit_error(e):
+                    raise
+                retry = await asyncio.to_thread(self._should_retry, e, attempt) if self.coordinator else self._should_retry(e, attempt)
+                if not retry:
+                    raise
+                attempt += 1
+                continue
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record_success()
+            if self.coordinator:
+                await asyncio.to_thread(self.record_success, tokens, response_tokens(result))
+            else:
+                self.record_success(tokens, response_tokens(result))
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counts,
+                "by_priority": {priority: dict(waits) for priority, waits in self._priority_waits.items()},
+                "rate_fraction": round(self._rate_fraction, 3),
+                "requests_per_minute": self.requests_per_minute and round(self.requests_per_minute * self._rate_fraction, 1),
+                "tokens_per_minute": self.tokens_per_minute and round(self.tokens_per_minute * self._rate_fraction),
+            }
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        """Records a rate-limit error; True if the call should be retried."""
+        if not is_rate_limit_error(error):
+            return False
+        retry_after = retry_after_seconds(error)
+        self.record_rate_limited(retry_after)
+        if attempt >= self.max_retries or (retry_after is not None and retry_after > self.max_retry_wait):
+            return False
+        return True
+
+    def _capacity(self, per_minute: Optional[float], fraction: float = 1.0) -> float:
+        if not per_minute:
+            return 0.0
+        return max(1.0, per_minute * fraction * self.burst_seconds / 60)
+
+    def _update_state(self, update: Callable[[Dict[str, Any]], T]) -> T:
+        """Applies `update` to the limiter state atomically, in this process or through the coordinator."""
+        if self.coordinator is not None:
+            return self.coordinator.update_state(f"rate-{self.name.replace(':', '-')}", update)
+        with self._lock:
+            return update(self._state)
+
+    def _init_state(self, state: Dict[str, Any]) -> None:
+        if not state:
+            state.update(
+                fraction=1.0,
+                request_level=self._capacity(self.requests_per_minute),
+                token_level=self._capacity(self.tokens_per_minute),
+                refilled_at=self._clock(),
+                paused_until=0.0,
+                last_decrease=None,
+            )
+        state.setdefault("waiting_until", {})
+
+    def _reserve(self, tokens: int, priority: str = PRIORITY_INTERACTIVE) -> float:
+        """
+        Takes one request and `tokens` from the buckets for `priority`; otherwise returns the
+        seconds until they may fit.
+        """
+        if priority not in self.priority_headroom:
+            raise ValueError(f"Unknown LLM call priority: {priority}")
+        headroom = self.priority_headroom[priority]
+        higher = PRIORITIES[:PRIORITIES.index(priority)] if priority in PRIORITIES else ()
+
+        def take(state: Dict[str, Any]) -> float:
+            self._init_state(state)
+            now = self._clock()
+            if now < state["paused_until"]:
+                return state["paused_until"] - now
+
+            elapsed = max(0.0, now - state["refilled_at"])
+            state["refilled_at"] = now
+            fraction = self._rate_fraction = state["fraction"]
+            request_rate = (self.requests_per_minute or 0) * fraction / 60
+            token_rate = (self.tokens_per_minute or 0) * fraction / 60
+            request_reserve = token_reserve = 0.0
+            if self.requests_per_minute:
+                request_capacity = self._capacity(self.requests_per_minute, fraction)
+                state["request_level"] = min(request_capacity, state["request_level"] + elapsed * request_rate)
+                request_reserve = headroom * request_capacity
+            needed = 0.0
+            if self.tokens_per_minute:
+                token_capacity = self._capacity(self.tokens_per_minute, fraction)
+                state["token_level"] = min(token_capacity, state["token_level"] + elapsed * token_rate)
+                token_reserve = headroom * token_capacity
+                # A request larger than the bucket goes through once the bucket is full
+                needed = min(tokens, token_capacity - token_reserve)
+
+            request_short = 1 + request_reserve - state["request_level"] if self.requests_per_minute else 0.0
+            token_short = needed + token_reserve - state["token_level"] if self.tokens_per_minute else 0.0
+            waiting_until = state["waiting_until"]
+            preempted = any(waiting_until.get(other, 0.0) > now for other in higher)
+            if request_short <= 0 and token_short <= 0 and not preempted:
+                if self.requests_per_minute:
+                    state["request_level"] -= 1
+                if self.tokens_per_minute:
+                    state["token_level"] -= needed
+                return 0.0
+            delay = max(
+                request_short / request_rate if request_short > 0 else 0.0,
+                token_short / token_rate if token_short > 0 else 0.0,
+                PREEMPTED_POLL_SECONDS if preempted else 0.0,
+            )
+            # Announce the wait so lower classes leave the next refill to this one
+            waiting_until[priority] = max(waiting_until.get(priority, 0.0), now + delay + PREEMPTED_POLL_SECONDS)
+            return delay
+
+        delay = self._update_state(take)
+        if delay <= 0:
+            with self._lock:
+                self._counts["acquired"] += 1
+        return delay
+
+    def _record_wait(self, waited: float, priority: str) -> None:
+        if waited > 0:
+            with self._lock:
+                self._counts["waited"] += 1
+                self._counts["wait_seconds"] += waited
+                waits = self._priority_waits.get(priority)
+                if waits is not None:
+                    waits["waited"] += 1
+                    waits["wait_seconds"] += waited
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter:
+    """
+    Returns the process-wide limiter for a provider model ("gemini" or "openai"), shared
+    cluster-wide when COORDINATION_BACKEND is set.
+    """
+    key = f"{provider}:{model}"
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            default_rpm, default_tpm = DEFAULT_RATE_LIMITS.get(provider, (0, 0))
+            prefix = provider.upper()
+            model_prefix = f"{prefix}_{re.sub(r'[^A-Za-z0-9]+', '_', model).upper()}"
+            rpm = os.getenv(f"{model_prefix}_RPM") or os.getenv(f"{prefix}_RPM") or default_rpm
+            tpm = os.getenv(f"{model_prefix}_TPM") or os.getenv(f"{prefix}_TPM") or default_tpm
+            limiter = _rate_limiters[key] = RateLimiter(
+                key, float(rpm), float(tpm), coordinator=get_coordinator(), circuit_breaker=get_circuit_breaker(provider)
+            )
+        return limiter
+
+
+def rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of every limiter created so far, keyed by provider:model."""
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return {key: limiter.stats() for key, limiter in limiters.items()}
@@ -0,0 +1,189 @@
+# src/llm/RequestHedger.py
+
+import collections
+import concurrent.futures
+import math
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestHedger:
+    """
+    Hedged requests against tail latency.
+
+    A request still running after the `percentile` latency observed so far gets a
+    duplicate; the first successful response wins and the other attempt is
+    cancelled if it has not started, otherwise its response is discarded when it
+    arrives. Hedges are capped at `budget` times the primary requests, so they cost
+    at most that fraction of extra quota. Latencies of every successful attempt,
+    hedges included, feed the percentile, so it tracks the provider's current state.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: Optional[float] = None,
+        budget: Optional[float] = None,
+        min_samples: Optional[int] = None,
+        window: int = 200,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Args:
+            name: Label for logs and thread names, e.g. "gemini:gemini-2.0-flash".
+            percentile: Latency percentile after which a request is hedged (env LLM_HEDGE_PERCENTILE, default 0.9).
+            budget: Hedges allowed per primary request (env LLM_HEDGE_BUDGET, default 0.05).
+            min_samples: Latencies needed before hedging starts (env LLM_HEDGE_MIN_SAMPLES, default 20).
+            window: Most recent latencies the percentile is computed over.
+            max_workers: Threads running attempts (env LLM_HEDGE_WORKERS, default 32).
+        """
+        self.name = name
+        self.percentile = percentile or float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+        self.budget = budget if budget is not None else float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+        self.min_samples = max(1, min_samples or int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")))
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(2, max_workers or int(os.getenv("LLM_HEDGE_WORKERS", "32"))),
+            thread_name_prefix=f"hedge-{name}",
+        )
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        self._counts = {
+            "requests": 0,
+            "hedges": 0,
+            "hedges_over_budget": 0,
+            "hedges_not_admitted": 0,
+            "hedge_wins": 0,
+            "saved_seconds": 0.0,
+        }
+
+    def hedge_after(self) -> Optional[float]:
+        """Seconds after which a request is hedged, or None while there are too few samples."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(self.percentile * len(ordered)) - 1)]
+
+    def call(
+        self,
+        fn: Callable[[], T],
+        admit: Optional[Callable[[], bool]] = None,
+        on_metric: Optional[Callable[[str, float], None]] = None,
+    ) -> T:
+        """
+        Runs `fn` (one provider request), hedging it with a second `fn()` once it is slow.
+
+        Args:
+            fn: Sends the request; called once more for the hedge.
+            admit: Asked before sending a hedge, e.g. to take rate limiter budget without waiting.
+            on_metric: Receives per-caller metrics: "hedged_requests", "hedge_wins" and
+                "hedge_saved_seconds" (reported when the slower attempt finishes).
+
+        Raises:
+            The primary attempt's error when no attempt succeeds.
+        """
+        with self._lock:
+            self._counts["requests"] += 1
+        threshold = self.hedge_after()
+        started_at = time.monotonic()
+        primary = self._submit(fn)
+        if threshold is None:
+            return primary.result()
+        try:
+            return primary.result(timeout=max(0.0, threshold - (time.monotonic() - started_at)))
+        except concurrent.futures.TimeoutError:
+            if primary.done():  # fn itself timed out
+                raise
+
+        with self._lock:
+            over_budget = self._counts["hedges"] + 1 > self.budget * self._counts["requests"]
+            if over_budget:
+                self._counts["hedges_over_budget"] += 1
+        if over_budget:
+            return primary.result()
+        if admit is not None and not admit():
+            with self._lock:
+                self._counts["hedges_not_admitted"] += 1
+            return primary.result()
+
+        with self._lock:
+            self._counts["hedges"] += 1
+        if on_metric is not None:
+            on_metric("hedged_requests", 1)
+        hedge = self._submit(fn)
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is None:
+                continue
+            for loser in pending:
+                if not loser.cancel() and winner is hedge:
+                    loser.add_done_callback(self._saved_time_recorder(winner, loser, on_metric))
+            if winner is hedge:
+                with self._lock:
+                    self._counts["hedge_wins"] += 1
+                if on_metric is not None:
+                    on_metric("hedge_wins", 1)
+            return winner.result()
+        return primary.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        counts["saved_seconds"] = round(counts["saved_seconds"], 3)
+        counts["hedge_after_seconds"] = self.hedge_after()
+        return counts
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn: Callable[[], T]) -> concurrent.futures.Future:
+        timing = {"started_at": time.monotonic()}
+
+        def attempt() -> T:
+            result = fn()
+            timing["finished_at"] = time.monotonic()
+            with self._lock:
+                self._latencies.append(timing["finished_at"] - timing["started_at"])
+            return result
+
+        future = self._executor.submit(attempt)
+        future.timing = timing  # type: ignore[attr-defined]
+        return future
+
+    def _saved_time_recorder(
+        self,
+        winner: concurrent.futures.Future,
+        loser: concurrent.futures.Future,
+        on_metric: Optional[Callable[[str, float], None]],
+    ) -> Callable[[concurrent.futures.Future], None]:
+        """Done-callback for a primary beaten by its hedge: how much later it would have answered."""
+        def record(_future: concurrent.futures.Future) -> None:
+            if loser.cancelled() or loser.exception() is not None:
+                return
+            saved = max(0.0, loser.timing["finished_at"] - winner.timing["finished_at"])  # type: ignore[attr-defined]
+            with self._lock:
+                self._counts["saved_seconds"] += saved
+            if on_metric is not None:
+                on_metric("hedge_saved_seconds", saved)
+        return record
+
+
+_request_hedgers: Dict[str, RequestHedger] = {}
+_request_hedgers_lock = threading.Lock()
+
+
+def get_request_hedger(provider: str, model: str) -> RequestHedger:
+    """Returns the process-wide hedger for a provider model, so latency samples and budget are shared."""
+    key = f"{provider}:{model}"
+    with _request_hedgers_lock:
+        hedger = _request_hedgers.get(key)
+        if hedger is None:
+            hedger = _request_hedgers[key] = RequestHedger(key)
+        return hedger
@@ -5,6 +5,10 @@ Chat provider selection is controlled by environment variables:
 - GEMINI_CHAT_MODEL: overrides the default Gemini model
 - OPENAI_CHAT_MODEL: overrides the default OpenAI chat model
 
+While the configured provider's circuit breaker is open, chat fails over to the
+other provider if its API key is set, otherwise it answers at once that the
+service is unavailable.
+
 Note: document retrieval currently uses OpenAI embeddings via OpenAIClient.
 """
 
@@ -25,7 +29,9 @@ from supabase import create_client
 from src.llm.tools.FunctionCaller import RetrievalService
 from src.llm.tools.PythonCalculatorTool import PythonCalculationTool
 from typing import AsyncGenerator, Any
+from src.llm.CircuitBreaker import CircuitOpenError, get_circuit_breaker
 from src.llm.OpenAIClient import OpenAIClient
+from src.llm.RateLimiter import PRIORITY_INTERACTIVE, estimate_tokens, get_rate_limiter
 from src.storage.SupabaseService import SupabaseService
 from src.prompts.prompt_manager import PromptManager
 from src.config.gemini_config import DEFAULT_CHAT_MODEL
@@ -231,6 +237,19 @@ def _strip_obvious_plotting_code(text: str) -> str:
         cleaned.append(line)
     return "\n".join(cleaned).strip()
 
+def _available_chat_provider() -> str | None:
+    """CHAT_PROVIDER; while its circuit is open, the other provider if configured and up; None if neither can answer."""
+    if not get_circuit_breaker(CHAT_PROVIDER).is_open():
+        return CHAT_PROVIDER
+    fallback = "gemini" if CHAT_PROVIDER == "openai" else "openai"
+    if f"{fallback.upper()}_API_KEY" in os.environ and not get_circuit_breaker(fallback).is_open():
+        print(f"[DEBUG] {CHAT_PROVIDER} circuit open; failing over to {fallback}")
+        return fallback
+    return None
+
+def _provider_unavailable_message(retry_after: float) -> str:
+    return f"The AI service is temporarily unavailable. Please try again in about {max(1, round(retry_after))} seconds."
+
 def create_system_prompt(**user_details):
     return PromptManager.get_prompt(
         "chat_system_prompt",
@@ -251,6 +270,11 @@ async def run_react_rag(
     # authenticate on each call
     supabase_client.options.headers["Authorization"] = f"Bearer {session.token}"
     user_id = session.user_id
+    # Fail over, or answer at once, instead of waiting on a provider that is down
+    chat_provider = _available_chat_provider()
+    if chat_provider is None:
+        yield _provider_unavailable_message(get_circuit_breaker(CHAT_PROVIDER).retry_after())
+        return
     # get current date for system prompt (timezone-aware UTC)
     current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
@@ -280,12 +304,13 @@ async def run_react_rag(
     )
     #calculator = PythonCalculationTool()
     # Chat model provider configuration (default: Gemini)
-    if CHAT_PROVIDER == "openai":
+    if chat_provider == "openai":
         if "OPENAI_API_KEY" not in os.environ:
             raise EnvironmentError("OPENAI_API_KEY must be set as an environment variable")
         openai_key = os.environ["OPENAI_API_KEY"]
         provider = OpenAIProvider(api_key=openai_key)
         model = OpenAIModel(OPENAI_MODEL_NAME, provider=provider)
+        rate_limiter = get_rate_limiter("openai", OPENAI_MODEL_NAME)
         print(f"[DEBUG] Chat provider=openai model={OPENAI_MODEL_NAME}")
     else:
         if "GEMINI_API_KEY" not in os.environ:
@@ -293,6 +318,7 @@ async def run_react_rag(
         gemini_key = os.environ["GEMINI_API_KEY"]
         provider = GoogleProvider(api_key=gemini_key)
         model = GoogleModel(GEMINI_MODEL_NAME, provider=provider)
+        rate_limiter = get_rate_limiter("gemini", GEMINI_MODEL_NAME)
         print(f"[DEBUG] Chat provider=gemini model={GEMINI_MODEL_NAME}")
 
     # ensure message_history is JSON serializable
@@ -304,7 +330,7 @@ async def run_react_rag(
     # Workaround: run retrieval server-side and feed retrieved context to Gemini (no tools).
     retrieval_json: str | None = None
     preferred_pdfnav_payload: dict | None = None
-    if CHAT_PROVIDER != "openai":
+    if chat_provider != "openai":
         try:
             retrieval_json = retrieval.retrieve_chunks(query_text=user_input, match_count=50)
             preferred_pdfnav_payload = _best_effort_pdfnav_from_retrieval_json(retrieval_json)
@@ -315,9 +341,9 @@ async def run_react_rag(
 
     try:
         augmented_system_prompt = system_prompt
-        tools_for_agent = [retrieval.retrieve_chunks] if CHAT_PROVIDER == "openai" else []
+        tools_for_agent = [retrieval.retrieve_chunks] if chat_provider == "openai" else []
 
-        if CHAT_PROVIDER != "openai" and retrieval_json:
+        if chat_provider != "openai" and retrieval_json:
             retrieval_block = _retrieval_context_for_prompt(retrieval_json)
             if retrieval_block:
                 augmented_system_prompt = (
@@ -339,7 +365,12 @@ async def run_react_rag(
         require_meaningful_chart = _should_require_visual_chart(user_input)
 
         async def run_once(prompt: str) -> str:
-            result = await agent.run(prompt, message_history=same_history_as_step_1)
+            # One budget slot per agent run (a tool-calling run may make a few model requests)
+            result = await rate_limiter.acall(
+                lambda: agent.run(prompt, message_history=same_history_as_step_1),
+                tokens=estimate_tokens([augmented_system_prompt, prompt]),
+                priority=PRIORITY_INTERACTIVE,
+            )
             return (result.data or "").strip()
 
         # Attempt 1: normal
@@ -389,6 +420,8 @@ async def run_react_rag(
         for chunk in _chunk_text_for_sse(answer, chunk_size=80):
             yield chunk
 
+    except CircuitOpenError as e:
+        yield _provider_unavailable_message(e.retry_after)
     except Exception:
         # Keep errors user-friendly; stack trace is still printed server-side.
         traceback.print_exc()
@@ -1,12 +1,45 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from api import router as api_router
+from api.v1.upload_limits import UploadSizeLimitMiddleware
 
 load_dotenv()  # Load environment variables once for dependencies
 
-app = FastAPI(title="Backend API with Supabase Auth", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Single-box deployments process queued ingestion jobs inside the API process.
+    # Set INGESTION_EMBEDDED_WORKERS=0 when running standalone `python -m src.jobs.worker`.
+    # Workers need SUPABASE_SERVICE_ROLE_KEY.
+    worker, worker_task = None, None
+    if os.getenv("INGESTION_EMBEDDED_WORKERS", "1") != "0":
+        from src.jobs.IngestionWorker import IngestionWorker
+        worker = IngestionWorker()
+        worker_task = asyncio.create_task(worker.run_forever())
+    yield
+    # Let uploads still going to storage finish so their jobs get queued.
+    from api.v1.endpoints.document_process import drain_background_uploads
+    await drain_background_uploads()
+    if worker is not None:
+        worker.stop()
+        # In-flight jobs get INGESTION_SHUTDOWN_GRACE_SECONDS to finish; jobs still
+        # running after that are cancelled and reclaimed by another worker once their leases expire.
+        try:
+            await asyncio.wait_for(worker_task, timeout=float(os.getenv("INGESTION_SHUTDOWN_GRACE_SECONDS", "30")))
+        except asyncio.TimeoutError:
+            pass
+
+
+app = FastAPI(title="Backend API with Supabase Auth", version="1.0.0", lifespan=lifespan)
+
+# Added before CORS so its 413 responses still get CORS headers.
+app.add_middleware(UploadSizeLimitMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
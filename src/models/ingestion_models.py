@@ -3,7 +3,7 @@
 import uuid
 from typing import Dict, Any
 
-ParsingResult = Dict[str, Any] # Contains 'markdown_content', 'page_count', 'error'
+ParsingResult = Dict[str, Any] # Contains 'markdown_content', 'page_count', 'error', 'stats', 'page_hashes'
 
 SectionData = Dict[str, Any] # Contains 'document_id', 'user_id', 'section_heading',
                              # 'page_numbers', 'content_markdown', 'section_index', 'id' (after saving)
@@ -12,4 +12,4 @@ ChunkData = Dict[str, Any] # Contains 'section_id', 'document_id', 'user_id',
                            # 'chunk_text', 'chunk_index', 'start_char_index', 'end_char_index',
                            # 'embedding', 'embedding_model', 'doc_specific_type',
                            # 'doc_year', 'doc_quarter', 'company_name', 'report_date',
-                           # 'section_heading', 'metadata'
\ No newline at end of file
+                           # 'section_heading', 'metadata', 'embedding_reused' (taken from a previous version)
\ No newline at end of file
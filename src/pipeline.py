@@ -1,9 +1,13 @@
 # src/pipeline.py
 
+import asyncio
+import io
+import threading
 import time
 import uuid
-from typing import IO, Optional, Dict, Any
+from typing import IO, Optional, Dict, Any, List, Union
 
+from src.llm.CircuitBreaker import CircuitOpenError
 from src.llm.GeminiClient import GeminiClient
 from src.llm.OpenAIClient import OpenAIClient
 from src.services.FinancialDocParser import FinancialDocParser
@@ -18,6 +22,9 @@ from src.services.Sectioner import Sectioner
 from src.services.ChunkingService import ChunkingService
 from src.services.EmbeddingService import EmbeddingService
 from src.storage.SupabaseService import SupabaseService
+from src.services.StageGraph import StageFailed, StageGraph
+from src.jobs.PageCheckpointWriter import get_page_checkpoint_writer
+from src.jobs.ProgressWriter import get_progress_writer
 
 PipelineResult = Dict[str, Any]
 
@@ -57,63 +64,267 @@ class IngestionPipeline:
 
 
     def _update_job_progress(self, job_id: Optional[uuid.UUID], status: str, step: str, progress: int):
-        """Helper to update processing job progress in database."""
+        """Helper to push processing job progress to subscribers; the database write is coalesced in the background."""
         if not job_id:
             return
-        try:
-            self.supabase_service.client.table("processing_jobs").update({
-                "status": status,
-                "current_step": step,
-                "progress_percentage": progress
-            }).eq("id", str(job_id)).execute()
-        except Exception as e:
-            print(f"Warning: Failed to update job progress: {e}")
+        get_progress_writer().write(self.supabase_service.client, job_id, {
+            "status": status,
+            "current_step": step,
+            "progress_percentage": progress
+        })
 
     async def run(
         self,
-        pdf_file_buffer: IO[bytes],
+        pdf_file_buffer: Union[IO[bytes], str],
         user_id: uuid.UUID,
         original_filename: str,
         doc_type: str,
-        job_id: Optional[uuid.UUID] = None
+        job_id: Optional[uuid.UUID] = None,
+        storage_path: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        previous_document_id: Optional[uuid.UUID] = None
     ) -> PipelineResult:
         """
         Executes the full ingestion pipeline for a single document.
 
+        Stages run as a dependency graph (see `_build_stage_graph`) rather than in
+        sequence: the storage upload starts alongside parsing, sectioning overlaps
+        metadata extraction, and chunks are embedded while the document and section
+        rows are written, so latency tracks the critical path.
+
+        Never blocks the event loop: LLM and embedding calls use async clients, and
+        work with no async client (PDF parsing, supabase-py, sectioning, chunking)
+        runs in worker threads.
+
         Args:
-            pdf_file_buffer: File buffer containing PDF bytes.
+            pdf_file_buffer: Path of the PDF, or a file buffer containing its bytes. A path
+                is handed to the parser and the storage upload as is, so the PDF is never
+                held in memory; a buffer is read once.
             user_id: UUID of the authenticated user.
             original_filename: The original filename.
             doc_type: The file type ('pdf', etc.).
-            job_id: Optional processing job ID for progress updates.
+            job_id: Optional processing job ID for progress updates. Pages are checkpointed
+                under it as they are annotated, and a later run with the same job_id
+                (a retry) only annotates pages that have no checkpoint.
+            storage_path: Path of the PDF if it is already in storage (queued jobs); the
+                upload stage is skipped and the file is kept if ingestion fails.
+            content_hash: SHA-256 of the PDF if the caller already computed it; stored on
+                the document so identical re-uploads can be deduplicated.
+            previous_document_id: Completed document this file is a new version of. Pages
+                and chunk embeddings unchanged since that version are reused, the new
+                version is staged, and it replaces the previous one in a single swap once
+                it is complete; until then searches keep seeing the previous version.
 
         Returns:
             A dictionary indicating success or failure.
+
+        Raises:
+            CircuitOpenError: A provider went down mid-run. Partial results are cleaned
+                up as for a failure, but the error is passed on so the job can be parked.
         """
         print(f"\n--- Starting Ingestion Pipeline for: {original_filename} (User: {user_id}) ---")
         start_time = time.time()
 
-        document_id: Optional[uuid.UUID] = None
+        if isinstance(pdf_file_buffer, str):
+            pdf_source: Union[bytes, str] = pdf_file_buffer
+            content_hash = content_hash or await asyncio.to_thread(SupabaseService.hash_file, pdf_file_buffer)
+        else:
+            pdf_file_buffer.seek(0)
+            pdf_source = pdf_file_buffer.read()
+            content_hash = content_hash or await asyncio.to_thread(SupabaseService.hash_content, pdf_source)
+        graph = self._build_stage_graph(
+            pdf_source, user_id, original_filename, doc_type, job_id, storage_path, content_hash, previous_document_id
+        )
+        owns_upload = storage_path is None
+        versioned = previous_document_id is not None
 
         try:
-            # --- Step 1: Parse PDF to Markdown ---
+            results = await graph.run()
+        except StageFailed as e:
+            return await self._fail_run(graph, str(e), owns_upload, versioned)
+        except CircuitOpenError as e:
+            print(f"Ingestion interrupted: {e}")
+            await self._fail_run(graph, str(e), owns_upload, versioned)
+            raise
+        except Exception as e:
+            error_msg = f"An unexpected error occurred in the ingestion pipeline: {e}"
+            print(error_msg)
+            return await self._fail_run(graph, error_msg, owns_upload, versioned)
+        finally:
+            print(f"\nStage timings (critical path {graph.critical_path_seconds():.2f}s): {graph.timings}")
+
+        document_id = results["document_record"]
+        chunk_count = results["save_chunks"]
+        if job_id:
+            # The document now holds every page; checkpoints only matter to failed jobs.
+            await asyncio.to_thread(self.supabase_service.delete_page_checkpoints, job_id)
+        total_time = time.time() - start_time
+        parse_stats = results["parse"].get("stats") or {}
+        pages_resumed = sum(1 for page_hash in results["parse"].get("page_hashes") or [] if page_hash in results["checkpoints"])
+        result: PipelineResult = {
+            "success": True,
+            "document_id": document_id,
+            "chunk_count": chunk_count,
+            "pages_resumed": pages_resumed,
+            "parse_stats": parse_stats,
+            "stage_timings": graph.timings,
+        }
+        if versioned:
+            result["previous_document_id"] = str(previous_document_id)
+            result["pages_reused"] = max(0, parse_stats.get("pages_reused", 0) - pages_resumed)
+            result["embeddings_reused"] = sum(1 for chunk in results["embed"] if chunk.get("embedding_reused"))
+        if chunk_count == 0:
+            print(f"\n--- Ingestion Pipeline Completed (No Chunks) for {original_filename} in {total_time:.2f} seconds ---")
+            result["message"] = "Pipeline completed, but no chunks were generated."
+        else:
+            print(f"\n--- Ingestion Pipeline Successfully Completed for {original_filename} in {total_time:.2f} seconds ---")
+            result["message"] = "Document processed and ingested successfully."
+        return result
+
+    async def _fail_run(self, graph: StageGraph, error_msg: str, owns_upload: bool, versioned: bool = False) -> PipelineResult:
+        """
+        Marks a saved document as failed, or removes an orphaned upload, and builds the failure result.
+
+        A failed new version is deleted instead: the previous version stays live and
+        untouched, and a retry starts a fresh staging document.
+        """
+        document_id = graph.results.get("document_record")
+        storage_path = graph.results.get("upload")
+        if document_id and versioned:
+            print(f"Discarding staged version {document_id}; the previous version stays live.")
+            await asyncio.to_thread(self.supabase_service.delete_document, document_id)
+            document_id = None
+        elif document_id:
+            print(f"Attempting to mark document {document_id} as failed...")
+            await asyncio.to_thread(self.supabase_service.update_document_status, document_id, "failed")
+        elif storage_path and owns_upload:
+            await asyncio.to_thread(self.supabase_service.delete_pdf_from_storage, storage_path)
+        return {"success": False, "message": error_msg, "document_id": document_id, "stage_timings": graph.timings}
+
+    def _build_stage_graph(
+        self,
+        pdf_source: Union[bytes, str],
+        user_id: uuid.UUID,
+        original_filename: str,
+        doc_type: str,
+        job_id: Optional[uuid.UUID],
+        storage_path: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        previous_document_id: Optional[uuid.UUID] = None,
+    ) -> StageGraph:
+        """
+        Declares the ingestion stages and their dependencies.
+
+            previous_version, checkpoints,
+            upload                             (start immediately)
+            parse                              <- previous_version, checkpoints
+            metadata, sections                 <- parse
+            document_record                    <- upload, metadata
+            summary                            <- document_record, metadata
+            save_pages                         <- parse, document_record
+            save_sections                      <- sections, document_record
+            chunks                             <- sections, metadata
+            embed                              <- chunks, previous_version
+            save_chunks                        <- embed, save_sections
+            finalize                           <- save_chunks, summary, save_pages
+
+        `pdf_source` is the PDF's path or its bytes.
+        Sections and chunks are built before the document and section rows exist;
+        `save_sections` and `save_chunks` stamp the database ids onto them.
+        `previous_version` only does work when `previous_document_id` is given, and
+        `checkpoints` (pages annotated by earlier attempts of the job) when `job_id` is.
+        """
+        graph = StageGraph(name=f"ingest:{original_filename}")
+        progress = {"percentage": 0}
+        progress_lock = threading.Lock()
+
+        def report(status: str, step: str, percentage: int) -> None:
+            # Stages overlap (and pages report from parser threads), so never move the job's progress back.
+            with progress_lock:
+                if percentage < progress["percentage"]:
+                    return
+                progress["percentage"] = percentage
+                self._update_job_progress(job_id, status, step, percentage)
+
+        def open_pdf() -> Union[IO[bytes], str]:
+            return pdf_source if isinstance(pdf_source, str) else io.BytesIO(pdf_source)
+
+        def report_pages(pages_done: int, total_pages: int) -> None:
+            # Parsing spans 15-24%; per-page steps only reach subscribers, not one database write each.
+            report("parsing", f"Reading page {pages_done} of {total_pages}...", 15 + (9 * pages_done) // total_pages)
+
+        async def previous_version(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            if not previous_document_id:
+                return None
+            print(f"\nStep 0: Loading previous version {previous_document_id}...")
+            base = await asyncio.to_thread(self.supabase_service.get_document_version_base, previous_document_id, user_id)
+            if not base:
+                error_msg = f"Previous version {previous_document_id} not found or not completed."
+                print(error_msg)
+                raise StageFailed(error_msg)
+
+            def build_reuse() -> Dict[str, Any]:
+                page_markdown = self.parser.split_combined_markdown(base.get("full_markdown_content") or "")
+                reuse_pages = {
+                    page_hash: page_markdown[page_number - 1]
+                    for page_number, page_hash in base["page_hashes"].items()
+                    if page_number - 1 in page_markdown
+                }
+                return {"reuse_pages": reuse_pages, "reuse_index": self.embedding_service.build_reuse_index(base["chunks"])}
+
+            # Splitting the whole previous markdown and decoding every stored embedding is CPU-bound.
+            reuse = await asyncio.to_thread(build_reuse)
+            print(f"Previous version offers {len(reuse['reuse_pages'])} reusable pages and {len(reuse['reuse_index'])} reusable embeddings.")
+            return reuse
+
+        async def checkpoints(results: Dict[str, Any]) -> Dict[str, str]:
+            if not job_id:
+                return {}
+            checkpoint_pages = await asyncio.to_thread(self.supabase_service.get_page_checkpoints, job_id)
+            if checkpoint_pages:
+                print(f"\nResuming job {job_id}: {len(checkpoint_pages)} pages were annotated by an earlier attempt.")
+            return checkpoint_pages
+
+        async def parse(results: Dict[str, Any]) -> ParsingResult:
             print("\nStep 1: Parsing PDF to Markdown...")
-            self._update_job_progress(job_id, "parsing", "Reading PDF...", 15)
-            parsing_result: ParsingResult = self.parser.parse_pdf_to_markdown(pdf_file_buffer)
+            report("parsing", "Reading PDF...", 15)
+            base = results["previous_version"] or {}
+            page_callback = None
+            if job_id:
+                checkpoint_writer = get_page_checkpoint_writer()
+
+                def page_callback(page_num: int, page_hash: str, markdown: str) -> None:
+                    checkpoint_writer.write(self.supabase_service.client, job_id, user_id, page_num, page_hash, markdown)
+
+            try:
+                parsing_result: ParsingResult = await asyncio.to_thread(
+                    self.parser.parse_pdf_to_markdown,
+                    open_pdf(),
+                    job_key=str(job_id) if job_id else None,
+                    user_key=str(user_id),
+                    progress_callback=report_pages if job_id else None,
+                    reuse_pages={**base.get("reuse_pages", {}), **results["checkpoints"]},
+                    page_callback=page_callback,
+                    fingerprint_pages=bool(job_id or previous_document_id),
+                )
+            finally:
+                if job_id:
+                    # Durable before the job can be marked failed and retried.
+                    await asyncio.to_thread(checkpoint_writer.flush_job, job_id)
             if parsing_result.get("error") or not parsing_result.get("markdown_content"):
                 error_msg = f"Parsing failed: {parsing_result.get('error', 'No markdown content generated.')}"
                 print(error_msg)
-                return {"success": False, "message": error_msg}
-            combined_markdown = parsing_result["markdown_content"]
-            page_count = parsing_result["page_count"]
-            print(f"Parsing successful ({page_count} pages). Markdown length: {len(combined_markdown)}")
+                raise StageFailed(error_msg)
+            print(f"Parsing successful ({parsing_result['page_count']} pages). Markdown length: {len(parsing_result['markdown_content'])}")
+            print(f"  Parse stats: {parsing_result.get('stats') or {}}")
+            return parsing_result
 
-            # --- Step 2: Extract Document Metadata ---
+        async def metadata(results: Dict[str, Any]) -> FinancialDocumentMetadata:
             print("\nStep 2: Extracting Document Metadata...")
-            self._update_job_progress(job_id, "extracting_metadata", "Analyzing content...", 25)
-            markdown_snippet = combined_markdown
+            report("extracting_metadata", "Analyzing content...", 25)
+            markdown_snippet = results["parse"]["markdown_content"]
 
-            metadata_result, metadata_rate_limited = self.metadata_extractor.extract_metadata(
+            metadata_result, metadata_rate_limited = await self.metadata_extractor.aextract_metadata(
                 markdown_snippet,
                 original_filename=original_filename,
                 forced_doc_specific_type=None,
@@ -122,7 +333,7 @@ class IngestionPipeline:
             if not metadata_result:
                  error_msg = "Metadata extraction failed."
                  print(error_msg)
-                 return {"success": False, "message": error_msg}
+                 raise StageFailed(error_msg)
             document_metadata: FinancialDocumentMetadata = metadata_result
             print("Metadata extraction successful.")
             print(f"  Extracted Type: {document_metadata.doc_specific_type.value if document_metadata.doc_specific_type else 'None'}")
@@ -136,19 +347,13 @@ class IngestionPipeline:
                 f"currency={getattr(document_metadata, 'currency', None)}"
             )
 
-            required_for_summary = {
-                "total_revenue": getattr(document_metadata, "total_revenue", None),
-                "total_expenses": getattr(document_metadata, "total_expenses", None),
-                "net_income": getattr(document_metadata, "net_income", None),
-                "period_end_date": getattr(document_metadata, "period_end_date", None),
-            }
-            missing_for_summary = [k for k, v in required_for_summary.items() if v is None]
+            missing_for_summary = self._missing_summary_fields(document_metadata)
             if missing_for_summary and not metadata_rate_limited:
                 print(
                     "Income statement required fields missing after metadata extraction: "
                     f"{', '.join(missing_for_summary)}. Attempting focused LLM extraction for income fields..."
                 )
-                fields = self.metadata_extractor.extract_income_statement_fields(
+                fields = await self.metadata_extractor.aextract_income_statement_fields(
                     markdown_snippet,
                     original_filename=original_filename,
                 )
@@ -179,170 +384,215 @@ class IngestionPipeline:
                     "Income statement required fields missing, but metadata extraction was quota-limited; "
                     "skipping second-pass income field extraction to avoid extra quota burn."
                 )
+            return document_metadata
 
-            # --- Step 3: Upload Original PDF to Storage ---
+        async def upload(results: Dict[str, Any]) -> str:
+            # Needs only the raw file, so it runs from t=0 alongside parsing.
+            if storage_path:
+                print(f"\nStep 3: Using already uploaded PDF at: {storage_path}")
+                return storage_path
             document_id_for_path = uuid.uuid4()
             print(f"\nStep 3: Uploading Original PDF (using temp ID for path: {document_id_for_path})...")
-            self._update_job_progress(job_id, "uploading", "Saving file...", 35)
-            storage_path = self.supabase_service.upload_pdf_to_storage(
-                pdf_file_buffer=pdf_file_buffer,
+            uploaded_path = await asyncio.to_thread(
+                self.supabase_service.upload_pdf_to_storage,
+                pdf_file_buffer=open_pdf(),
                 user_id=user_id,
                 document_id=document_id_for_path,
                 original_filename=original_filename
             )
-            if not storage_path:
+            if not uploaded_path:
                  error_msg = "Failed to upload original PDF to storage."
                  print(error_msg)
-                 return {"success": False, "message": error_msg}
-            print(f"Original PDF uploaded successfully to: {storage_path}")
+                 raise StageFailed(error_msg)
+            print(f"Original PDF uploaded successfully to: {uploaded_path}")
+            return uploaded_path
 
-
-            # --- Step 4: Save Document Record to Database ---
+        async def document_record(results: Dict[str, Any]) -> uuid.UUID:
             print("\nStep 4: Saving Document Record to Database...")
-            document_id = self.supabase_service.save_document_record(
+            report("uploading", "Saving file...", 35)
+            document_id = await asyncio.to_thread(
+                self.supabase_service.save_document_record,
                 user_id=user_id,
                 filename=original_filename,
-                storage_path=storage_path,
+                storage_path=results["upload"],
                 doc_type=doc_type,
-                metadata=document_metadata,
-                full_markdown_content=combined_markdown
-
+                metadata=results["metadata"],
+                full_markdown_content=results["parse"]["markdown_content"],
+                content_hash=content_hash,
+                previous_version_id=previous_document_id
             )
             if not document_id:
                  error_msg = "Failed to save document record to database."
                  print(error_msg)
-                 return {"success": False, "message": error_msg}
+                 raise StageFailed(error_msg)
             print(f"Document record saved successfully. Document ID: {document_id}")
+            return document_id
 
-            # --- Step 4.5: Save Income Statement Summary (when required fields are present) ---
-            required_for_summary = {
-                "total_revenue": getattr(document_metadata, "total_revenue", None),
-                "total_expenses": getattr(document_metadata, "total_expenses", None),
-                "net_income": getattr(document_metadata, "net_income", None),
-                "period_end_date": getattr(document_metadata, "period_end_date", None),
-            }
-            missing_for_summary = [k for k, v in required_for_summary.items() if v is None]
+        async def summary(results: Dict[str, Any]) -> Optional[uuid.UUID]:
+            document_id = results["document_record"]
+            document_metadata: FinancialDocumentMetadata = results["metadata"]
+            missing_for_summary = self._missing_summary_fields(document_metadata)
 
             if missing_for_summary:
                 print(
                     f"\nSkipping Income Statement Summary for document: {document_id} "
                     f"(missing: {', '.join(missing_for_summary)}; doc_specific_type={document_metadata.doc_specific_type.value if document_metadata.doc_specific_type else 'None'})."
                 )
+                return None
+            print(
+                f"\nAttempting to save Income Statement Summary for document: {document_id} "
+                f"(doc_specific_type={document_metadata.doc_specific_type.value if document_metadata.doc_specific_type else 'None'})."
+            )
+            summary_id = await asyncio.to_thread(
+                self.supabase_service.save_income_statement_summary,
+                document_id=document_id,
+                user_id=user_id,
+                metadata=document_metadata,
+            )
+            if summary_id:
+                print(f"Income Statement Summary saved successfully. Summary ID: {summary_id}")
             else:
-                print(
-                    f"\nAttempting to save Income Statement Summary for document: {document_id} "
-                    f"(doc_specific_type={document_metadata.doc_specific_type.value if document_metadata.doc_specific_type else 'None'})."
-                )
-                summary_id = self.supabase_service.save_income_statement_summary(
-                    document_id=document_id,
-                    user_id=user_id,
-                    metadata=document_metadata,
-                )
-                if summary_id:
-                    print(f"Income Statement Summary saved successfully. Summary ID: {summary_id}")
-                else:
-                    print(f"Warning: Failed to save Income Statement Summary for document: {document_id}. Pipeline will continue.")
-            # --- End Step ---
+                print(f"Warning: Failed to save Income Statement Summary for document: {document_id}. Pipeline will continue.")
+            return summary_id
+
+        async def save_pages(results: Dict[str, Any]) -> bool:
+            # Fingerprints let the next version of this document skip its unchanged pages.
+            # Parses without a job or previous version skip fingerprinting, so there may be none.
+            page_hashes = results["parse"].get("page_hashes") or []
+            saved = await asyncio.to_thread(
+                self.supabase_service.save_document_pages, results["document_record"], user_id, page_hashes
+            )
+            if not saved:
+                print("Warning: Failed to save page fingerprints; a later version will re-annotate every page.")
+            return saved
 
-            # --- Step 5: Section Markdown ---
+        async def sections(results: Dict[str, Any]) -> List[SectionData]:
             print("\nStep 5: Sectioning Markdown Content...")
-            self._update_job_progress(job_id, "sectioning", "Organizing content...", 50)
-            sections_data = self.sectioner.section_markdown(
-                markdown_content=combined_markdown,
-                document_id=document_id,
+            report("sectioning", "Organizing content...", 50)
+            sections_data = await asyncio.to_thread(
+                self.sectioner.section_markdown,
+                markdown_content=results["parse"]["markdown_content"],
+                document_id=None,  # stamped in save_sections once the document row exists
                 user_id=user_id
             )
             if not sections_data:
                  print("Warning: No sections were generated from the markdown.")
+            return sections_data
 
-
-            # --- Step 6: Save Sections Batch ---
+        async def save_sections(results: Dict[str, Any]) -> List[uuid.UUID]:
             print("\nStep 6: Saving Sections to Database...")
-            for section in sections_data:
-                 section['document_id'] = document_id
-                 section['user_id'] = user_id
+            document_id = results["document_record"]
+            sections_data = [{**section, "document_id": document_id, "user_id": user_id} for section in results["sections"]]
 
-            saved_section_ids = self.supabase_service.save_sections_batch(sections_data)
+            saved_section_ids = await asyncio.to_thread(self.supabase_service.save_sections_batch, sections_data)
 
             if saved_section_ids is None:
                  error_msg = "Failed to save sections batch to database."
                  print(error_msg)
-                 self.supabase_service.update_document_status(document_id, "failed")
-                 return {"success": False, "message": error_msg, "document_id": document_id}
+                 raise StageFailed(error_msg)
             elif len(saved_section_ids) != len(sections_data):
                  print(f"Warning: Number of saved section IDs ({len(saved_section_ids)}) does not match number of sections ({len(sections_data)}).")
 
-            if len(saved_section_ids) == len(sections_data):
-                for i, section in enumerate(sections_data):
-                     section['id'] = saved_section_ids[i]
-            else:
-                 print("Skipping adding section IDs due to count mismatch.")
-
             print(f"Sections saved successfully ({len(saved_section_ids)} sections).")
+            return saved_section_ids
 
-            # --- Step 7: Chunk Sections ---
+        async def chunks(results: Dict[str, Any]) -> List[ChunkData]:
             print("\nStep 7: Chunking Sections...")
-            self._update_job_progress(job_id, "chunking", "Preparing data...", 65)
-            chunks_data = self.chunking_service.chunk_sections(
-                sections=sections_data,
-                document_metadata=document_metadata,
-                document_id=document_id,
+            report("chunking", "Preparing data...", 65)
+            # Section rows may not be saved yet: key chunks by section position and
+            # swap in the real section ids in save_chunks.
+            indexed_sections = [{**section, "id": index} for index, section in enumerate(results["sections"])]
+            chunks_data = await asyncio.to_thread(
+                self.chunking_service.chunk_sections,
+                sections=indexed_sections,
+                document_metadata=results["metadata"],
+                document_id=None,
                 user_id=user_id
             )
             if not chunks_data:
                  print("Warning: No chunks were generated.")
-                 self.supabase_service.update_document_status(document_id, "completed_no_chunks")
-                 total_time = time.time() - start_time
-                 print(f"\n--- Ingestion Pipeline Completed (No Chunks) for {original_filename} in {total_time:.2f} seconds ---")
-                 return {"success": True, "message": "Pipeline completed, but no chunks were generated.", "document_id": document_id, "chunk_count": 0}
-
+            return chunks_data
 
-            # --- Step 8: Generate Embeddings ---
+        async def embed(results: Dict[str, Any]) -> List[ChunkData]:
+            chunks_data = results["chunks"]
+            if not chunks_data:
+                return []
             print("\nStep 8: Generating Embeddings...")
-            self._update_job_progress(job_id, "embedding", "Processing with AI...", 80)
-            chunks_with_embeddings = self.embedding_service.generate_embeddings(chunks_data)
+            report("embedding", "Processing with AI...", 80)
+            base = results["previous_version"] or {}
+            chunks_with_embeddings = await self.embedding_service.agenerate_embeddings(
+                chunks_data, reuse_index=base.get("reuse_index")
+            )
             if not chunks_with_embeddings or 'embedding' not in chunks_with_embeddings[0]:
                  error_msg = "Failed to generate embeddings or add them to chunk data."
                  print(error_msg)
-                 self.supabase_service.update_document_status(document_id, "failed")
-                 return {"success": False, "message": error_msg, "document_id": document_id}
+                 raise StageFailed(error_msg)
             print("Embeddings generated successfully.")
+            return chunks_with_embeddings
 
-
-            # --- Step 9: Save Chunks Batch ---
+        async def save_chunks(results: Dict[str, Any]) -> int:
+            chunks_with_embeddings = results["embed"]
+            if not chunks_with_embeddings:
+                return 0
             print("\nStep 9: Saving Chunks with Embeddings to Database...")
-            self._update_job_progress(job_id, "saving", "Finalizing...", 90)
-            save_chunks_success = self.supabase_service.save_chunks_batch(chunks_with_embeddings)
+            report("saving", "Finalizing...", 90)
+            saved_section_ids = results["save_sections"]
+            if len(saved_section_ids) != len(results["sections"]):
+                error_msg = "Failed to link chunks to saved sections (section count mismatch)."
+                print(error_msg)
+                raise StageFailed(error_msg)
+            for chunk in chunks_with_embeddings:
+                chunk["section_id"] = saved_section_ids[chunk["section_id"]]
+                chunk["document_id"] = results["document_record"]
 
+            save_chunks_success = await asyncio.to_thread(self.supabase_service.save_chunks_batch, chunks_with_embeddings)
             if not save_chunks_success:
                  error_msg = "Failed to save chunks batch to database."
                  print(error_msg)
-                 self.supabase_service.update_document_status(document_id, "failed")
-                 return {"success": False, "message": error_msg, "document_id": document_id}
+                 raise StageFailed(error_msg)
             print("Chunks saved successfully.")
-
-
-            # --- Step 10: Finalize - Update Document Status ---
-            print("\nStep 10: Updating Document Status to Completed...")
-            status_update_success = self.supabase_service.update_document_status(document_id, "completed")
+            return len(chunks_with_embeddings)
+
+        async def finalize(results: Dict[str, Any]) -> bool:
+            final_status = "completed" if results["save_chunks"] else "completed_no_chunks"
+            if previous_document_id:
+                print(f"\nStep 10: Replacing previous version {previous_document_id} (status {final_status})...")
+                swapped = await asyncio.to_thread(
+                    self.supabase_service.swap_document_version, previous_document_id, results["document_record"], final_status
+                )
+                if not swapped:
+                    error_msg = "Failed to swap in the new document version."
+                    print(error_msg)
+                    raise StageFailed(error_msg)
+                return swapped
+            print(f"\nStep 10: Updating Document Status to {final_status}...")
+            status_update_success = await asyncio.to_thread(self.supabase_service.update_document_status, results["document_record"], final_status)
             if not status_update_success:
-                print("Warning: Failed to update final document status to 'completed'.")
-
-
-            # --- Pipeline Complete ---
-            total_time = time.time() - start_time
-            print(f"\n--- Ingestion Pipeline Successfully Completed for {original_filename} in {total_time:.2f} seconds ---")
-            return {
-                "success": True,
-                "message": "Document processed and ingested successfully.",
-                "document_id": document_id,
-                "chunk_count": len(chunks_with_embeddings)
-            }
-
-        except Exception as e:
-            error_msg = f"An unexpected error occurred in the ingestion pipeline: {e}"
-            print(error_msg)
-            if document_id:
-                 print(f"Attempting to mark document {document_id} as failed...")
-                 self.supabase_service.update_document_status(document_id, "failed")
-            return {"success": False, "message": error_msg, "document_id": document_id}
\ No newline at end of file
+                print(f"Warning: Failed to update final document status to '{final_status}'.")
+            return status_update_success
+
+        graph.add_stage("previous_version", previous_version)
+        graph.add_stage("checkpoints", checkpoints)
+        graph.add_stage("parse", parse, depends_on=["previous_version", "checkpoints"])
+        graph.add_stage("upload", upload)
+        graph.add_stage("metadata", metadata, depends_on=["parse"])
+        graph.add_stage("sections", sections, depends_on=["parse"])
+        graph.add_stage("document_record", document_record, depends_on=["upload", "metadata"])
+        graph.add_stage("summary", summary, depends_on=["document_record", "metadata"])
+        graph.add_stage("save_pages", save_pages, depends_on=["parse", "document_record"])
+        graph.add_stage("save_sections", save_sections, depends_on=["sections", "document_record"])
+        graph.add_stage("chunks", chunks, depends_on=["sections", "metadata"])
+        graph.add_stage("embed", embed, depends_on=["chunks", "previous_version"])
+        graph.add_stage("save_chunks", save_chunks, depends_on=["embed", "save_sections"])
+        graph.add_stage("finalize", finalize, depends_on=["save_chunks", "summary", "save_pages"])
+        return graph
+
+    @staticmethod
+    def _missing_summary_fields(document_metadata: FinancialDocumentMetadata) -> List[str]:
+        required_for_summary = {
+            "total_revenue": getattr(document_metadata, "total_revenue", None),
+            "total_expenses": getattr(document_metadata, "total_expenses", None),
+            "net_income": getattr(document_metadata, "net_income", None),
+            "period_end_date": getattr(document_metadata, "period_end_date", None),
+        }
+        return [k for k, v in required_for_summary.items() if v is None]
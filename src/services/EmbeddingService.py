@@ -1,8 +1,13 @@
 # src/services/EmbeddingService.py
 
-from typing import List
+import asyncio
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
 from src.models.ingestion_models import ChunkData
+from src.llm.CircuitBreaker import CircuitOpenError
 from src.llm.OpenAIClient import OpenAIClient
+from src.llm.RateLimiter import PRIORITY_BULK
 
 class EmbeddingService:
     """
@@ -26,6 +31,102 @@ class EmbeddingService:
         Returns:
             List of chunk data with embeddings.
         """
+        texts_to_embed = self._prepare_texts(chunks_data)
+        if not texts_to_embed:
+            return []
+
+        try:
+            embeddings_result = self.openai_client.get_embeddings(texts_to_embed, priority=PRIORITY_BULK)
+            return self._attach_embeddings(chunks_data, embeddings_result)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+             print(f"Error generating embeddings: {e}")
+             return chunks_data
+
+    async def agenerate_embeddings(
+        self,
+        chunks_data: List[ChunkData],
+        reuse_index: Optional[Dict[str, List[float]]] = None,
+    ) -> List[ChunkData]:
+        """
+        Async variant of `generate_embeddings` using the async OpenAI client.
+
+        Args:
+            chunks_data: List of chunk data.
+            reuse_index: Embeddings of a previous document version (see `build_reuse_index`);
+                chunks whose embedded text is unchanged take their embedding from here.
+
+        Returns:
+            List of chunk data with embeddings.
+        """
+        # Building and hashing the texts of a large document is CPU work; keep it off the event loop.
+        texts_to_embed = await asyncio.to_thread(self._prepare_texts, chunks_data)
+        if not texts_to_embed:
+            return []
+
+        if reuse_index:
+            missing = await asyncio.to_thread(self._apply_reuse_index, chunks_data, texts_to_embed, reuse_index)
+            print(f"Reusing {len(texts_to_embed) - len(missing)} embeddings from the previous version; {len(missing)} to embed.")
+            if not missing:
+                return chunks_data
+            try:
+                embeddings_result = await self.openai_client.aget_embeddings([texts_to_embed[i] for i in missing], priority=PRIORITY_BULK)
+                self._attach_embeddings([chunks_data[i] for i in missing], embeddings_result)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                 print(f"Error generating embeddings: {e}")
+            return chunks_data
+
+        try:
+            embeddings_result = await self.openai_client.aget_embeddings(texts_to_embed, priority=PRIORITY_BULK)
+            return self._attach_embeddings(chunks_data, embeddings_result)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+             print(f"Error generating embeddings: {e}")
+             return chunks_data
+
+    def build_reuse_index(self, previous_chunks: List[Dict[str, Any]]) -> Dict[str, List[float]]:
+        """
+        Maps the embedded text of a previous version's chunks to their stored embeddings.
+
+        Only embeddings from the current embedding model are reused.
+        """
+        reusable = [
+            chunk for chunk in previous_chunks
+            if chunk.get("embedding") and chunk.get("embedding_model") == self.openai_client.embedding_model
+        ]
+        index: Dict[str, List[float]] = {}
+        for chunk, text in zip(reusable, self._prepare_texts(reusable)):
+            embedding = chunk["embedding"]
+            if isinstance(embedding, str):  # pgvector values come back as "[0.1,...]"
+                embedding = json.loads(embedding)
+            index[self._text_key(text)] = embedding
+        return index
+
+    def _apply_reuse_index(
+        self, chunks_data: List[ChunkData], texts: List[str], reuse_index: Dict[str, List[float]]
+    ) -> List[int]:
+        """Gives chunks whose text is in `reuse_index` that embedding; returns the indexes of the rest."""
+        missing: List[int] = []
+        for i, text in enumerate(texts):
+            reused = reuse_index.get(self._text_key(text))
+            if reused is None:
+                missing.append(i)
+            else:
+                chunks_data[i]['embedding'] = reused
+                chunks_data[i]['embedding_model'] = self.openai_client.embedding_model
+                chunks_data[i]['embedding_reused'] = True
+        return missing
+
+    @staticmethod
+    def _text_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _prepare_texts(self, chunks_data: List[ChunkData]) -> List[str]:
+        """Builds the metadata-augmented text embedded for each chunk."""
         if not chunks_data:
             print("No chunks provided for embedding.")
             return []
@@ -33,9 +134,7 @@ class EmbeddingService:
         print(f"Generating embeddings for {len(chunks_data)} chunks using model: {self.openai_client.embedding_model}...")
 
         texts_to_embed: List[str] = []
-        chunk_indices_map: List[int] = []
-
-        for i, chunk in enumerate(chunks_data):
+        for chunk in chunks_data:
             # Augment chunk text with metadata for better context
             augmented_text = (
                 f"Document Type: {chunk.get('doc_specific_type', 'Unknown')}. "
@@ -46,24 +145,18 @@ class EmbeddingService:
                 f"Content: {chunk.get('chunk_text', '')}"
             )
             texts_to_embed.append(augmented_text)
-            chunk_indices_map.append(i)
 
         print(f"Prepared {len(texts_to_embed)} augmented texts for embedding.")
+        return texts_to_embed
 
-        try:
-            embeddings_result = self.openai_client.get_embeddings(texts_to_embed)
-
-            if len(embeddings_result) != len(texts_to_embed):
-                 print(f"Warning: Embedding API returned {len(embeddings_result)} embeddings for {len(texts_to_embed)} texts. Expected count mismatch.")
+    def _attach_embeddings(self, chunks_data: List[ChunkData], embeddings_result: List[List[float]]) -> List[ChunkData]:
+        if len(embeddings_result) != len(chunks_data):
+             print(f"Warning: Embedding API returned {len(embeddings_result)} embeddings for {len(chunks_data)} texts. Expected count mismatch.")
 
-            valid_embeddings_count = min(len(embeddings_result), len(texts_to_embed))
-            for i in range(valid_embeddings_count):
-                original_chunk_index = chunk_indices_map[i]
-                chunks_data[original_chunk_index]['embedding'] = embeddings_result[i]
-                chunks_data[original_chunk_index]['embedding_model'] = self.openai_client.embedding_model
+        valid_embeddings_count = min(len(embeddings_result), len(chunks_data))
+        for i in range(valid_embeddings_count):
+            chunks_data[i]['embedding'] = embeddings_result[i]
+            chunks_data[i]['embedding_model'] = self.openai_client.embedding_model
 
-            print(f"Successfully added embeddings to {valid_embeddings_count} chunks.")
-            return chunks_data
-        except Exception as e:
-             print(f"Error generating embeddings: {e}")
-             return chunks_data
\ No newline at end of file
+        print(f"Successfully added embeddings to {valid_embeddings_count} chunks.")
+        return chunks_data
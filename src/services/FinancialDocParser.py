@@ -11,15 +11,73 @@ try:  # pragma: no cover
 except Exception:  # pragma: no cover
     _PYMUPDF_FILE_DATA_ERROR = None
 import concurrent.futures
-from typing import Optional, Dict, Any, IO
+import functools
+import hashlib
+import shutil
+import tempfile
+import threading
+import uuid
+from typing import Optional, Dict, Any, IO, List, Tuple, Iterator, Callable, Union
 from google.genai import types
+from src.llm.CircuitBreaker import CircuitOpenError, get_circuit_breaker, is_outage_error
 from src.llm.GeminiClient import GeminiClient
+from src.llm.RateLimiter import PRIORITY_BULK, estimate_tokens, get_rate_limiter, is_rate_limit_error, response_tokens, retry_after_seconds
+from src.llm.RequestHedger import RequestHedger, get_request_hedger
 from src.prompts.prompt_manager import PromptManager
 import re
 from src.config.gemini_config import MULTIMODAL_MODEL
 import os
 
 from src.models.ingestion_models import ParsingResult
+from src.services.PageAnnotationCache import PageAnnotationCache, get_page_annotation_cache
+from src.services.PageClassifier import PageClassifier
+from src.services.PageRenderer import ProcessPoolPageRenderer, RenderedPage, create_page_renderer, get_process_page_renderer
+from src.services.PageScheduler import PageScheduler, get_page_scheduler
+
+# (page_nums, callable) pairs executed by the annotation worker pool. The callable returns
+# (page_num, markdown) for each page; markdown is None when the page must be retried another way.
+AnnotationTask = Tuple[List[int], Callable[[], List[Tuple[int, Optional[str]]]]]
+
+_PAGE_START_MARKER_PATTERN = re.compile(r"^[ \t]*-{3}\s*Page\s+(\d+)\s+Start\s*-{3}[ \t]*$", re.MULTILINE | re.IGNORECASE)
+_PAGE_END_MARKER_PATTERN = re.compile(r"^[ \t]*-{3}\s*Page\s+\d+\s+End\s*-{3}[ \t]*$", re.MULTILINE | re.IGNORECASE)
+_COMBINED_PAGE_PATTERN = re.compile(r"--- Page (\d+) Start ---\n\n(.*?)\n\n--- Page \1 End ---", re.DOTALL)
+_FENCED_MARKDOWN_PATTERN = re.compile(r"\s*```(?:markdown)?[ \t]*\n(.*?)\n?```\s*", re.DOTALL)
+
+
+def _strip_markdown_fence(text: str) -> str:
+    """Removes a code fence wrapping the whole text, if present."""
+    m = _FENCED_MARKDOWN_PATTERN.fullmatch(text or "")
+    return (m.group(1) if m else (text or "")).strip()
+
+
+class _ParseStats:
+    """Thread-safe counters collected while parsing a single document."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Any] = {}
+
+    def incr(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def incr_key(self, name: str, key: str, amount: float = 1) -> None:
+        with self._lock:
+            bucket = self._counters.setdefault(name, {})
+            bucket[key] = bucket.get(key, 0) + amount
+
+    def append(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._counters.setdefault(name, []).append(value)
+
+    def set(self, name: str, value: Any) -> None:
+        with self._lock:
+            self._counters[name] = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counters)
+
 
 class FinancialDocParser:
     """
@@ -31,29 +89,124 @@ class FinancialDocParser:
         "pdf_annotation", pipeline="financial"
     )
 
-    def __init__(self, gemini_client: Optional[GeminiClient] = None):
+    def __init__(
+        self,
+        gemini_client: Optional[GeminiClient] = None,
+        max_workers: Optional[int] = None,
+        render_queue_size: Optional[int] = None,
+        annotation_cache: Optional[PageAnnotationCache] = None,
+        page_classifier: Optional[PageClassifier] = None,
+        parse_mode: Optional[str] = None,
+        native_pages_per_part: Optional[int] = None,
+        page_renderer: Optional[Any] = None,
+        annotation_batch_size: Optional[int] = None,
+        page_scheduler: Optional[PageScheduler] = None,
+        process_renderer: Optional[ProcessPoolPageRenderer] = None,
+        request_hedger: Optional[RequestHedger] = None,
+    ):
         """
         Initialize parser with a Gemini client.
+
+        Args:
+            gemini_client: Client used for page annotation.
+            max_workers: Concurrent page annotation workers when no shared page scheduler is
+                used (env PDF_ANNOTATION_WORKERS, default 4).
+            render_queue_size: Pages rendered ahead of the workers (env PDF_RENDER_QUEUE_SIZE, default 2).
+            annotation_cache: Page annotation cache; defaults to the shared on-disk cache.
+            page_classifier: Per-page router between local extraction and annotation. Used when
+                PDF_PAGE_ROUTING is "auto" (default); "multimodal" annotates every page.
+            parse_mode: "image" renders one PNG per page (default); "native_pdf" sends pages as
+                application/pdf parts (env PDF_PARSE_MODE).
+            native_pages_per_part: Pages per sub-PDF in native mode (env PDF_NATIVE_PAGES_PER_PART, default 4).
+            page_renderer: Page rasterizer; defaults to PDF_RENDER_MODE ("adaptive" or "fixed").
+            annotation_batch_size: Page images packed into one annotation request in image mode
+                (env PDF_ANNOTATION_BATCH_SIZE, default 1 = one request per page).
+            page_scheduler: Worker pool shared by all parses; defaults to the process-wide
+                scheduler (PAGE_SCHEDULER=0 gives each parse its own `max_workers` pool).
+            process_renderer: Worker-process pool that renders pages off the parsing thread;
+                defaults to the shared pool when PDF_RENDER_PROCESSES > 0, otherwise pages
+                are rendered in-process.
+            request_hedger: Hedges slow annotation requests; defaults to the model's shared
+                hedger when PDF_HEDGE_REQUESTS=1, otherwise requests are not hedged.
         """
         self.gemini_client = gemini_client or GeminiClient()
         self.multimodal_model = MULTIMODAL_MODEL  # Use model from config
-
-
-    def parse_pdf_to_markdown(self, pdf_file: IO[bytes]) -> ParsingResult:
+        self.max_workers = max(1, max_workers or int(os.getenv("PDF_ANNOTATION_WORKERS", "4")))
+        self.render_queue_size = max(0, render_queue_size if render_queue_size is not None else int(os.getenv("PDF_RENDER_QUEUE_SIZE", "2")))
+        self.annotation_cache = annotation_cache or get_page_annotation_cache()
+        self.page_routing = os.getenv("PDF_PAGE_ROUTING", "auto").strip().lower()
+        self.page_classifier = (page_classifier or PageClassifier()) if self.page_routing == "auto" else None
+        self.parse_mode = (parse_mode or os.getenv("PDF_PARSE_MODE", "image")).strip().lower()
+        if self.parse_mode not in ("image", "native_pdf"):
+            raise ValueError(f"Unsupported PDF parse mode: {self.parse_mode}")
+        self.native_pages_per_part = max(1, native_pages_per_part or int(os.getenv("PDF_NATIVE_PAGES_PER_PART", "4")))
+        self.page_renderer = page_renderer or create_page_renderer()
+        self.annotation_batch_size = max(1, annotation_batch_size or int(os.getenv("PDF_ANNOTATION_BATCH_SIZE", "1")))
+        self.page_scheduler = page_scheduler or get_page_scheduler()
+        self.process_renderer = process_renderer or get_process_page_renderer()
+        self.request_hedger = request_hedger or (
+            get_request_hedger("gemini", self.multimodal_model) if os.getenv("PDF_HEDGE_REQUESTS", "0") == "1" else None
+        )
+
+
+    def parse_pdf_to_markdown(
+        self,
+        pdf_file: Union[IO[bytes], str],
+        job_key: Optional[str] = None,
+        user_key: Optional[str] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        reuse_pages: Optional[Dict[str, str]] = None,
+        page_callback: Optional[Callable[[int, str, str], None]] = None,
+        fingerprint_pages: Optional[bool] = None,
+    ) -> ParsingResult:
         """
         Converts PDF file buffer to combined markdown using Gemini.
 
         Args:
-            pdf_file: PDF content as a file-like object (bytes).
+            pdf_file: Path of the PDF, or its content as a file-like object (bytes). A path is
+                opened directly, so MuPDF reads pages from disk instead of a copy in memory.
+            job_key: Identifies this parse to the page scheduler (defaults to a fresh id).
+            user_key: Owner of the job; the scheduler round-robins between users first.
+            progress_callback: Called as (pages_done, total_pages) whenever pages finish,
+                from parser worker threads; must be quick and thread-safe.
+            reuse_pages: Page fingerprint -> markdown from a previous version of the
+                document or an earlier attempt of the job; matching pages are taken from
+                here instead of being annotated.
+            page_callback: Called as (page_num, page_fingerprint, markdown) as soon as a
+                page is annotated successfully, from parser worker threads, so callers can
+                checkpoint pages before the whole document is done.
+            fingerprint_pages: Whether to fingerprint pages (an extra low-resolution render
+                of each page). Defaults to True only when `reuse_pages` or `page_callback`
+                is given, as nothing else reads the fingerprints.
+
+        The result's 'page_hashes' lists each page's fingerprint (see `page_fingerprint`),
+        or None for pages whose annotation failed, so they are never reused, and for
+        every page when pages were not fingerprinted.
 
         Returns:
-            Dictionary with markdown content, page count, and potential error.
+            Dictionary with markdown content, page count, potential error and parse stats.
         """
         pdf_document = None
+        spool_path = None
+        stats = _ParseStats()
+        stats.set("parse_mode", self.parse_mode)
+        job_key = job_key or uuid.uuid4().hex
+        user_key = user_key or job_key
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
         try:
-            # Read PDF buffer into bytes to support SpooledTemporaryFile streams
-            pdf_bytes = pdf_file.read()
-            pdf_document = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+            if isinstance(pdf_file, str):
+                # Render workers open the same file by path (pdf_document.name)
+                pdf_document = pymupdf.open(pdf_file, filetype="pdf")
+            elif self.process_renderer is not None:
+                # Render workers open the PDF by path, so spool it to a temp file they can share.
+                with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+                    shutil.copyfileobj(pdf_file, spool)
+                    spool_path = spool.name
+                pdf_document = pymupdf.open(spool_path)
+            else:
+                # Read PDF buffer into bytes to support SpooledTemporaryFile streams
+                pdf_document = pymupdf.open(stream=pdf_file.read(), filetype="pdf")
             total_pages = len(pdf_document)
             print(f"PDF has {total_pages} pages")
 
@@ -68,51 +221,54 @@ class FinancialDocParser:
                 combined_markdown = self._extract_text_fallback(pdf_document)
                 return {"markdown_content": combined_markdown.strip(), "page_count": total_pages, "error": None}
 
-            pages_data = []
-            for page_num in range(total_pages):
-                print(f"Rendering page {page_num+1}/{total_pages}")
-                page = pdf_document[page_num]
-                pix = page.get_pixmap(matrix=pymupdf.Matrix(3, 3))
-                img_bytes = pix.tobytes("png")
-                pages_data.append({"page_num": page_num, "img_bytes": img_bytes})
-
-            max_workers = min(4, total_pages)
-            print(f"Starting page annotation with max {max_workers} concurrent workers...")
-
-            future_to_page = {}
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                 for page_data in pages_data:
-                     future = executor.submit(self._process_single_page, page_data)
-                     future_to_page[future] = page_data
-
-
-            results = []
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_data = future_to_page[future]
-                page_num = page_data["page_num"]
-
-                try:
-                    markdown_result = future.result()
-                    results.append((page_num, markdown_result))
-                except Exception as exc:
-                    print(f'Page {page_num + 1} task failed unexpectedly in executor: {exc}')
-                    results.append((page_num, f"\n\n[FATAL ERROR processing Page {page_num+1}: {exc}]\n\n"))
-
+            on_pages_done = self._page_progress(progress_callback, total_pages)
+            page_hashes: List[Optional[str]] = [None] * total_pages
+            if fingerprint_pages is None:
+                fingerprint_pages = bool(reuse_pages) or page_callback is not None
+            on_page_annotated = None
+            if page_callback is not None:
+                def on_page_annotated(page_num: int, markdown: str) -> None:
+                    page_callback(page_num, page_hashes[page_num], markdown)
+            results = self._annotate_pages(
+                pdf_document, total_pages, stats, job_key, user_key, on_pages_done, page_hashes, reuse_pages or {},
+                fingerprint_pages, on_page_annotated,
+            )
+            stats.set("wall_seconds", round(time.perf_counter() - wall_start, 3))
+            stats.set("cpu_seconds", round(time.process_time() - cpu_start, 3))
+            stats.set("render_seconds", round(stats.as_dict().get("render_seconds", 0.0), 3))
+            stats.set("scheduler_wait_seconds", round(stats.as_dict().get("scheduler_wait_seconds", 0.0), 3))
 
             results.sort(key=lambda x: x[0])
 
-            if any(("resource_exhausted" in (t or "").lower()) or ("quota exceeded" in (t or "").lower()) for _, t in results):
+            if any(self._is_quota_error(t) for _, t in results):
                 combined_markdown = self._extract_text_fallback(pdf_document)
-                return {"markdown_content": combined_markdown.strip(), "page_count": total_pages, "error": None}
+                stats.set("quota_fallback", True)
+                return {"markdown_content": combined_markdown.strip(), "page_count": total_pages, "error": None, "stats": stats.as_dict()}
 
             combined_markdown = ""
             for page_num, markdown_text in results:
+                 if self._is_annotation_error(markdown_text):
+                     page_hashes[page_num] = None
                  start_separator = f"\n\n--- Page {page_num+1} Start ---\n\n"
                  end_separator = f"\n\n--- Page {page_num+1} End ---\n\n"
                  combined_markdown += start_separator + markdown_text.strip() + end_separator
 
-            return {"markdown_content": combined_markdown.strip(), "page_count": total_pages, "error": None}
-
+            if self.annotation_cache is not None:
+                print(f"Page annotation cache: {self.annotation_cache.stats()}")
+            if self.request_hedger is not None:
+                stats.set("hedge_saved_seconds", round(stats.as_dict().get("hedge_saved_seconds", 0.0), 3))
+                print(f"Page request hedging: {self.request_hedger.stats()}")
+            return {
+                "markdown_content": combined_markdown.strip(),
+                "page_count": total_pages,
+                "error": None,
+                "stats": stats.as_dict(),
+                "page_hashes": page_hashes,
+            }
+
+        except CircuitOpenError:
+            # Not a problem with this PDF: the caller parks the job until Gemini recovers.
+            raise
         except Exception as e:
             if _PYMUPDF_FILE_DATA_ERROR is not None and isinstance(e, _PYMUPDF_FILE_DATA_ERROR):
                 error_msg = "Error: Could not open PDF file from buffer. File may be corrupt or not a PDF."
@@ -124,14 +280,504 @@ class FinancialDocParser:
         finally:
             if pdf_document:
                 pdf_document.close()
+            if spool_path:
+                try:
+                    os.remove(spool_path)
+                except OSError:
+                    pass
+
+
+    @staticmethod
+    def page_fingerprint(page: pymupdf.Page) -> str:
+        """
+        Content fingerprint of a page: its text plus a low-resolution grayscale render.
+
+        Stable across re-exports of an unchanged page, but any visible edit (a changed
+        figure, a moved chart) changes it. Costs a few milliseconds per page.
+        """
+        digest = hashlib.sha256()
+        digest.update(page.get_text("text").encode("utf-8"))
+        digest.update(b"\x00")
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(0.5, 0.5), colorspace=pymupdf.csGRAY, alpha=False)
+        digest.update(pixmap.samples)
+        return digest.hexdigest()
+
+    @staticmethod
+    def split_combined_markdown(markdown: str) -> Dict[int, str]:
+        """Splits markdown produced by `parse_pdf_to_markdown` back into {page_num (0-based): markdown}."""
+        pages: Dict[int, str] = {}
+        for match in _COMBINED_PAGE_PATTERN.finditer(markdown or ""):
+            pages[int(match.group(1)) - 1] = match.group(2).strip()
+        return pages
+
+    @staticmethod
+    def _page_progress(progress_callback: Optional[Callable[[int, int], None]], total_pages: int) -> Callable[[int], None]:
+        """Returns a thread-safe `pages_finished(count)` that reports the running total to `progress_callback`."""
+        lock = threading.Lock()
+        done = [0]
+
+        def pages_finished(count: int) -> None:
+            if progress_callback is None:
+                return
+            with lock:
+                # Native-mode fallback re-annotates pages, so cap at the page count.
+                done[0] = min(total_pages, done[0] + count)
+                pages_done = done[0]
+            try:
+                progress_callback(pages_done, total_pages)
+            except Exception as e:
+                print(f"Warning: page progress callback failed: {e}")
+
+        return pages_finished
+
+    def _render_page(self, page: pymupdf.Page, stats: _ParseStats) -> RenderedPage:
+        """Rasterizes a single page and records its payload size and render time."""
+        rendered = self.page_renderer.render(page)
+        self._record_render(page.number, rendered, stats)
+        return rendered
+
+    @staticmethod
+    def _record_render(page_num: int, rendered: RenderedPage, stats: _ParseStats) -> None:
+        stats.incr("render_seconds", rendered["render_seconds"])
+        stats.append("page_renders", {
+            "page": page_num + 1,
+            "zoom": rendered["zoom"],
+            "encoding": rendered["encoding"],
+            "width": rendered["width"],
+            "height": rendered["height"],
+            "payload_bytes": rendered["payload_bytes"],
+            "render_ms": round(rendered["render_seconds"] * 1000, 1),
+            "cropped": rendered["cropped"],
+        })
+        print(
+            f"Rendered page {page_num + 1}: {rendered['encoding']} {rendered['width']}x{rendered['height']} "
+            f"zoom={rendered['zoom']} {rendered['payload_bytes']} bytes in {rendered['render_seconds'] * 1000:.0f} ms"
+        )
+
+    def _annotate_pages(
+        self,
+        pdf_document: pymupdf.Document,
+        total_pages: int,
+        stats: _ParseStats,
+        job_key: str,
+        user_key: str,
+        on_pages_done: Callable[[int], None],
+        page_hashes: List[Optional[str]],
+        reuse_pages: Dict[str, str],
+        fingerprint_pages: bool,
+        on_page_annotated: Optional[Callable[[int, str], None]] = None,
+    ) -> List[Tuple[int, str]]:
+        """
+        Classifies, renders and annotates pages as a streaming pipeline.
+
+        Pages the classifier accepts for local extraction are never rendered. The
+        remaining pages are turned into annotation tasks lazily on the calling thread
+        (PyMuPDF documents are not thread-safe), either as page images (one request per
+        `annotation_batch_size` pages) or, in "native_pdf" mode, as small sub-PDFs. Pages a native part fails to return are
+        re-annotated through the render-per-page path.
+
+        Returns:
+            Unordered list of (page_num, markdown) tuples.
+        """
+        results: List[Tuple[int, str]] = []
+        multimodal_pages = self._iter_multimodal_pages(
+            pdf_document, total_pages, stats, results, on_pages_done, page_hashes, reuse_pages, fingerprint_pages
+        )
+        run_tasks = functools.partial(
+            self._run_annotation_tasks, job_key=job_key, user_key=user_key, stats=stats, on_pages_done=on_pages_done,
+            on_page_annotated=on_page_annotated,
+        )
+
+        if self.parse_mode == "native_pdf":
+            native_results = run_tasks(self._iter_native_tasks(pdf_document, multimodal_pages, stats))
+            fallback_pages = [page_num for page_num, markdown in native_results if markdown is None]
+            results.extend((page_num, markdown) for page_num, markdown in native_results if markdown is not None)
+            if fallback_pages:
+                print(f"Native PDF mode missed {len(fallback_pages)} page(s); falling back to rendered page annotation.")
+                stats.incr("native_fallback_pages", len(fallback_pages))
+                results.extend(run_tasks(self._iter_image_tasks(pdf_document, iter(fallback_pages), stats)))
+        else:
+            results.extend(run_tasks(self._iter_image_tasks(pdf_document, multimodal_pages, stats)))
+
+        routed = stats.as_dict()
+        print(f"Page routing: {routed.get('pages_local', 0)} local, {routed.get('pages_multimodal', 0)} multimodal")
+        return results
+
+    def _iter_multimodal_pages(
+        self,
+        pdf_document: pymupdf.Document,
+        total_pages: int,
+        stats: _ParseStats,
+        local_results: List[Tuple[int, str]],
+        on_pages_done: Callable[[int], None],
+        page_hashes: List[Optional[str]],
+        reuse_pages: Dict[str, str],
+        fingerprint_pages: bool,
+    ) -> Iterator[int]:
+        """
+        Yields pages that need multimodal annotation. Pages unchanged from a previous
+        version and locally extracted pages go straight to `local_results`. Pages are
+        fingerprinted into `page_hashes` only when `fingerprint_pages` is set.
+        """
+        for page_num in range(total_pages):
+            page = pdf_document[page_num]
+            reused_markdown = None
+            if fingerprint_pages:
+                page_hashes[page_num] = self.page_fingerprint(page)
+                reused_markdown = reuse_pages.get(page_hashes[page_num])
+            if reused_markdown is not None:
+                print(f"Page {page_num + 1}: Unchanged from previous version; reusing its annotation.")
+                stats.incr("pages_reused")
+                local_results.append((page_num, reused_markdown))
+                on_pages_done(1)
+                continue
+            local_markdown = self._route_page(page, page_num, stats)
+            if local_markdown is not None:
+                local_results.append((page_num, local_markdown))
+                on_pages_done(1)
+            else:
+                yield page_num
+
+    def _run_annotation_tasks(
+        self,
+        tasks: Iterator[AnnotationTask],
+        job_key: str,
+        user_key: str,
+        stats: _ParseStats,
+        on_pages_done: Callable[[int], None],
+        on_page_annotated: Optional[Callable[[int, str], None]] = None,
+    ) -> List[Tuple[int, Optional[str]]]:
+        """
+        Runs annotation tasks on the page scheduler with a bounded in-flight window.
+
+        Tasks are submitted to the process-wide scheduler, which shares its workers
+        round-robin between every job currently parsing. The task iterator is only
+        advanced once fewer than `workers + render_queue_size` of this job's tasks are
+        queued or running, so rendered payloads are produced just ahead of the workers
+        and released as soon as their task finishes.
+
+        Returns:
+            Unordered list of (page_num, markdown) tuples; markdown is None for pages a
+            task could not produce.
+        """
+        scheduler = self.page_scheduler
+        private_scheduler = None
+        if scheduler is None:
+            scheduler = private_scheduler = PageScheduler(max_concurrency=self.max_workers, name=f"page-annotation-{job_key[:8]}")
+        max_in_flight = scheduler.max_concurrency + self.render_queue_size
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        print(f"Starting page annotation on {scheduler.max_concurrency} scheduler workers ({max_in_flight} tasks in flight for job {job_key})...")
+
+        future_to_pages: Dict[concurrent.futures.Future, List[int]] = {}
+        try:
+            while True:
+                in_flight.acquire()
+                try:
+                    page_nums, task = next(tasks)
+                except StopIteration:
+                    in_flight.release()
+                    break
+                except Exception:
+                    in_flight.release()
+                    raise
+                future = scheduler.submit(job_key, user_key, task)
+                future.add_done_callback(lambda _f: in_flight.release())
+                future.add_done_callback(lambda _f, count=len(page_nums): on_pages_done(count))
+                if on_page_annotated is not None:
+                    future.add_done_callback(functools.partial(self._report_annotated_pages, on_page_annotated))
+                future_to_pages[future] = page_nums
+                del task
+
+            results: List[Tuple[int, Optional[str]]] = []
+            for future in concurrent.futures.as_completed(future_to_pages):
+                page_nums = future_to_pages[future]
+                stats.incr("scheduler_wait_seconds", getattr(future, "queue_wait_seconds", 0.0))
+                try:
+                    results.extend(future.result())
+                except CircuitOpenError:
+                    # The provider is down; fail the parse rather than fill it with error pages
+                    for pending in future_to_pages:
+                        pending.cancel()
+                    raise
+                except Exception as exc:
+                    for page_num in page_nums:
+                        print(f'Page {page_num + 1} task failed unexpectedly in executor: {exc}')
+                        results.append((page_num, f"\n\n[FATAL ERROR processing Page {page_num+1}: {exc}]\n\n"))
+            return results
+        finally:
+            if private_scheduler is not None:
+                private_scheduler.shutdown()
+
+    @classmethod
+    def _report_annotated_pages(cls, on_page_annotated: Callable[[int, str], None], future: concurrent.futures.Future) -> None:
+        """Done-callback passing a task's successfully annotated pages to `on_page_annotated`."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        for page_num, markdown in future.result():
+            if markdown is not None and not cls._is_annotation_error(markdown):
+                try:
+                    on_page_annotated(page_num, markdown)
+                except Exception as e:
+                    print(f"Warning: Page {page_num + 1} callback failed: {e}")
+
+    def _iter_image_tasks(self, pdf_document: pymupdf.Document, page_nums: Iterator[int], stats: _ParseStats) -> Iterator[AnnotationTask]:
+        """Renders pages to images and yields one annotation task per `annotation_batch_size` pages."""
+        if self.process_renderer is not None and pdf_document.name:
+            yield from self._iter_process_rendered_tasks(pdf_document.name, page_nums, stats)
+            return
+        batch: List[Dict[str, Any]] = []
+        for page_num in page_nums:
+            rendered = self._render_page(pdf_document[page_num], stats)
+            batch.append({"page_num": page_num, "img_bytes": rendered["img_bytes"], "mime_type": rendered["mime_type"]})
+            del rendered
+            if len(batch) >= self.annotation_batch_size:
+                yield [d["page_num"] for d in batch], functools.partial(self._annotate_image_batch, batch, stats)
+                batch = []
+        if batch:
+            yield [d["page_num"] for d in batch], functools.partial(self._annotate_image_batch, batch, stats)
+
+    def _iter_process_rendered_tasks(self, pdf_path: str, page_nums: Iterator[int], stats: _ParseStats) -> Iterator[AnnotationTask]:
+        """
+        Yields annotation tasks whose pages are rendered in the worker-process pool.
+
+        Each batch is submitted for rendering as soon as its task is yielded, so the
+        in-flight window in `_run_annotation_tasks` also bounds how far rendering runs
+        ahead; the task itself waits for the images before annotating them.
+        """
+        batch: List[int] = []
+        for page_num in page_nums:
+            batch.append(page_num)
+            if len(batch) >= self.annotation_batch_size:
+                render_future = self.process_renderer.submit(pdf_path, batch, self.page_renderer)
+                yield batch, functools.partial(self._annotate_process_rendered_batch, batch, render_future, stats)
+                batch = []
+        if batch:
+            render_future = self.process_renderer.submit(pdf_path, batch, self.page_renderer)
+            yield batch, functools.partial(self._annotate_process_rendered_batch, batch, render_future, stats)
+
+    def _annotate_process_rendered_batch(
+        self,
+        page_nums: List[int],
+        render_future: concurrent.futures.Future,
+        stats: _ParseStats,
+    ) -> List[Tuple[int, Optional[str]]]:
+        batch: List[Dict[str, Any]] = []
+        for page_num, rendered in zip(page_nums, render_future.result()):
+            self._record_render(page_num, rendered, stats)
+            batch.append({"page_num": page_num, "img_bytes": rendered["img_bytes"], "mime_type": rendered["mime_type"]})
+        return self._annotate_image_batch(batch, stats)
+
+    def _annotate_image_batch(self, pages_data: List[Dict[str, Any]], stats: _ParseStats) -> List[Tuple[int, Optional[str]]]:
+        """
+        Annotates a batch of page images with a single request.
+
+        Cached pages are served first; the remaining images are sent together with
+        page separator instructions and the response is split back per page. Pages
+        missing from the response, or a failed batch, are retried page by page.
+        """
+        results: Dict[int, str] = {}
+        pending: List[Dict[str, Any]] = []
+        for page_data in pages_data:
+            cached_markdown = self._get_cached_page(page_data, stats)
+            if cached_markdown is not None:
+                results[page_data["page_num"]] = cached_markdown
+            else:
+                pending.append(page_data)
+
+        if len(pending) == 1:
+            results[pending[0]["page_num"]] = self._annotate_page_uncached(pending[0], stats)
+        elif pending:
+            page_nums = [d["page_num"] for d in pending]
+            batch_identifier = f"Pages {', '.join(str(p + 1) for p in page_nums)}"
+            prompt = self.PDF_ANNOTATION_PROMPT + "\n\n" + PromptManager.get_prompt(
+                "multi_page_annotation",
+                input_description="images, one image per page",
+                page_numbers=[page_num + 1 for page_num in page_nums],
+            )
+            stats.incr("llm_requests")
+            stats.incr("batched_requests")
+            stats.incr("llm_pages", len(pending))
+            stats.incr("bytes_sent", sum(len(d["img_bytes"]) for d in pending))
+            raw = self._generate_annotation(
+                [types.Part.from_bytes(data=d["img_bytes"], mime_type=d.get("mime_type", "image/png")) for d in pending] + [prompt],
+                batch_identifier,
+                stats,
+            )
+
+            if self._is_annotation_error(raw) and self._is_quota_error(raw):
+                # Retrying page by page would only burn more quota; let the parse-level fallback handle it.
+                return [(page_num, raw) for page_num in page_nums]
+            pages = {} if self._is_annotation_error(raw) else self._split_page_markdown(raw, page_nums)
+
+            served = 0
+            for page_data in pending:
+                page_num = page_data["page_num"]
+                markdown = pages.get(page_num)
+                if markdown is None:
+                    print(f"Page {page_num + 1}: Missing from batch response; retrying individually.")
+                    stats.incr("batch_retry_pages")
+                    markdown = self._annotate_page_uncached(page_data, stats)
+                else:
+                    served += 1
+                    self._store_page(page_data, markdown)
+                results[page_num] = markdown
+            if served > 1:
+                stats.incr("requests_saved", served - 1)
+
+        return [(page_data["page_num"], results[page_data["page_num"]]) for page_data in pages_data]
+
+    def _iter_native_tasks(self, pdf_document: pymupdf.Document, page_nums: Iterator[int], stats: _ParseStats) -> Iterator[AnnotationTask]:
+        """Groups pages into sub-PDFs of up to `native_pages_per_part` pages and yields one task per part."""
+        part: List[int] = []
+        for page_num in page_nums:
+            part.append(page_num)
+            if len(part) >= self.native_pages_per_part:
+                yield self._build_native_task(pdf_document, part, stats)
+                part = []
+        if part:
+            yield self._build_native_task(pdf_document, part, stats)
+
+    def _build_native_task(self, pdf_document: pymupdf.Document, page_nums: List[int], stats: _ParseStats) -> AnnotationTask:
+        print(f"Extracting pages {', '.join(str(p + 1) for p in page_nums)} into a sub-PDF")
+        sub_document = pymupdf.open()
+        try:
+            for page_num in page_nums:
+                sub_document.insert_pdf(pdf_document, from_page=page_num, to_page=page_num)
+            part_bytes = sub_document.tobytes(garbage=3, deflate=True, no_new_id=True)
+        finally:
+            sub_document.close()
+        return list(page_nums), functools.partial(self._annotate_native_part, list(page_nums), part_bytes, stats)
 
+    def _annotate_native_part(self, page_nums: List[int], part_bytes: bytes, stats: _ParseStats) -> List[Tuple[int, Optional[str]]]:
+        """
+        Annotates a sub-PDF in one request and splits the response back into pages.
+
+        Returns:
+            (page_num, markdown) for every page in the part; markdown is None for pages
+            missing from the response so the caller can re-annotate them individually.
+        """
+        part_identifier = f"Pages {page_nums[0] + 1}-{page_nums[-1] + 1}"
+        prompt = self.PDF_ANNOTATION_PROMPT + "\n\n" + PromptManager.get_prompt(
+            "multi_page_annotation",
+            input_description="a PDF document",
+            page_numbers=[page_num + 1 for page_num in page_nums],
+        )
+
+        cache = self.annotation_cache
+        cache_key = cache.make_key(part_bytes, prompt, self.multimodal_model) if cache is not None else None
+        raw = cache.get(cache_key) if cache is not None else None
+        if raw is not None:
+            print(f"{part_identifier}: Annotation served from cache.")
+            stats.incr("cache_hits", len(page_nums))
+        else:
+            if cache is not None:
+                stats.incr("cache_misses", len(page_nums))
+            stats.incr("llm_requests")
+            stats.incr("llm_pages", len(page_nums))
+            stats.incr("bytes_sent", len(part_bytes))
+            raw = self._generate_annotation(
+                [types.Part.from_bytes(data=part_bytes, mime_type="application/pdf"), prompt],
+                part_identifier,
+                stats,
+            )
+            if self._is_annotation_error(raw):
+                return [(page_num, None) for page_num in page_nums]
+
+        pages = self._split_page_markdown(raw, page_nums)
+        if cache is not None and len(pages) == len(page_nums):
+            cache.put(cache_key, raw)
+        return [(page_num, pages.get(page_num)) for page_num in page_nums]
+
+    @staticmethod
+    def _split_page_markdown(raw: str, page_nums: List[int]) -> Dict[int, str]:
+        """Splits a multi-page response on its `--- Page N Start ---` markers into {page_num: markdown}."""
+        raw = _strip_markdown_fence(raw)
+        markers = list(_PAGE_START_MARKER_PATTERN.finditer(raw))
+        expected = set(page_nums)
+        pages: Dict[int, str] = {}
+        for i, marker in enumerate(markers):
+            body_end = markers[i + 1].start() if i + 1 < len(markers) else len(raw)
+            body = _PAGE_END_MARKER_PATTERN.sub("", raw[marker.end():body_end])
+            body = _strip_markdown_fence(body)
+            page_num = int(marker.group(1)) - 1
+            if page_num in expected and body:
+                pages[page_num] = body
+        return pages
+
+    def _route_page(self, page: pymupdf.Page, page_num: int, stats: _ParseStats) -> Optional[str]:
+        """
+        Decides whether a page needs multimodal annotation.
+
+        Returns:
+            Locally extracted markdown, or None when the page must be annotated.
+        """
+        if self.page_classifier is None:
+            stats.incr("pages_multimodal")
+            return None
+        try:
+            route = self.page_classifier.classify(page)
+        except Exception as e:
+            print(f"Page {page_num + 1}: Classification failed ({e}); sending to multimodal annotation.")
+            route = {"route": PageClassifier.MULTIMODAL, "reason": "classifier_error"}
+
+        stats.incr_key("routing_reasons", route["reason"])
+        if route["route"] == PageClassifier.LOCAL:
+            print(f"Page {page_num + 1}: Extracted locally ({route['reason']}).")
+            stats.incr("pages_local")
+            return route["markdown"]
+        print(f"Page {page_num + 1}: Routed to multimodal annotation ({route['reason']}).")
+        stats.incr("pages_multimodal")
+        return None
+
+    def _get_cached_page(self, data: Dict[str, Any], stats: _ParseStats) -> Optional[str]:
+        """
+        Looks a page image up in the annotation cache.
 
-    def _process_single_page(self, data: Dict[str, Any]) -> str:
+        Pages annotated inside a batch are stored under the same single-page key, since
+        the batch prompt only adds page separators to the annotation prompt.
+        """
+        cache = self.annotation_cache
+        if cache is None:
+            return None
+        cached_markdown = cache.get(cache.make_key(data["img_bytes"], self.PDF_ANNOTATION_PROMPT, self.multimodal_model))
+        if cached_markdown is not None:
+            print(f"Page {data['page_num'] + 1}: Annotation served from cache.")
+            stats.incr("cache_hits")
+        else:
+            stats.incr("cache_misses")
+        return cached_markdown
+
+    def _store_page(self, data: Dict[str, Any], markdown: str) -> None:
+        cache = self.annotation_cache
+        if cache is not None and not self._is_annotation_error(markdown):
+            cache.put(cache.make_key(data["img_bytes"], self.PDF_ANNOTATION_PROMPT, self.multimodal_model), markdown)
+
+    def _annotate_page_uncached(self, data: Dict[str, Any], stats: _ParseStats) -> str:
+        """Annotates a single page with its own request and stores the result in the cache."""
+        stats.incr("llm_requests")
+        stats.incr("llm_pages")
+        stats.incr("bytes_sent", len(data["img_bytes"]))
+        markdown = self._process_single_page(data, stats)
+        self._store_page(data, markdown)
+        return markdown
+
+    @staticmethod
+    def _is_quota_error(markdown: str) -> bool:
+        lowered = (markdown or "").lower()
+        return "resource_exhausted" in lowered or "quota exceeded" in lowered
+
+    @staticmethod
+    def _is_annotation_error(markdown: str) -> bool:
+        """True for the placeholder strings returned when a page could not be annotated."""
+        return (markdown or "").lstrip().startswith(("[Error", "[Annotation blocked", "[Warning", "[FATAL"))
+
+    def _process_single_page(self, data: Dict[str, Any], stats: Optional[_ParseStats] = None) -> str:
         """
         Processes a single page image with Gemini, including retry logic.
 
         Args:
-            data: Dictionary containing page_num (0-indexed) and img_bytes.
+            data: Dictionary containing page_num (0-indexed), img_bytes and optionally mime_type.
+            stats: Parse stats receiving hedging metrics.
 
         Returns:
             Markdown text for the page or an error placeholder string.
@@ -140,56 +786,115 @@ class FinancialDocParser:
         img_bytes = data["img_bytes"]
         page_identifier = f"Page {page_num + 1}"
 
+        raw = self._generate_annotation(
+            [
+                types.Part.from_bytes(data=img_bytes, mime_type=data.get("mime_type", "image/png")),
+                self.PDF_ANNOTATION_PROMPT
+            ],
+            page_identifier,
+            stats,
+        )
+        if self._is_annotation_error(raw):
+            return raw
+        m = re.search(r"```(?:markdown)?\s*(.*?)\s*```", raw, re.DOTALL)
+        return m.group(1).strip() if m else raw.strip()
+
+    def _generate_annotation(self, contents: List[Any], identifier: str, stats: Optional[_ParseStats] = None) -> str:
+        """
+        Sends an annotation request to Gemini, including retry logic.
+
+        Requests go through the model's shared rate limiter, which paces them under the
+        quota and, after a 429, pauses for the server's retry hint before the next attempt.
+        While the Gemini circuit breaker is open no request is sent.
+        With a request hedger, a request slower than the recent p90 is duplicated when
+        the hedge budget and the rate limiter allow, and the first response is used.
+
+        Args:
+            contents: Request parts (page payload and prompt).
+            identifier: Label for log lines and error placeholders, e.g. "Page 3".
+            stats: Parse stats receiving hedging metrics.
+
+        Returns:
+            Raw response text or an error placeholder string.
+
+        Raises:
+            CircuitOpenError: Gemini is unavailable; the caller should give the whole parse up.
+        """
         max_retries = 5
         retry_delay = 10
+        rate_limiter = get_rate_limiter("gemini", self.multimodal_model)
+        circuit_breaker = get_circuit_breaker("gemini")
+        tokens = estimate_tokens(contents)
 
         for attempt in range(max_retries + 1):
-            print(f"{page_identifier}: Annotating (Attempt {attempt + 1}/{max_retries + 1})")
+            print(f"{identifier}: Annotating (Attempt {attempt + 1}/{max_retries + 1})")
+            circuit_breaker.before_call()
             try:
-                response = self.gemini_client.client.models.generate_content(
+                rate_limiter.acquire(tokens, PRIORITY_BULK)
+                send = functools.partial(
+                    self.gemini_client.client.models.generate_content,
                     model=self.multimodal_model,
-                    contents=[
-                        types.Part.from_bytes(data=img_bytes, mime_type="image/png"),
-                        self.PDF_ANNOTATION_PROMPT
-                    ]
+                    contents=contents
                 )
+                if self.request_hedger is not None:
+                    response = self.request_hedger.call(
+                        send,
+                        admit=lambda: rate_limiter.try_acquire(tokens, PRIORITY_BULK),
+                        on_metric=stats.incr if stats is not None else None,
+                    )
+                else:
+                    response = send()
+                circuit_breaker.record_success()
+                rate_limiter.record_success(tokens, response_tokens(response))
 
                 if hasattr(response, 'text') and response.text:
-                    raw = response.text
-                    m = re.search(r"```(?:markdown)?\s*(.*?)\s*```", raw, re.DOTALL)
-                    processed_text = m.group(1).strip() if m else raw.strip()
-                    print(f"{page_identifier}: Annotation successful.")
-                    return processed_text
+                    print(f"{identifier}: Annotation successful.")
+                    return response.text.strip()
 
                 elif hasattr(response, 'prompt_feedback') and response.prompt_feedback and hasattr(response.prompt_feedback, 'block_reason'):
                      block_reason = response.prompt_feedback.block_reason
-                     print(f"{page_identifier}: Annotation blocked ({block_reason}).")
-                     return f"[Annotation blocked for {page_identifier}: {block_reason}]"
+                     print(f"{identifier}: Annotation blocked ({block_reason}).")
+                     return f"[Annotation blocked for {identifier}: {block_reason}]"
 
                 elif hasattr(response, 'candidates') and response.candidates and len(response.candidates) > 0 and hasattr(response.candidates, 'finish_reason') and response.candidates.finish_reason == types.GenerateContentResponse.Candidate.FinishReason.RECITATION:
-                    print(f"{page_identifier}: Recitation detected - published content not transcribed.")
-                    return f"[Warning: {page_identifier}: Recitation of published content avoided.]"
+                    print(f"{identifier}: Recitation detected - published content not transcribed.")
+                    return f"[Warning: {identifier}: Recitation of published content avoided.]"
 
                 else:
-                    print(f"{page_identifier}: Received empty or unexpected AI response format.")
-                    return f"[Error processing {page_identifier}: Unexpected AI response.]"
+                    print(f"{identifier}: Received empty or unexpected AI response format.")
+                    return f"[Error processing {identifier}: Unexpected AI response.]"
 
 
             except Exception as e:
+                circuit_breaker.record_error(e)
+                if circuit_breaker.is_open():
+                    # Give the job back instead of sleeping through an outage
+                    raise CircuitOpenError(circuit_breaker.name, circuit_breaker.retry_after()) from e
                 error_details = str(e)
-                is_quota_exhausted = "resource_exhausted" in error_details.lower() or "quota exceeded" in error_details.lower()
-                is_retryable = ("429" in error_details or "503" in error_details or "rate limit" in error_details.lower()) and not is_quota_exhausted
+                is_rate_limited = is_rate_limit_error(e)
+                retry_after = retry_after_seconds(e) if is_rate_limited else None
+                if is_rate_limited:
+                    rate_limiter.record_rate_limited(retry_after)
+                # RESOURCE_EXHAUSTED without a short retry hint is a spent (e.g. daily) quota
+                is_quota_exhausted = (
+                    ("resource_exhausted" in error_details.lower() or "quota exceeded" in error_details.lower())
+                    and (retry_after is None or retry_after > rate_limiter.max_retry_wait)
+                )
+                is_retryable = (is_rate_limited or is_outage_error(e)) and not is_quota_exhausted
 
                 if is_retryable and attempt < max_retries:
-                    print(f"{page_identifier}: Retryable error: {error_details}... Retrying in {retry_delay}s")
-                    time.sleep(retry_delay)
+                    if is_rate_limited:
+                        print(f"{identifier}: Rate limited: {error_details}... Retrying when the rate limiter allows")
+                    else:
+                        print(f"{identifier}: Retryable error: {error_details}... Retrying in {retry_delay}s")
+                        time.sleep(retry_delay)
                 else:
                     error_msg = f"Failed after {attempt+1} attempts: {error_details}" if is_retryable else f"Non-retryable error: {error_details}"
-                    print(f"{page_identifier}: Processing failed - {error_msg}")
-                    return f"[Error processing {page_identifier}: {error_msg}]"
+                    print(f"{identifier}: Processing failed - {error_msg}")
+                    return f"[Error processing {identifier}: {error_msg}]"
 
-        print(f"{page_identifier}: Loop finished unexpectedly without returning.")
-        return f"[Error: Unknown issue processing {page_identifier} after loop.]"
+        print(f"{identifier}: Loop finished unexpectedly without returning.")
+        return f"[Error: Unknown issue processing {identifier} after loop.]"
 
     def _extract_text_fallback(self, pdf_document: pymupdf.Document) -> str:
         parts: list[str] = []
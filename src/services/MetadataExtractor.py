@@ -4,6 +4,7 @@ from src.llm.GeminiClient import GeminiClient
 from src.prompts.prompt_manager import PromptManager
 from src.models.metadata_models import FinancialDocumentMetadata, IncomeStatementSummaryFields
 from src.config.gemini_config import TEXT_MODEL
+from src.llm.RateLimiter import PRIORITY_METADATA, estimate_tokens, get_rate_limiter
 from src.enums import FinancialDocSpecificType
 
 
@@ -18,6 +19,7 @@ class MetadataExtractor:
         """
         self.gemini_client = gemini_client or GeminiClient()
         self.text_model = TEXT_MODEL  # Use text model from config
+        self.rate_limiter = get_rate_limiter("gemini", self.text_model)
 
     def extract_metadata(
         self,
@@ -29,67 +31,65 @@ class MetadataExtractor:
         """
         Sends text snippet to LLM to extract structured metadata.
         """
-        truncated = (markdown_text_snippet or "")[:truncate_length]
-
-        filename_hint = (original_filename or "").strip()
-        forced_hint = forced_doc_specific_type.value if forced_doc_specific_type else ""
-        preamble_lines: list[str] = []
-        if filename_hint:
-            preamble_lines.append(f"FILENAME: {filename_hint}")
-        if forced_hint:
-            preamble_lines.append(f"DOC_TYPE_HINT: {forced_hint}")
-
-        if preamble_lines:
-            truncated = "\n".join(preamble_lines) + "\n\n" + truncated
-
-        formatted_prompt = PromptManager.get_prompt(
-            "metadata_extraction",
-            document_text_snippet=truncated
+        formatted_prompt = self._build_metadata_prompt(
+            markdown_text_snippet, truncate_length, original_filename, forced_doc_specific_type
         )
 
         print("Sending text snippet to LLM for structured metadata extraction…")
-        empty_metadata = FinancialDocumentMetadata(
-            doc_specific_type=FinancialDocSpecificType.UNKNOWN,
-            company_name="",
-            report_date=None,
-            doc_year=-1,
-            doc_quarter=-1,
-            doc_summary="",
-            total_revenue=None,
-            total_expenses=None,
-            net_income=None,
-            currency=None,
-            period_start_date=None,
-            period_end_date=None,
-        )
         try:
-            response = self.gemini_client.client.models.generate_content(
-                model=self.text_model,
-                contents=[formatted_prompt],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=FinancialDocumentMetadata
-                )
+            response = self.rate_limiter.call(
+                lambda: self.gemini_client.client.models.generate_content(
+                    model=self.text_model,
+                    contents=[formatted_prompt],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        response_schema=FinancialDocumentMetadata
+                    )
+                ),
+                tokens=estimate_tokens(formatted_prompt),
+                priority=PRIORITY_METADATA,
             )
+            return self._handle_metadata_response(response)
+        except Exception as e:
+            if not self._is_quota_error(e):
+                raise
 
-            extracted_metadata: FinancialDocumentMetadata = response.parsed
-            if extracted_metadata is not None:
-                print("Structured metadata extraction attempted.")
-                return extracted_metadata, False
+        print("Metadata extraction rate-limited (quota). Returning empty metadata (UNKNOWN).")
+        return self._empty_metadata(), True
+
+    async def aextract_metadata(
+        self,
+        markdown_text_snippet: str,
+        truncate_length: int = 16000,
+        original_filename: str | None = None,
+        forced_doc_specific_type: FinancialDocSpecificType | None = None,
+    ) -> tuple[FinancialDocumentMetadata, bool]:
+        """Async variant of `extract_metadata` using the Gemini async client."""
+        formatted_prompt = self._build_metadata_prompt(
+            markdown_text_snippet, truncate_length, original_filename, forced_doc_specific_type
+        )
 
-            print(
-                "Metadata extraction returned an empty/invalid parsed response (not quota-limited). "
-                "Returning empty metadata (UNKNOWN)."
+        print("Sending text snippet to LLM for structured metadata extraction…")
+        try:
+            response = await self.rate_limiter.acall(
+                lambda: self.gemini_client.client.aio.models.generate_content(
+                    model=self.text_model,
+                    contents=[formatted_prompt],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        response_schema=FinancialDocumentMetadata
+                    )
+                ),
+                tokens=estimate_tokens(formatted_prompt),
+                priority=PRIORITY_METADATA,
             )
-            return empty_metadata, False
+            return self._handle_metadata_response(response)
         except Exception as e:
-            error_text = str(e)
-            is_quota = "resource_exhausted" in error_text.lower() or "quota exceeded" in error_text.lower() or "429" in error_text
-            if not is_quota:
+            if not self._is_quota_error(e):
                 raise
 
         print("Metadata extraction rate-limited (quota). Returning empty metadata (UNKNOWN).")
-        return empty_metadata, True
+        return self._empty_metadata(), True
 
     def extract_income_statement_fields(
         self,
@@ -102,35 +102,139 @@ class MetadataExtractor:
         Intended as a second pass when the main metadata extraction did not populate
         required fields for income_statement_summaries.
         """
-        truncated = (markdown_text_snippet or "")[:truncate_length]
+        formatted_prompt = self._build_income_fields_prompt(markdown_text_snippet, truncate_length, original_filename)
 
-        filename_hint = (original_filename or "").strip()
-        if filename_hint:
-            truncated = f"FILENAME: {filename_hint}\n\n" + truncated
+        print("Sending text snippet to LLM for income statement fields extraction…")
+        try:
+            response = self.rate_limiter.call(
+                lambda: self.gemini_client.client.models.generate_content(
+                    model=self.text_model,
+                    contents=[formatted_prompt],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        response_schema=IncomeStatementSummaryFields,
+                    ),
+                ),
+                tokens=estimate_tokens(formatted_prompt),
+                priority=PRIORITY_METADATA,
+            )
+            return self._handle_income_fields_response(response)
+        except Exception as e:
+            if self._is_quota_error(e):
+                print("Income statement fields extraction rate-limited (quota). Skipping second pass.")
+                return None
+            raise
 
-        formatted_prompt = PromptManager.get_prompt(
-            "income_statement_fields_extraction",
-            document_text_snippet=truncated,
-        )
+    async def aextract_income_statement_fields(
+        self,
+        markdown_text_snippet: str,
+        truncate_length: int = 16000,
+        original_filename: str | None = None,
+    ) -> IncomeStatementSummaryFields | None:
+        """Async variant of `extract_income_statement_fields` using the Gemini async client."""
+        formatted_prompt = self._build_income_fields_prompt(markdown_text_snippet, truncate_length, original_filename)
 
         print("Sending text snippet to LLM for income statement fields extraction…")
         try:
-            response = self.gemini_client.client.models.generate_content(
-                model=self.text_model,
-                contents=[formatted_prompt],
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=IncomeStatementSummaryFields,
+            response = await self.rate_limiter.acall(
+                lambda: self.gemini_client.client.aio.models.generate_content(
+                    model=self.text_model,
+                    contents=[formatted_prompt],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="application/json",
+                        response_schema=IncomeStatementSummaryFields,
+                    ),
                 ),
+                tokens=estimate_tokens(formatted_prompt),
+                priority=PRIORITY_METADATA,
             )
-            fields: IncomeStatementSummaryFields = response.parsed
-            if fields:
-                print("Income statement fields extraction attempted.")
-            return fields
+            return self._handle_income_fields_response(response)
         except Exception as e:
-            error_text = str(e)
-            is_quota = "resource_exhausted" in error_text.lower() or "quota exceeded" in error_text.lower() or "429" in error_text
-            if is_quota:
+            if self._is_quota_error(e):
                 print("Income statement fields extraction rate-limited (quota). Skipping second pass.")
                 return None
-            raise
\ No newline at end of file
+            raise
+
+    @staticmethod
+    def _build_metadata_prompt(
+        markdown_text_snippet: str,
+        truncate_length: int,
+        original_filename: str | None,
+        forced_doc_specific_type: FinancialDocSpecificType | None,
+    ) -> str:
+        truncated = (markdown_text_snippet or "")[:truncate_length]
+
+        filename_hint = (original_filename or "").strip()
+        forced_hint = forced_doc_specific_type.value if forced_doc_specific_type else ""
+        preamble_lines: list[str] = []
+        if filename_hint:
+            preamble_lines.append(f"FILENAME: {filename_hint}")
+        if forced_hint:
+            preamble_lines.append(f"DOC_TYPE_HINT: {forced_hint}")
+
+        if preamble_lines:
+            truncated = "\n".join(preamble_lines) + "\n\n" + truncated
+
+        return PromptManager.get_prompt(
+            "metadata_extraction",
+            document_text_snippet=truncated
+        )
+
+    @staticmethod
+    def _build_income_fields_prompt(
+        markdown_text_snippet: str,
+        truncate_length: int,
+        original_filename: str | None,
+    ) -> str:
+        truncated = (markdown_text_snippet or "")[:truncate_length]
+
+        filename_hint = (original_filename or "").strip()
+        if filename_hint:
+            truncated = f"FILENAME: {filename_hint}\n\n" + truncated
+
+        return PromptManager.get_prompt(
+            "income_statement_fields_extraction",
+            document_text_snippet=truncated,
+        )
+
+    @staticmethod
+    def _empty_metadata() -> FinancialDocumentMetadata:
+        return FinancialDocumentMetadata(
+            doc_specific_type=FinancialDocSpecificType.UNKNOWN,
+            company_name="",
+            report_date=None,
+            doc_year=-1,
+            doc_quarter=-1,
+            doc_summary="",
+            total_revenue=None,
+            total_expenses=None,
+            net_income=None,
+            currency=None,
+            period_start_date=None,
+            period_end_date=None,
+        )
+
+    def _handle_metadata_response(self, response) -> tuple[FinancialDocumentMetadata, bool]:
+        extracted_metadata: FinancialDocumentMetadata = response.parsed
+        if extracted_metadata is not None:
+            print("Structured metadata extraction attempted.")
+            return extracted_metadata, False
+
+        print(
+            "Metadata extraction returned an empty/invalid parsed response (not quota-limited). "
+            "Returning empty metadata (UNKNOWN)."
+        )
+        return self._empty_metadata(), False
+
+    @staticmethod
+    def _handle_income_fields_response(response) -> IncomeStatementSummaryFields | None:
+        fields: IncomeStatementSummaryFields = response.parsed
+        if fields:
+            print("Income statement fields extraction attempted.")
+        return fields
+
+    @staticmethod
+    def _is_quota_error(error: Exception) -> bool:
+        # Only reached once the rate limiter's retries are used up (or the quota is spent for the day)
+        error_text = str(error)
+        return "resource_exhausted" in error_text.lower() or "quota exceeded" in error_text.lower() or "429" in error_text
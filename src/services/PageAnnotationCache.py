@@ -0,0 +1,157 @@
+# src/services/PageAnnotationCache.py
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional, Dict, Any
+
+
+class PageAnnotationCache:
+    """
+    Persistent, content-addressed cache of page annotations.
+
+    Entries are keyed by sha256(page image bytes + annotation prompt + model name)
+    and stored in a single SQLite file so they survive restarts and can be shared
+    by every worker process on the host. Total stored markdown is bounded by
+    `max_bytes`; the least recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: Directory for the cache database (env PAGE_ANNOTATION_CACHE_DIR).
+            max_bytes: Size bound for stored annotations (env PAGE_ANNOTATION_CACHE_MAX_MB, default 512 MB).
+        """
+        self.cache_dir = cache_dir or os.getenv(
+            "PAGE_ANNOTATION_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "stackrag_page_annotation_cache"),
+        )
+        self.max_bytes = max_bytes or int(float(os.getenv("PAGE_ANNOTATION_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "annotations.sqlite3")
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS page_annotations (
+                key TEXT PRIMARY KEY,
+                markdown TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_page_annotations_last_access ON page_annotations(last_access)")
+        self._conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        print(f"PageAnnotationCache initialized at {self.db_path} (max {self.max_bytes // (1024 * 1024)} MB)")
+
+    @staticmethod
+    def make_key(content: bytes, prompt: str, model: str) -> str:
+        """Builds the content-addressed cache key for a page."""
+        digest = hashlib.sha256()
+        digest.update(content)
+        digest.update(b"\x00")
+        digest.update(prompt.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(model.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached annotation for `key`, or None on a miss."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT markdown FROM page_annotations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self._conn.execute(
+                    "UPDATE page_annotations SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+        except sqlite3.Error as e:
+            print(f"Warning: Page annotation cache read failed: {e}")
+            return None
+
+    def put(self, key: str, markdown: str) -> None:
+        """Stores an annotation and evicts least recently used entries over the size bound."""
+        size_bytes = len(markdown.encode("utf-8"))
+        if size_bytes > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO page_annotations (key, markdown, size_bytes, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, markdown, size_bytes, now, now),
+                )
+                self._evict_locked()
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: Page annotation cache write failed: {e}")
+
+    def _evict_locked(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM page_annotations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size_bytes FROM page_annotations ORDER BY last_access ASC"
+        ).fetchall()
+        evicted_keys = []
+        for key, size_bytes in rows:
+            if total <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            total -= size_bytes
+        self._conn.executemany("DELETE FROM page_annotations WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and current cache occupancy."""
+        with self._lock:
+            entries, size_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM page_annotations"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": size_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_shared_cache: Optional[PageAnnotationCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_page_annotation_cache() -> Optional[PageAnnotationCache]:
+    """Returns the process-wide page annotation cache, or None when disabled (PAGE_ANNOTATION_CACHE=0)."""
+    global _shared_cache
+    if os.getenv("PAGE_ANNOTATION_CACHE", "1") == "0":
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            try:
+                _shared_cache = PageAnnotationCache()
+            except Exception as e:
+                print(f"Warning: Page annotation cache unavailable: {e}")
+                return None
+        return _shared_cache
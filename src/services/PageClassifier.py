@@ -0,0 +1,155 @@
+# src/services/PageClassifier.py
+
+import os
+import re
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fitz as pymupdf  # type: ignore[import-not-found]  # PyMuPDF canonical import
+except Exception:  # pragma: no cover
+    import pymupdf  # type: ignore[import-not-found]
+
+PageRoute = Dict[str, Any]  # Contains 'route' ('local' | 'multimodal'), 'reason', 'markdown' (local pages only)
+
+_NUMERIC_TOKEN_PATTERN = re.compile(r"\(?-?[$€£]?\d[\d,]*(?:\.\d+)?%?\)?")
+
+
+class PageClassifier:
+    """
+    Routes individual PDF pages to local text extraction or multimodal annotation.
+
+    Pages with a clean text layer and no complex tables are converted to markdown
+    locally with PyMuPDF. Scanned, image-heavy, garbled or table-heavy pages are
+    left for the multimodal model.
+    """
+
+    LOCAL = "local"
+    MULTIMODAL = "multimodal"
+
+    def __init__(
+        self,
+        min_text_chars: Optional[int] = None,
+        max_image_coverage: Optional[float] = None,
+        max_garbled_ratio: Optional[float] = None,
+        max_numeric_line_ratio: Optional[float] = None,
+        max_empty_cell_ratio: Optional[float] = None,
+    ):
+        """
+        Thresholds default to PAGE_CLASSIFIER_* environment variables.
+
+        Args:
+            min_text_chars: Below this many text-layer characters a page is treated as scanned.
+            max_image_coverage: Fraction of the page area covered by images above which a page is image-heavy.
+            max_garbled_ratio: Fraction of unreadable characters above which the text layer is untrusted.
+            max_numeric_line_ratio: Fraction of lines holding 2+ figures above which a page is an unruled table.
+            max_empty_cell_ratio: Fraction of empty/merged cells above which a detected table is complex.
+        """
+        self.min_text_chars = min_text_chars if min_text_chars is not None else int(os.getenv("PAGE_CLASSIFIER_MIN_TEXT_CHARS", "200"))
+        self.max_image_coverage = max_image_coverage if max_image_coverage is not None else float(os.getenv("PAGE_CLASSIFIER_MAX_IMAGE_COVERAGE", "0.35"))
+        self.max_garbled_ratio = max_garbled_ratio if max_garbled_ratio is not None else float(os.getenv("PAGE_CLASSIFIER_MAX_GARBLED_RATIO", "0.02"))
+        self.max_numeric_line_ratio = max_numeric_line_ratio if max_numeric_line_ratio is not None else float(os.getenv("PAGE_CLASSIFIER_MAX_NUMERIC_LINE_RATIO", "0.4"))
+        self.max_empty_cell_ratio = max_empty_cell_ratio if max_empty_cell_ratio is not None else float(os.getenv("PAGE_CLASSIFIER_MAX_EMPTY_CELL_RATIO", "0.3"))
+
+    def classify(self, page: pymupdf.Page) -> PageRoute:
+        """
+        Classifies a page and, for local pages, extracts its markdown.
+
+        Args:
+            page: PyMuPDF page.
+
+        Returns:
+            Dictionary with the chosen route, the reason and, for local pages, the markdown.
+        """
+        text = page.get_text("text") or ""
+        stripped = text.strip()
+        if len(stripped) < self.min_text_chars:
+            if not page.get_image_info() and not page.get_drawings():
+                return {"route": self.LOCAL, "reason": "blank_page", "markdown": stripped or "[No extractable text on this page]"}
+            return {"route": self.MULTIMODAL, "reason": "sparse_text_layer"}
+
+        garbled = sum(1 for ch in stripped if ch == "�" or (not ch.isprintable() and not ch.isspace()))
+        if garbled / len(stripped) > self.max_garbled_ratio:
+            return {"route": self.MULTIMODAL, "reason": "garbled_text_layer"}
+
+        page_area = abs(page.rect) or 1.0
+        image_area = 0.0
+        for info in page.get_image_info():
+            image_area += abs(pymupdf.Rect(info["bbox"]) & page.rect)
+        if image_area / page_area > self.max_image_coverage:
+            return {"route": self.MULTIMODAL, "reason": "image_heavy"}
+
+        # find_tables only detects ruled tables, and on a dense page it holds the GIL for
+        # well over 100 ms, stalling the event loop of the pipeline that called us.
+        has_rulings = bool(page.get_drawings())
+        tables = page.find_tables().tables if has_rulings and hasattr(page, "find_tables") else []
+        for table in tables:
+            if self._is_complex_table(table):
+                return {"route": self.MULTIMODAL, "reason": "complex_table"}
+
+        if not tables:
+            lines = [line for line in stripped.splitlines() if line.strip()]
+            numeric_lines = sum(1 for line in lines if len(_NUMERIC_TOKEN_PATTERN.findall(line)) >= 2)
+            if lines and numeric_lines / len(lines) > self.max_numeric_line_ratio:
+                return {"route": self.MULTIMODAL, "reason": "unruled_table_layout"}
+
+        return {"route": self.LOCAL, "reason": "clean_text_layer", "markdown": self.extract_markdown(page, tables)}
+
+    def _is_complex_table(self, table: Any) -> bool:
+        rows = table.extract()
+        cells = [cell for row in rows for cell in row]
+        if not cells:
+            return False
+        empty = sum(1 for cell in cells if cell is None or not str(cell).strip())
+        return empty / len(cells) > self.max_empty_cell_ratio
+
+    def extract_markdown(self, page: pymupdf.Page, tables: Optional[List[Any]] = None) -> str:
+        """
+        Converts a page's text layer to markdown in reading order.
+
+        Lines set noticeably larger than the page's body text become headings so the
+        Sectioner can split locally extracted pages the same way as annotated ones.
+        Simple ruled tables are emitted as markdown tables.
+        """
+        tables = tables or []
+        table_rects = [pymupdf.Rect(t.bbox) for t in tables]
+        page_dict = page.get_text("dict", sort=True)
+
+        span_sizes: List[float] = []
+        for block in page_dict.get("blocks", []):
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    span_sizes.extend([span["size"]] * len(span["text"].strip()))
+        body_size = statistics.median(span_sizes) if span_sizes else 0.0
+
+        items: List[Tuple[float, str]] = []
+        for block in page_dict.get("blocks", []):
+            if block.get("type") != 0:
+                continue
+            block_rect = pymupdf.Rect(block["bbox"])
+            center = pymupdf.Point((block_rect.x0 + block_rect.x1) / 2, (block_rect.y0 + block_rect.y1) / 2)
+            if any(center in rect for rect in table_rects):
+                continue
+
+            lines_text = []
+            max_size = 0.0
+            for line in block.get("lines", []):
+                line_text = "".join(span["text"] for span in line.get("spans", [])).strip()
+                if line_text:
+                    lines_text.append(line_text)
+                for span in line.get("spans", []):
+                    if span["text"].strip():
+                        max_size = max(max_size, span["size"])
+            block_text = "\n".join(lines_text).strip()
+            if not block_text:
+                continue
+
+            if body_size and max_size >= body_size * 1.25 and len(block_text) <= 120 and "\n" not in block_text:
+                block_text = f"## {block_text}"
+            items.append((block_rect.y0, block_text))
+
+        for table, rect in zip(tables, table_rects):
+            items.append((rect.y0, table.to_markdown(clean=False).strip()))
+
+        items.sort(key=lambda item: item[0])
+        return "\n\n".join(text for _, text in items)
@@ -0,0 +1,245 @@
+# src/services/PageRenderer.py
+
+import concurrent.futures
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fitz as pymupdf  # type: ignore[import-not-found]  # PyMuPDF canonical import
+except Exception:  # pragma: no cover
+    import pymupdf  # type: ignore[import-not-found]
+
+RenderedPage = Dict[str, Any]  # Contains 'img_bytes', 'mime_type', 'zoom', 'encoding', 'width', 'height',
+                               # 'payload_bytes', 'render_seconds', 'cropped'
+
+
+class FixedPageRenderer:
+    """Renders every page at a fixed zoom as RGB PNG (the original behaviour)."""
+
+    def __init__(self, zoom: float = 3.0):
+        self.zoom = zoom
+
+    def render(self, page: pymupdf.Page) -> RenderedPage:
+        start = time.perf_counter()
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(self.zoom, self.zoom))
+        img_bytes = pix.tobytes("png")
+        return {
+            "img_bytes": img_bytes,
+            "mime_type": "image/png",
+            "zoom": self.zoom,
+            "encoding": "png",
+            "width": pix.width,
+            "height": pix.height,
+            "payload_bytes": len(img_bytes),
+            "render_seconds": time.perf_counter() - start,
+            "cropped": False,
+        }
+
+
+class AdaptivePageRenderer:
+    """
+    Renders pages for annotation with resolution and encoding chosen per page.
+
+    Zoom is derived from the page's body font size (so small print stays legible)
+    or, for pages without a text layer, from the page size. White margins are
+    cropped away. Encodings are tried from most to least faithful — PNG, then
+    JPEG at decreasing quality, grayscale whenever the page has no colour — and
+    the zoom is stepped down until the payload fits the per-page byte budget.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        min_zoom: Optional[float] = None,
+        max_zoom: Optional[float] = None,
+        target_glyph_px: Optional[float] = None,
+        max_long_side_px: Optional[int] = None,
+    ):
+        """
+        Settings default to PDF_RENDER_* environment variables.
+
+        Args:
+            max_bytes: Per-page payload budget in bytes (default 1,000,000).
+            min_zoom: Lowest zoom the renderer will step down to (default 1.0).
+            max_zoom: Highest zoom used for very small print (default 3.0).
+            target_glyph_px: Rendered pixel height aimed for the body font size (default 24).
+            max_long_side_px: Cap on the rendered image's long side (default 3072).
+        """
+        self.max_bytes = max_bytes or int(os.getenv("PDF_RENDER_MAX_BYTES", "1000000"))
+        self.min_zoom = min_zoom or float(os.getenv("PDF_RENDER_MIN_ZOOM", "1.0"))
+        self.max_zoom = max_zoom or float(os.getenv("PDF_RENDER_MAX_ZOOM", "3.0"))
+        self.target_glyph_px = target_glyph_px or float(os.getenv("PDF_RENDER_TARGET_GLYPH_PX", "24"))
+        self.max_long_side_px = max_long_side_px or int(os.getenv("PDF_RENDER_MAX_LONG_SIDE_PX", "3072"))
+
+    def render(self, page: pymupdf.Page) -> RenderedPage:
+        """
+        Renders a page under the byte budget.
+
+        Returns:
+            Dictionary with the encoded image, its mime type and the choices made.
+        """
+        start = time.perf_counter()
+        clip = self._content_clip(page)
+        zoom = self._pick_zoom(page, clip)
+        grayscale = not self._has_colour(page, clip)
+        photo_heavy = self._image_coverage(page, clip) > 0.5
+
+        img_bytes, mime_type, encoding, pix = b"", "image/png", "png", None
+        while True:
+            colorspace = pymupdf.csGRAY if grayscale else pymupdf.csRGB
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), clip=clip, colorspace=colorspace)
+            for candidate_encoding, candidate_mime, quality in self._encodings(photo_heavy):
+                img_bytes = pix.tobytes(candidate_encoding, jpg_quality=quality) if quality else pix.tobytes(candidate_encoding)
+                mime_type = candidate_mime
+                encoding = f"{candidate_encoding}{quality or ''}{'-gray' if grayscale else ''}"
+                if len(img_bytes) <= self.max_bytes:
+                    break
+            if len(img_bytes) <= self.max_bytes or zoom <= self.min_zoom:
+                break
+            zoom = max(self.min_zoom, zoom * 0.8)
+
+        return {
+            "img_bytes": img_bytes,
+            "mime_type": mime_type,
+            "zoom": round(zoom, 3),
+            "encoding": encoding,
+            "width": pix.width,
+            "height": pix.height,
+            "payload_bytes": len(img_bytes),
+            "render_seconds": time.perf_counter() - start,
+            "cropped": clip != page.rect,
+        }
+
+    @staticmethod
+    def _encodings(photo_heavy: bool) -> List[Tuple[str, str, Optional[int]]]:
+        jpeg = [("jpeg", "image/jpeg", 85), ("jpeg", "image/jpeg", 70)]
+        png = [("png", "image/png", None)]
+        return jpeg + png if photo_heavy else png + jpeg
+
+    @staticmethod
+    def _content_clip(page: pymupdf.Page, padding: float = 12.0) -> pymupdf.Rect:
+        """Bounding box of everything drawn on the page, padded, or the full page when empty."""
+        content = pymupdf.Rect()
+        for block in page.get_text("blocks"):
+            content |= pymupdf.Rect(block[:4])
+        for info in page.get_image_info():
+            content |= pymupdf.Rect(info["bbox"])
+        for drawing in page.get_drawings():
+            content |= drawing["rect"]
+        if content.is_empty:
+            return pymupdf.Rect(page.rect)
+        clip = pymupdf.Rect(content.x0 - padding, content.y0 - padding, content.x1 + padding, content.y1 + padding)
+        return clip & page.rect
+
+    def _pick_zoom(self, page: pymupdf.Page, clip: pymupdf.Rect) -> float:
+        sizes: List[float] = []
+        for block in page.get_text("dict", clip=clip).get("blocks", []):
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    if span["text"].strip():
+                        sizes.extend([span["size"]] * len(span["text"].strip()))
+        if sizes:
+            # Render the smaller half of the text (footnotes, table figures) at the target height.
+            zoom = self.target_glyph_px / max(1.0, statistics.median_low(sorted(sizes)[: max(1, len(sizes) // 2)]))
+        else:
+            # No text layer (scans): size by page so a letter page lands around 2000 px tall.
+            zoom = 2000.0 / max(1.0, max(clip.width, clip.height))
+        zoom = min(zoom, self.max_long_side_px / max(1.0, max(clip.width, clip.height)))
+        return max(self.min_zoom, min(self.max_zoom, zoom))
+
+    @staticmethod
+    def _has_colour(page: pymupdf.Page, clip: pymupdf.Rect, tolerance: int = 24) -> bool:
+        """Samples a thumbnail and reports whether any pixel is noticeably non-gray."""
+        thumb = page.get_pixmap(matrix=pymupdf.Matrix(0.25, 0.25), clip=clip, colorspace=pymupdf.csRGB)
+        samples = thumb.samples
+        for i in range(0, len(samples) - 2, 3):
+            r, g, b = samples[i], samples[i + 1], samples[i + 2]
+            if max(r, g, b) - min(r, g, b) > tolerance:
+                return True
+        return False
+
+    @staticmethod
+    def _image_coverage(page: pymupdf.Page, clip: pymupdf.Rect) -> float:
+        area = abs(clip) or 1.0
+        covered = sum(abs(pymupdf.Rect(info["bbox"]) & clip) for info in page.get_image_info())
+        return covered / area
+
+
+def create_page_renderer(mode: Optional[str] = None):
+    """Returns the renderer for PDF_RENDER_MODE: "adaptive" (default) or "fixed" (3x PNG)."""
+    mode = (mode or os.getenv("PDF_RENDER_MODE", "adaptive")).strip().lower()
+    if mode == "fixed":
+        return FixedPageRenderer()
+    if mode == "adaptive":
+        return AdaptivePageRenderer()
+    raise ValueError(f"Unsupported PDF render mode: {mode}")
+
+
+# Document opened by the current render worker process, reused across page ranges of the same file.
+_worker_document: Optional[Tuple[str, pymupdf.Document]] = None
+
+
+def _render_pages_in_worker(pdf_path: str, page_nums: List[int], renderer: Any) -> List[RenderedPage]:
+    """Runs in a worker process: renders the given pages of the PDF at `pdf_path`."""
+    global _worker_document
+    if _worker_document is None or _worker_document[0] != pdf_path:
+        if _worker_document is not None:
+            _worker_document[1].close()
+        _worker_document = (pdf_path, pymupdf.open(pdf_path))
+    pdf_document = _worker_document[1]
+    return [renderer.render(pdf_document[page_num]) for page_num in page_nums]
+
+
+class ProcessPoolPageRenderer:
+    """
+    Renders page ranges in worker processes.
+
+    Rasterization and image encoding hold the GIL, so rendering on the parsing
+    thread serializes it and stalls the API's event loop. Worker processes open the
+    PDF from a temporary file shared with the parent, render with a copy of the
+    configured renderer, and return the encoded images, so render throughput scales
+    with cores.
+    """
+
+    def __init__(self, max_processes: Optional[int] = None):
+        """
+        Args:
+            max_processes: Worker processes (env PDF_RENDER_PROCESSES; default is the CPU count).
+        """
+        self.max_processes = max(1, max_processes or int(os.getenv("PDF_RENDER_PROCESSES", "0")) or os.cpu_count() or 1)
+        # "spawn" keeps forked children from inheriting locks held by the parent's worker threads.
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def submit(self, pdf_path: str, page_nums: List[int], renderer: Any) -> concurrent.futures.Future:
+        """
+        Schedules rendering of `page_nums` (0-based) from the PDF at `pdf_path`.
+
+        Returns:
+            Future resolving to one RenderedPage per requested page, in order.
+        """
+        return self._executor.submit(_render_pages_in_worker, pdf_path, list(page_nums), renderer)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+_shared_process_renderer: Optional[ProcessPoolPageRenderer] = None
+_shared_process_renderer_lock = threading.Lock()
+
+
+def get_process_page_renderer() -> Optional[ProcessPoolPageRenderer]:
+    """Returns the process-wide render pool, or None unless PDF_RENDER_PROCESSES is set above 0."""
+    global _shared_process_renderer
+    if int(os.getenv("PDF_RENDER_PROCESSES", "0")) <= 0:
+        return None
+    with _shared_process_renderer_lock:
+        if _shared_process_renderer is None:
+            _shared_process_renderer = ProcessPoolPageRenderer()
+        return _shared_process_renderer
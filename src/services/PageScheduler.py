@@ -0,0 +1,257 @@
+# src/services/PageScheduler.py
+
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from src.jobs.ClusterCoordinator import SlotLease, get_cluster_semaphore
+
+_Task = Tuple[concurrent.futures.Future, Callable[[], Any], float]
+
+
+class PageScheduler:
+    """
+    Process-wide worker pool for page annotation tasks.
+
+    Every ingestion job submits its page tasks here instead of running its own
+    thread pool, so total concurrency against the provider is capped once per
+    process. Workers pick the next task round-robin across users, and within a
+    user round-robin across that user's jobs, so a 400-page report cannot starve
+    a 2-page invoice and a lone large job can still use every worker.
+
+    With PAGE_CLUSTER_CONCURRENCY and a COORDINATION_BACKEND set, a worker also holds
+    a cluster-wide slot while running a task, capping page calls across processes.
+    The slot is taken before the task is dequeued, and only one worker per process
+    polls for a slot while the cluster is saturated; slots held for longer than a
+    third of their TTL are renewed by a background thread.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, name: str = "page-scheduler"):
+        """
+        Args:
+            max_concurrency: Worker threads shared by all jobs (env PAGE_SCHEDULER_CONCURRENCY, default 8).
+            name: Thread name prefix.
+        """
+        self.max_concurrency = max(1, max_concurrency or int(os.getenv("PAGE_SCHEDULER_CONCURRENCY", "8")))
+        self.name = name
+        self._cond = threading.Condition()
+        self._user_order: Deque[str] = collections.deque()
+        self._user_jobs: Dict[str, Deque[str]] = {}
+        self._job_tasks: Dict[str, Deque[_Task]] = {}
+        self._job_users: Dict[str, str] = {}
+        self._workers: list[threading.Thread] = []
+        self._running = 0
+        self._completed = 0
+        self._shutdown = False
+        self._cluster_slots = get_cluster_semaphore("page-annotation", "PAGE_CLUSTER_CONCURRENCY")
+        self._acquiring_slot = False
+        self._held_slots: Dict[int, List[Any]] = {}  # id(lease) -> [lease, last renewed (monotonic)]
+        self._renewer: Optional[threading.Thread] = None
+
+    def submit(self, job_key: str, user_key: str, fn: Callable[[], Any]) -> concurrent.futures.Future:
+        """
+        Queues a task for a job.
+
+        Returns:
+            Future resolved with the task's result. Its `queue_wait_seconds` attribute
+            is set when a worker picks the task up.
+        """
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("PageScheduler has been shut down")
+            self._ensure_workers_locked()
+            tasks = self._job_tasks.get(job_key)
+            if tasks is None:
+                tasks = self._job_tasks[job_key] = collections.deque()
+                self._job_users[job_key] = user_key
+                jobs = self._user_jobs.get(user_key)
+                if jobs is None:
+                    jobs = self._user_jobs[user_key] = collections.deque()
+                    self._user_order.append(user_key)
+                jobs.append(job_key)
+            tasks.append((future, fn, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def _ensure_workers_locked(self) -> None:
+        while len(self._workers) < self.max_concurrency:
+            worker = threading.Thread(target=self._worker_loop, name=f"{self.name}-{len(self._workers)}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+        if self._cluster_slots is not None and self._renewer is None:
+            self._renewer = threading.Thread(target=self._renew_loop, name=f"{self.name}-slots", daemon=True)
+            self._renewer.start()
+
+    def _next_task_locked(self) -> Optional[_Task]:
+        if not self._user_order:
+            return None
+        user_key = self._user_order.popleft()
+        jobs = self._user_jobs[user_key]
+        job_key = jobs.popleft()
+        tasks = self._job_tasks[job_key]
+        task = tasks.popleft()
+
+        if tasks:
+            jobs.append(job_key)
+        else:
+            del self._job_tasks[job_key]
+            del self._job_users[job_key]
+        if jobs:
+            self._user_order.append(user_key)
+        else:
+            del self._user_jobs[user_key]
+        return task
+
+    def _take_task(self) -> Optional[Tuple[_Task, Optional[SlotLease]]]:
+        """
+        Waits for a queued task and, with cluster slots, a free slot; None once shut down and drained.
+
+        Tasks stay queued until a slot is held, so the round-robin order is applied
+        to the tasks waiting at that moment. One worker at a time polls for a slot;
+        the others wait until it hands over. If the scheduler is shut down while no
+        slot is free, the queued tasks are failed rather than polled for forever.
+        """
+        while True:
+            with self._cond:
+                while not self._user_order or self._acquiring_slot:
+                    if self._shutdown and not self._user_order:
+                        return None
+                    self._cond.wait()
+                if self._cluster_slots is None:
+                    return self._next_task_locked(), None
+                self._acquiring_slot = True
+
+            slot_lease = None
+            try:
+                while slot_lease is None:
+                    try:
+                        slot_lease = self._cluster_slots.try_acquire()
+                    except Exception as e:
+                        print(f"Warning: Failed to acquire a page annotation slot: {e}")
+                    if slot_lease is None:
+                        with self._cond:
+                            if self._shutdown:
+                                break
+                            self._cond.wait(self._cluster_slots.poll_interval)
+            finally:
+                with self._cond:
+                    self._acquiring_slot = False
+                    task = self._next_task_locked() if slot_lease is not None and self._user_order else None
+                    if task is not None:
+                        self._held_slots[id(slot_lease)] = [slot_lease, time.monotonic()]
+                    self._cond.notify()
+            if task is not None:
+                return task, slot_lease
+            if slot_lease is None:
+                self._fail_queued(RuntimeError("PageScheduler was shut down while waiting for a page annotation slot"))
+                return None
+            self._cluster_slots.release(slot_lease)
+
+    def _fail_queued(self, error: Exception) -> None:
+        with self._cond:
+            tasks = []
+            while self._user_order:
+                tasks.append(self._next_task_locked())
+            self._cond.notify_all()
+        for future, _, _ in tasks:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _release_slot(self, slot_lease: SlotLease) -> None:
+        with self._cond:
+            self._held_slots.pop(id(slot_lease), None)
+        self._cluster_slots.release(slot_lease)
+
+    def _renew_loop(self) -> None:
+        """Renews cluster slots held for over a third of their TTL, so long annotations keep them."""
+        interval = self._cluster_slots.ttl_seconds / 3
+        while True:
+            time.sleep(min(interval, 5.0))
+            now = time.monotonic()
+            with self._cond:
+                if self._shutdown and not self._held_slots and not self._user_order:
+                    return
+                due = [held for held in self._held_slots.values() if now - held[1] >= interval]
+            for held in due:
+                try:
+                    renewed = self._cluster_slots.renew(held[0])
+                except Exception as e:
+                    renewed = False
+                    print(f"Warning: Failed to renew page annotation slot {held[0].get('slot')}: {e}")
+                if renewed:
+                    held[1] = now
+                else:
+                    print(f"Warning: Page annotation slot {held[0].get('slot')} was lost; the cluster cap may be exceeded briefly.")
+
+    def _worker_loop(self) -> None:
+        while True:
+            taken = self._take_task()
+            if taken is None:
+                return
+            task, slot_lease = taken
+            with self._cond:
+                self._running += 1
+
+            future, fn, submitted_at = task
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                future.queue_wait_seconds = time.monotonic() - submitted_at  # type: ignore[attr-defined]
+                try:
+                    result = fn()
+                except BaseException as exc:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+            finally:
+                if slot_lease is not None:
+                    self._release_slot(slot_lease)
+                del task, future, fn
+                with self._cond:
+                    self._running -= 1
+                    self._completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns current utilisation and queue depth per job."""
+        with self._cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "running": self._running,
+                "queued": sum(len(tasks) for tasks in self._job_tasks.values()),
+                "queued_by_job": {job_key: len(tasks) for job_key, tasks in self._job_tasks.items()},
+                "active_users": len(self._user_jobs),
+                "completed": self._completed,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops the workers once queued tasks have drained. With cluster slots, tasks
+        still waiting for a slot when none is free are failed instead.
+        """
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            workers = list(self._workers)
+        if wait:
+            for worker in workers:
+                if worker is not threading.current_thread():
+                    worker.join()
+
+
+_shared_scheduler: Optional[PageScheduler] = None
+_shared_scheduler_lock = threading.Lock()
+
+
+def get_page_scheduler() -> Optional[PageScheduler]:
+    """Returns the process-wide page scheduler, or None when disabled (PAGE_SCHEDULER=0)."""
+    global _shared_scheduler
+    if os.getenv("PAGE_SCHEDULER", "1") == "0":
+        return None
+    with _shared_scheduler_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = PageScheduler()
+        return _shared_scheduler
@@ -0,0 +1,130 @@
+# src/services/StageGraph.py
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+StageTiming = Dict[str, Any]  # Contains 'start' (s since run start), 'seconds', 'status'
+
+
+class StageFailed(Exception):
+    """Raised by a stage to stop the graph with a user-facing failure message."""
+
+
+class StageGraph:
+    """
+    Runs async pipeline stages as a dependency graph.
+
+    Each stage declares the stages it depends on and starts as soon as they have
+    all finished, so independent stages overlap and a run takes roughly as long as
+    its critical path. A stage receives the results of every stage completed so far.
+    When a stage raises, stages that have not started are cancelled, stages already
+    running are allowed to finish (so their side effects are reflected in `results`),
+    and the first exception is re-raised.
+    """
+
+    def __init__(self, name: str = "pipeline"):
+        self.name = name
+        self._stages: Dict[str, StageFn] = {}
+        self._depends_on: Dict[str, List[str]] = {}
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, StageTiming] = {}
+
+    def add_stage(self, name: str, fn: StageFn, depends_on: Sequence[str] = ()) -> None:
+        """
+        Registers a stage.
+
+        Args:
+            name: Unique stage name; its return value is stored under this key.
+            fn: Coroutine function called with the results dict.
+            depends_on: Stages that must complete before this one starts.
+        """
+        if name in self._stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self._stages[name] = fn
+        self._depends_on[name] = list(depends_on)
+
+    def _check_graph(self) -> None:
+        for name, deps in self._depends_on.items():
+            for dep in deps:
+                if dep not in self._stages:
+                    raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        visiting, done = set(), set()
+
+        def visit(name: str) -> None:
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage graph has a cycle through '{name}'")
+            visiting.add(name)
+            for dep in self._depends_on[name]:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self._stages:
+            visit(name)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Executes all stages.
+
+        Returns:
+            Dictionary of stage name to stage result.
+        """
+        self._check_graph()
+        run_start = time.perf_counter()
+        finished = {name: asyncio.Event() for name in self._stages}
+        started: set[str] = set()
+
+        async def run_stage(name: str) -> None:
+            for dep in self._depends_on[name]:
+                await finished[dep].wait()
+            started.add(name)
+            start = time.perf_counter()
+            self.timings[name] = {"start": round(start - run_start, 3), "seconds": None, "status": "running"}
+            try:
+                self.results[name] = await self._stages[name](self.results)
+            except asyncio.CancelledError:
+                self.timings[name].update(seconds=round(time.perf_counter() - start, 3), status="cancelled")
+                raise
+            except BaseException:
+                self.timings[name].update(seconds=round(time.perf_counter() - start, 3), status="failed")
+                raise
+            self.timings[name].update(seconds=round(time.perf_counter() - start, 3), status="ok")
+            finished[name].set()
+
+        tasks = {asyncio.create_task(run_stage(name), name=f"{self.name}:{name}"): name for name in self._stages}
+        error: Optional[BaseException] = None
+        try:
+            pending = set(tasks)
+            while pending and error is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        error = task.exception()
+                        break
+        finally:
+            for task, name in tasks.items():
+                if not task.done() and (error is None or name not in started):
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        for name in self._stages:
+            self.timings.setdefault(name, {"start": None, "seconds": None, "status": "skipped"})
+        if error is not None:
+            raise error
+        return self.results
+
+    def critical_path_seconds(self) -> float:
+        """Longest chain of stage durations through the graph (ignores scheduling gaps)."""
+        memo: Dict[str, float] = {}
+
+        def longest(name: str) -> float:
+            if name not in memo:
+                own = self.timings.get(name, {}).get("seconds") or 0.0
+                memo[name] = own + max((longest(dep) for dep in self._depends_on[name]), default=0.0)
+            return memo[name]
+
+        return round(max((longest(name) for name in self._stages), default=0.0), 3)
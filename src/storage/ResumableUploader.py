@@ -0,0 +1,285 @@
+# src/storage/ResumableUploader.py
+
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Optional, Union
+
+import httpx
+
+# Supabase Storage requires every chunk but the last to be exactly 6MB.
+TUS_CHUNK_BYTES = 6 * 1024 * 1024
+
+UploadSource = Union[str, bytes]  # file path (e.g. a SpooledUpload) or the file's bytes
+
+
+class UploadExpired(Exception):
+    """The server no longer knows the upload; it has to be created again."""
+
+
+class TusUploadBackend:
+    """
+    Supabase Storage resumable uploads (the TUS 1.0.0 protocol).
+
+    An upload is created with a POST, which returns its URL; chunks are appended
+    with PATCH at the server's current offset, and HEAD reports that offset so an
+    interrupted upload continues where the server left off.
+    """
+
+    def __init__(self, storage_url: str, api_key: str, authorization: str, timeout: float = 60.0):
+        """
+        Args:
+            storage_url: Storage API base URL (supabase client's `storage_url`).
+            api_key: Project API key.
+            authorization: Authorization header value; uploads are subject to storage RLS for its user.
+            timeout: Seconds per request.
+        """
+        self.endpoint = storage_url.rstrip("/") + "/upload/resumable"
+        self.headers = {"apikey": api_key, "Authorization": authorization, "Tus-Resumable": "1.0.0"}
+        self.timeout = timeout
+
+    @classmethod
+    def from_supabase_client(cls, supabase_client: Any) -> "TusUploadBackend":
+        headers = supabase_client.options.headers
+        return cls(
+            storage_url=str(supabase_client.storage_url),
+            api_key=supabase_client.supabase_key,
+            authorization=headers.get("Authorization") or headers.get("authorization") or f"Bearer {supabase_client.supabase_key}",
+        )
+
+    def create(self, bucket: str, object_name: str, length: int, content_type: str) -> str:
+        metadata = {"bucketName": bucket, "objectName": object_name, "contentType": content_type, "cacheControl": "3600"}
+        encoded = ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in metadata.items())
+        response = httpx.post(
+            self.endpoint,
+            headers={**self.headers, "Upload-Length": str(length), "Upload-Metadata": encoded, "x-upsert": "false"},
+            timeout=self.timeout,
+        )
+        if response.status_code == 409:
+            raise FileExistsError(f"The resource already exists: {object_name}")
+        response.raise_for_status()
+        return str(httpx.URL(self.endpoint).join(response.headers["Location"]))
+
+    def get_offset(self, upload_url: str) -> int:
+        response = httpx.head(upload_url, headers=self.headers, timeout=self.timeout)
+        if response.status_code in (404, 410):
+            raise UploadExpired(upload_url)
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+
+    def append(self, upload_url: str, offset: int, chunk: bytes) -> int:
+        response = httpx.patch(
+            upload_url,
+            headers={**self.headers, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"},
+            content=chunk,
+            timeout=self.timeout,
+        )
+        if response.status_code in (404, 410):
+            raise UploadExpired(upload_url)
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+
+
+class LocalUploadBackend:
+    """
+    Filesystem stand-in for Supabase Storage, for development and offline tests.
+
+    Objects live at `<root>/<bucket>/<object_name>`; an upload in progress is a
+    `.part` file whose size is the upload offset, renamed into place once complete.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        """
+        Args:
+            root: Storage root directory (env STORAGE_LOCAL_ROOT, default <tmp>/stackrag_storage).
+        """
+        self.root = root or os.getenv("STORAGE_LOCAL_ROOT") or os.path.join(tempfile.gettempdir(), "stackrag_storage")
+
+    def object_path(self, bucket: str, object_name: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, bucket, object_name))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Object name escapes the storage root: {object_name}")
+        return path
+
+    def create(self, bucket: str, object_name: str, length: int, content_type: str) -> str:
+        path = self.object_path(bucket, object_name)
+        if os.path.exists(path):
+            raise FileExistsError(f"The resource already exists: {object_name}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".part", "wb"):
+            pass
+        with open(path + ".length", "w") as length_file:
+            length_file.write(str(length))
+        return path
+
+    def get_offset(self, upload_url: str) -> int:
+        if os.path.exists(upload_url) and not os.path.exists(upload_url + ".part"):
+            return os.path.getsize(upload_url)
+        if not os.path.exists(upload_url + ".part"):
+            raise UploadExpired(upload_url)
+        return os.path.getsize(upload_url + ".part")
+
+    def append(self, upload_url: str, offset: int, chunk: bytes) -> int:
+        part_path = upload_url + ".part"
+        if not os.path.exists(part_path):
+            raise UploadExpired(upload_url)
+        with open(part_path, "r+b") as part:
+            part.seek(offset)
+            part.write(chunk)
+            part.truncate()
+            new_offset = part.tell()
+        with open(upload_url + ".length") as length_file:
+            if new_offset >= int(length_file.read()):
+                os.replace(part_path, upload_url)
+                os.remove(upload_url + ".length")
+        return new_offset
+
+
+UploadBackend = Union[TusUploadBackend, LocalUploadBackend]
+
+
+def get_upload_backend(supabase_client: Any) -> UploadBackend:
+    """Backend for originals: local files when STORAGE_BACKEND=local, else Supabase Storage over TUS."""
+    if os.getenv("STORAGE_BACKEND", "supabase").strip().lower() == "local":
+        return LocalUploadBackend()
+    return TusUploadBackend.from_supabase_client(supabase_client)
+
+
+class ResumableUploader:
+    """
+    Uploads a file to storage in fixed-size chunks that survive interruptions.
+
+    After a failed chunk the uploader asks the server for its offset and carries on
+    from there, so a transient error costs one chunk rather than the whole upload
+    (and the job waiting on it). The upload URL is also saved under `state_dir`,
+    keyed by the object name and source size, so a later attempt at the same
+    upload, e.g. after the process restarted, resumes instead of starting over.
+    """
+
+    def __init__(
+        self,
+        backend: UploadBackend,
+        chunk_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        state_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            backend: Where chunks go (see `get_upload_backend`).
+            chunk_size: Bytes per chunk (env RESUMABLE_UPLOAD_CHUNK_BYTES, default 6MB as Supabase requires).
+            max_retries: Consecutive failed attempts per chunk before giving up (env RESUMABLE_UPLOAD_MAX_RETRIES, default 5).
+            state_dir: Directory for resume state (env RESUMABLE_UPLOAD_STATE_DIR, default <tmp>/stackrag_uploads).
+        """
+        self.backend = backend
+        self.chunk_size = chunk_size or int(os.getenv("RESUMABLE_UPLOAD_CHUNK_BYTES", str(TUS_CHUNK_BYTES)))
+        self.max_retries = max_retries or int(os.getenv("RESUMABLE_UPLOAD_MAX_RETRIES", "5"))
+        self.state_dir = state_dir or os.getenv(
+            "RESUMABLE_UPLOAD_STATE_DIR", os.path.join(tempfile.gettempdir(), "stackrag_uploads")
+        )
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def upload(
+        self,
+        source: UploadSource,
+        bucket: str,
+        object_name: str,
+        content_type: str = "application/pdf",
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> str:
+        """
+        Uploads `source` to `bucket`/`object_name`, resuming a previous attempt if one exists.
+
+        Args:
+            progress_callback: Called as (bytes_uploaded, total_bytes) after every chunk.
+
+        Returns:
+            The object name.
+
+        Raises:
+            The last error once a chunk has failed `max_retries` times in a row.
+        """
+        length = os.path.getsize(source) if isinstance(source, str) else len(source)
+        state_path = os.path.join(
+            self.state_dir, hashlib.sha256(f"{bucket}/{object_name}:{length}".encode()).hexdigest() + ".json"
+        )
+        upload_url = self._load_state(state_path)
+        failures = 0
+        offset = None
+
+        with open(source, "rb") if isinstance(source, str) else contextlib.nullcontext() as source_file:
+            while True:
+                try:
+                    if upload_url is None:
+                        upload_url = self.backend.create(bucket, object_name, length, content_type)
+                        self._save_state(state_path, upload_url)
+                        offset = 0
+                    elif offset is None:
+                        offset = self.backend.get_offset(upload_url)
+                        if offset:
+                            print(f"Resuming upload of {object_name} at {offset}/{length} bytes.")
+                    if offset >= length:
+                        break
+                    chunk = self._read_chunk(source, source_file, offset)
+                    offset = self.backend.append(upload_url, offset, chunk)
+                    failures = 0
+                    if progress_callback is not None:
+                        progress_callback(offset, length)
+                except UploadExpired:
+                    print(f"Upload of {object_name} expired on the server; starting it again.")
+                    upload_url, offset = None, None
+                except FileExistsError:
+                    raise
+                except httpx.HTTPStatusError as e:
+                    # 409 (offset mismatch), 423 (locked) and 429 clear up on retry; other client errors do not.
+                    if e.response.status_code < 500 and e.response.status_code not in (409, 423, 429):
+                        raise
+                    failures = self._backoff(object_name, offset, failures, e)
+                    offset = None
+                except Exception as e:
+                    failures = self._backoff(object_name, offset, failures, e)
+                    offset = None  # ask the server how much it actually kept
+
+        self._clear_state(state_path)
+        return object_name
+
+    def _backoff(self, object_name: str, offset: Optional[int], failures: int, error: Exception) -> int:
+        """Sleeps before the next attempt, or re-raises `error` once `max_retries` is reached."""
+        failures += 1
+        if failures >= self.max_retries:
+            print(f"Upload of {object_name} failed {failures} times at offset {offset}: {error}")
+            raise error
+        delay = min(2 ** failures, 30)
+        print(f"Upload chunk for {object_name} failed ({error}); resuming in {delay}s...")
+        time.sleep(delay)
+        return failures
+
+    def _read_chunk(self, source: UploadSource, source_file: Any, offset: int) -> bytes:
+        if source_file is None:
+            return source[offset:offset + self.chunk_size]
+        source_file.seek(offset)
+        return source_file.read(self.chunk_size)
+
+    @staticmethod
+    def _load_state(state_path: str) -> Optional[str]:
+        try:
+            with open(state_path) as state_file:
+                return json.load(state_file).get("upload_url")
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_state(state_path: str, upload_url: str) -> None:
+        with open(state_path, "w") as state_file:
+            json.dump({"upload_url": upload_url, "created_at": time.time()}, state_file)
+
+    @staticmethod
+    def _clear_state(state_path: str) -> None:
+        try:
+            os.remove(state_path)
+        except FileNotFoundError:
+            pass
+
@@ -1,17 +1,23 @@
 # src/services/SupabaseService.py
 
+import hashlib
 import os
+import sys
 import uuid
-from typing import List, Optional, IO
+from typing import Any, Callable, Dict, List, Optional, IO, Union
+import httpx
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from src.models.ingestion_models import SectionData, ChunkData
 from src.models.metadata_models import FinancialDocumentMetadata
+from src.storage.ResumableUploader import LocalUploadBackend, ResumableUploader, get_upload_backend
+from src.storage.UploadSpool import SpooledUpload
 
 
 class SupabaseService:
     """Handles storage and database operations with Supabase."""
     STORAGE_BUCKET_NAME = "financial-pdfs"
+    COMPLETED_STATUSES = ("completed", "completed_no_chunks")
 
     def __init__(self, supabase_client: Optional[Client] = None):
         """Initializes the SupabaseService."""
@@ -32,24 +38,47 @@ class SupabaseService:
 
     def upload_pdf_to_storage(
         self,
-        pdf_file_buffer: IO[bytes],
+        pdf_file_buffer: Union[IO[bytes], str],
         user_id: uuid.UUID,
         document_id: uuid.UUID,
-        original_filename: str
+        original_filename: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None
     ) -> Optional[str]:
-        """Uploads a PDF buffer to user's storage path."""
+        """
+        Uploads a PDF buffer to user's storage path.
+
+        A file path (e.g. a `SpooledUpload`) is streamed from disk instead of being read into memory.
+        Files of at least RESUMABLE_UPLOAD_MIN_BYTES (default 6MB) go up as a resumable,
+        chunked upload that rides out transient failures (see `ResumableUploader`);
+        `progress_callback` gets (bytes_uploaded, total_bytes) after each chunk.
+        """
         storage_path = f"{str(user_id)}/{str(document_id)}/{original_filename}"
         print(f"Attempting to upload PDF to storage path: {storage_path}")
 
         try:
-            pdf_file_buffer.seek(0)
-            pdf_bytes = pdf_file_buffer.read()
-
-            self.client.storage.from_(self.STORAGE_BUCKET_NAME).upload(
-                path=storage_path,
-                file=pdf_bytes,
-                file_options={"cache-control": "3600", "upsert": "false"}
-            )
+            source = pdf_file_buffer
+            if not isinstance(source, str):
+                source.seek(0)
+                source = source.read()
+            size = os.path.getsize(source) if isinstance(source, str) else len(source)
+            upload_backend = get_upload_backend(self.client)
+            if isinstance(upload_backend, LocalUploadBackend) or size >= int(os.getenv("RESUMABLE_UPLOAD_MIN_BYTES", str(6 * 1024 * 1024))):
+                ResumableUploader(upload_backend).upload(
+                    source, self.STORAGE_BUCKET_NAME, storage_path, progress_callback=progress_callback
+                )
+            elif isinstance(source, str):
+                with open(source, "rb") as pdf_file:
+                    self.client.storage.from_(self.STORAGE_BUCKET_NAME).upload(
+                        path=storage_path,
+                        file=pdf_file,
+                        file_options={"cache-control": "3600", "upsert": "false"}
+                    )
+            else:
+                self.client.storage.from_(self.STORAGE_BUCKET_NAME).upload(
+                    path=storage_path,
+                    file=source,
+                    file_options={"cache-control": "3600", "upsert": "false"}
+                )
             print(f"Supabase storage upload response for {storage_path}")
 
             print(f"PDF successfully uploaded to: {storage_path}")
@@ -64,6 +93,46 @@ class SupabaseService:
                  print(f"Hint: RLS policy likely denied the upload. Check path prefix and policies.")
             return None
 
+    def download_pdf_to_spool(self, storage_path: str) -> SpooledUpload:
+        """
+        Streams an uploaded PDF to a temporary file, hashing it on the way; raises if it cannot be read.
+        The PDF is never held in memory. Close the returned spool to delete the file.
+        """
+        # Accepted when it was uploaded, so a since-lowered MAX_UPLOAD_BYTES must not reject it
+        spool = SpooledUpload(max_bytes=sys.maxsize)
+        try:
+            upload_backend = get_upload_backend(self.client)
+            if isinstance(upload_backend, LocalUploadBackend):
+                with open(upload_backend.object_path(self.STORAGE_BUCKET_NAME, storage_path), "rb") as pdf_file:
+                    for chunk in iter(lambda: pdf_file.read(SpooledUpload.CHUNK_BYTES), b""):
+                        spool.write(chunk)
+            else:
+                # storage3's download() returns the whole body; a signed URL can be streamed
+                signed_url = self.client.storage.from_(self.STORAGE_BUCKET_NAME).create_signed_url(storage_path, 60)["signedURL"]
+                with httpx.stream("GET", signed_url, timeout=60.0) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_bytes(SpooledUpload.CHUNK_BYTES):
+                        spool.write(chunk)
+            spool.finish()
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def delete_pdf_from_storage(self, storage_path: str) -> bool:
+        """Removes an uploaded PDF, e.g. when ingestion fails before its document record exists."""
+        try:
+            upload_backend = get_upload_backend(self.client)
+            if isinstance(upload_backend, LocalUploadBackend):
+                os.remove(upload_backend.object_path(self.STORAGE_BUCKET_NAME, storage_path))
+            else:
+                self.client.storage.from_(self.STORAGE_BUCKET_NAME).remove([storage_path])
+            print(f"Removed PDF from storage: {storage_path}")
+            return True
+        except Exception as e:
+            print(f"Error removing PDF from Supabase Storage at {storage_path}: {e}")
+            return False
+
     def save_document_record(
         self,
         user_id: uuid.UUID,
@@ -71,9 +140,16 @@ class SupabaseService:
         storage_path: str,
         doc_type: str,
         metadata: FinancialDocumentMetadata,
-        full_markdown_content: str
+        full_markdown_content: str,
+        content_hash: Optional[str] = None,
+        previous_version_id: Optional[uuid.UUID] = None
     ) -> Optional[uuid.UUID]:
-        """Saves the main document record to the 'documents' table."""
+        """
+        Saves the main document record to the 'documents' table.
+
+        A new version of an existing document (`previous_version_id`) is saved as
+        'staging', which keeps its chunks out of search until `swap_document_version`.
+        """
         print(f"Saving document record for: {filename} (User: {user_id})")
         try:
             document_data = {
@@ -89,8 +165,12 @@ class SupabaseService:
                 "doc_summary": metadata.doc_summary,
                 "full_markdown_content": full_markdown_content,
                 "metadata": {"currency": None, "units": None}, # Placeholder JSONB
-                "status": "processing"
+                "status": "staging" if previous_version_id else "processing"
             }
+            if content_hash:
+                document_data["content_hash"] = content_hash
+            if previous_version_id:
+                document_data["previous_version_id"] = str(previous_version_id)
 
             response = self.client.table('documents').insert(document_data).execute()
 
@@ -195,6 +275,169 @@ class SupabaseService:
             print(f"Error saving chunks batch to Supabase DB: {e}")
             return False
 
+    @staticmethod
+    def hash_content(pdf_bytes: bytes) -> str:
+        """SHA-256 of an uploaded file, used to recognise re-uploads of the same document."""
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """`hash_content` of a file on disk, read in chunks."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as pdf_file:
+            for chunk in iter(lambda: pdf_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def find_document_by_hash(self, user_id: uuid.UUID, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Returns the user's most recent completed document with this content hash, if any."""
+        try:
+            response = self.client.table('documents')\
+                .select("id, filename, status, storage_path")\
+                .eq("user_id", str(user_id))\
+                .eq("content_hash", content_hash)\
+                .in_("status", list(self.COMPLETED_STATUSES))\
+                .order("upload_timestamp", desc=True)\
+                .limit(1)\
+                .execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            print(f"Error looking up document by content hash: {e}")
+            return None
+
+    def find_documents_by_hashes(self, user_id: uuid.UUID, content_hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Like `find_document_by_hash` for many hashes in one query; maps each hash found to its document."""
+        if not content_hashes:
+            return {}
+        try:
+            response = self.client.table('documents')\
+                .select("id, filename, status, storage_path, content_hash")\
+                .eq("user_id", str(user_id))\
+                .in_("content_hash", list(set(content_hashes)))\
+                .in_("status", list(self.COMPLETED_STATUSES))\
+                .order("upload_timestamp", desc=True)\
+                .execute()
+            documents: Dict[str, Dict[str, Any]] = {}
+            for document in response.data or []:
+                documents.setdefault(document["content_hash"], document)
+            return documents
+        except Exception as e:
+            print(f"Error looking up documents by content hash: {e}")
+            return {}
+
+    def save_document_pages(self, document_id: uuid.UUID, user_id: uuid.UUID, page_hashes: List[Optional[str]]) -> bool:
+        """Saves per-page fingerprints so a later version of the document can reuse unchanged pages."""
+        rows = [
+            {"document_id": str(document_id), "user_id": str(user_id), "page_number": page_num + 1, "page_hash": page_hash}
+            for page_num, page_hash in enumerate(page_hashes)
+            if page_hash
+        ]
+        if not rows:
+            return True
+        try:
+            self.client.table('document_pages').insert(rows).execute()
+            print(f"Saved {len(rows)} page fingerprints for document {document_id}.")
+            return True
+        except Exception as e:
+            print(f"Error saving document pages to Supabase DB: {e}")
+            return False
+
+    def get_document_version_base(self, document_id: uuid.UUID, user_id: uuid.UUID) -> Optional[Dict[str, Any]]:
+        """
+        Loads what a new version of a document can reuse from it.
+
+        Returns:
+            The document row with 'full_markdown_content', plus 'page_hashes'
+            ({page_number: page_hash}) and 'chunks' (text, metadata and embedding of
+            every chunk); None if the document is not a completed document of the user.
+        """
+        try:
+            doc_response = self.client.table('documents')\
+                .select("id, filename, status, full_markdown_content")\
+                .eq("id", str(document_id))\
+                .eq("user_id", str(user_id))\
+                .in_("status", list(self.COMPLETED_STATUSES))\
+                .limit(1)\
+                .execute()
+            if not doc_response.data:
+                return None
+            base = doc_response.data[0]
+            pages_response = self.client.table('document_pages')\
+                .select("page_number, page_hash")\
+                .eq("document_id", str(document_id))\
+                .execute()
+            base["page_hashes"] = {row["page_number"]: row["page_hash"] for row in pages_response.data or []}
+            chunks_response = self.client.table('chunks')\
+                .select("chunk_text, section_heading, doc_specific_type, doc_year, doc_quarter, company_name, embedding, embedding_model")\
+                .eq("document_id", str(document_id))\
+                .execute()
+            base["chunks"] = chunks_response.data or []
+            return base
+        except Exception as e:
+            print(f"Error loading previous document version {document_id}: {e}")
+            return None
+
+    def swap_document_version(self, previous_document_id: uuid.UUID, document_id: uuid.UUID, status: str) -> bool:
+        """
+        Atomically makes a staged version live: it gets `status`, and the previous
+        version is marked 'superseded' with its chunks, sections and summary removed.
+        """
+        print(f"Swapping document {previous_document_id} for new version {document_id}")
+        try:
+            response = self.client.rpc("swap_document_version", {
+                "p_previous_document_id": str(previous_document_id),
+                "p_document_id": str(document_id),
+                "p_status": status,
+            }).execute()
+            return bool(response.data)
+        except Exception as e:
+            print(f"Error swapping document versions: {e}")
+            return False
+
+    def delete_document(self, document_id: uuid.UUID) -> bool:
+        """Deletes a document row; its sections, chunks and pages cascade."""
+        try:
+            self.client.table('documents').delete().eq("id", str(document_id)).execute()
+            print(f"Deleted document {document_id}.")
+            return True
+        except Exception as e:
+            print(f"Error deleting document {document_id}: {e}")
+            return False
+
+    def get_page_checkpoints(self, job_id: uuid.UUID) -> Dict[str, str]:
+        """Annotated pages checkpointed by earlier attempts of a processing job, as {page_hash: markdown}."""
+        try:
+            response = self.client.table('processing_job_pages')\
+                .select("page_hash, markdown")\
+                .eq("job_id", str(job_id))\
+                .execute()
+            return {row["page_hash"]: row["markdown"] for row in response.data or []}
+        except Exception as e:
+            print(f"Error loading page checkpoints for job {job_id}: {e}")
+            return {}
+
+    def count_page_checkpoints(self, job_id: uuid.UUID) -> int:
+        """Number of pages checkpointed for a processing job."""
+        try:
+            response = self.client.table('processing_job_pages')\
+                .select("page_number", count="exact")\
+                .eq("job_id", str(job_id))\
+                .limit(1)\
+                .execute()
+            return response.count or 0
+        except Exception as e:
+            print(f"Error counting page checkpoints for job {job_id}: {e}")
+            return 0
+
+    def delete_page_checkpoints(self, job_id: uuid.UUID) -> bool:
+        """Removes a processing job's page checkpoints once its document is saved."""
+        try:
+            self.client.table('processing_job_pages').delete().eq("job_id", str(job_id)).execute()
+            return True
+        except Exception as e:
+            print(f"Error deleting page checkpoints for job {job_id}: {e}")
+            return False
+
     def update_document_status(self, document_id: uuid.UUID, status: str) -> bool:
         """Updates the status of a document record."""
         print(f"Updating status for document {document_id} to '{status}'")
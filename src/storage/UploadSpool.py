@@ -0,0 +1,233 @@
+# src/storage/UploadSpool.py
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # pragma: no cover - older python-multipart releases
+    import multipart
+    from multipart.multipart import parse_options_header
+
+# Largest PDF accepted for processing (env MAX_UPLOAD_BYTES, default 50MB).
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+# Most files accepted in one batch upload (env MAX_BATCH_FILES, default 50).
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "50"))
+
+# Largest non-file form field kept from a multipart body.
+MAX_FIELD_BYTES = 64 * 1024
+
+# How long a stored upload's spool is kept for an ingestion worker in the same
+# process (env LOCAL_PAYLOAD_TTL_SECONDS, default 600).
+LOCAL_PAYLOAD_TTL_SECONDS = float(os.getenv("LOCAL_PAYLOAD_TTL_SECONDS", "600"))
+
+# storage path -> (spool, expiry) of uploads that were stored and queued by this process
+_local_payloads: Dict[str, Tuple["SpooledUpload", float]] = {}
+
+
+class UploadTooLarge(Exception):
+    """Raised as soon as an upload passes its size limit."""
+
+
+class SpooledUpload:
+    """
+    An uploaded file streamed to a named temporary file.
+
+    Chunks are hashed as they are written and the upload is rejected as soon as it
+    passes `max_bytes`, so the file is never held in memory. The spool file is the
+    one source for everything downstream: PyMuPDF opens it by path (MuPDF reads
+    pages from disk on demand) and the storage upload streams it, so neither copies
+    the whole file into memory. Use as a context manager, or call `close`, to
+    delete the file.
+    """
+
+    CHUNK_BYTES = 1024 * 1024
+
+    def __init__(self, max_bytes: Optional[int] = None, spool_dir: Optional[str] = None):
+        """
+        Args:
+            max_bytes: Size limit (default MAX_UPLOAD_BYTES).
+            spool_dir: Directory for the spool file (env UPLOAD_SPOOL_DIR, default the system temp dir).
+        """
+        self.max_bytes = max_bytes or MAX_UPLOAD_BYTES
+        self._file = tempfile.NamedTemporaryFile(
+            prefix="upload-", suffix=".pdf", dir=spool_dir or os.getenv("UPLOAD_SPOOL_DIR") or None, delete=False
+        )
+        self.path = self._file.name
+        self.size = 0
+        self.content_type: Optional[str] = None  # multipart part Content-Type, if the upload had one
+        self._hash = hashlib.sha256()
+
+    def write(self, chunk: bytes) -> None:
+        if self.size + len(chunk) > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def finish(self) -> None:
+        """Ends writing; the file stays on disk until `close`."""
+        self._file.close()
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-256 of the upload, as `SupabaseService.hash_content` computes it."""
+        return self._hash.hexdigest()
+
+    def close(self) -> None:
+        """Deletes the spool file."""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def keep_local_payload(storage_path: str, spool: SpooledUpload) -> None:
+    """
+    Keeps the spool of an upload stored at `storage_path` so an ingestion worker in
+    this process can parse it without downloading it again. Takes ownership of
+    `spool`; it is deleted after LOCAL_PAYLOAD_TTL_SECONDS if no worker took it
+    (e.g. a worker in another process claimed the job).
+    """
+    now = time.monotonic()
+    for path, (stale, expires_at) in list(_local_payloads.items()):
+        if expires_at <= now:
+            del _local_payloads[path]
+            stale.close()
+    _local_payloads[storage_path] = (spool, now + LOCAL_PAYLOAD_TTL_SECONDS)
+
+
+def take_local_payload(storage_path: str) -> Optional[SpooledUpload]:
+    """The kept spool of the upload stored at `storage_path`, if any; the caller closes it."""
+    entry = _local_payloads.pop(storage_path, None)
+    if entry is None:
+        return None
+    spool, expires_at = entry
+    if expires_at <= time.monotonic():
+        spool.close()
+        return None
+    return spool
+
+
+async def spool_multipart_files(
+    content_type: str,
+    stream: AsyncIterator[bytes],
+    max_files: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    spool_dir: Optional[str] = None,
+    fields: Optional[Dict[str, str]] = None,
+) -> List[Tuple[str, SpooledUpload]]:
+    """
+    Streams every file part of a multipart body (e.g. `Request.stream()`) into its own SpooledUpload.
+
+    Parts are written to disk as the body arrives, so a request carrying many files
+    is never held in memory, and an oversize file is rejected while it streams.
+    Non-file fields are stored in `fields` when it is given, otherwise ignored.
+
+    Returns:
+        (filename, spool) for each file, in request order; the caller closes the spools.
+
+    Raises:
+        UploadTooLarge: A file passed `max_bytes`.
+        ValueError: The body is not valid multipart, carries more than `max_files` files
+            or has a form field over MAX_FIELD_BYTES.
+        Nothing is left on disk when an error is raised.
+    """
+    max_files = max_files or MAX_BATCH_FILES
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing boundary in multipart body")
+
+    files: List[Tuple[str, SpooledUpload]] = []
+    part = {"header_name": b"", "header_value": b"", "disposition": b"", "content_type": b"", "spool": None, "field": None}
+    ended = []
+
+    def on_part_begin() -> None:
+        part.update(disposition=b"", content_type=b"", spool=None, field=None)
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        part["header_name"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        part["header_value"] += data[start:end]
+
+    def on_header_end() -> None:
+        if part["header_name"].lower() == b"content-disposition":
+            part["disposition"] = part["header_value"]
+        elif part["header_name"].lower() == b"content-type":
+            part["content_type"] = part["header_value"]
+        part.update(header_name=b"", header_value=b"")
+
+    def on_headers_finished() -> None:
+        _, options = parse_options_header(part["disposition"])
+        if b"filename" not in options:
+            if fields is not None and b"name" in options:
+                part["field"] = (options[b"name"].decode("utf-8", errors="replace"), bytearray())
+            return
+        if len(files) >= max_files:
+            raise ValueError(f"Too many files. Maximum is {max_files} per batch.")
+        spool = SpooledUpload(max_bytes, spool_dir)
+        if part["content_type"]:
+            spool.content_type = part["content_type"].decode("latin-1").strip()
+        files.append((options[b"filename"].decode("utf-8", errors="replace"), spool))
+        part["spool"] = spool
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if part["spool"] is not None:
+            part["spool"].write(data[start:end])
+        elif part["field"] is not None:
+            value = part["field"][1]
+            if len(value) + end - start > MAX_FIELD_BYTES:
+                raise ValueError(f"Form field '{part['field'][0]}' is too large.")
+            value += data[start:end]
+
+    def on_part_end() -> None:
+        if part["spool"] is not None:
+            part["spool"].finish()
+        elif part["field"] is not None:
+            name, value = part["field"]
+            fields[name] = value.decode("utf-8", errors="replace")
+
+    def on_end() -> None:
+        ended.append(True)
+
+    parser = multipart.MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_end": on_end,
+    })
+    try:
+        async for chunk in stream:
+            # Parsing runs the callbacks above, which write to disk
+            await asyncio.to_thread(parser.write, chunk)
+        parser.finalize()
+        if not ended:
+            raise multipart.exceptions.MultipartParseError("body ended before the closing boundary")
+    except multipart.exceptions.MultipartParseError as e:
+        for _, spool in files:
+            spool.close()
+        raise ValueError(f"Invalid multipart body: {e}")
+    except BaseException:
+        for _, spool in files:
+            spool.close()
+        raise
+    return files
@@ -0,0 +1,95 @@
+# tests/test_batch_upload.py
+"""A batch upload creates all of its processing_jobs rows in one insert.
+
+Rows of files the user already ingested are completed on the spot and carry
+more columns than rows of new files. PostgREST inserts a list under the union
+of its keys, so the fake table below stores a key a row lacks as NULL, unless
+the insert asks for column defaults, and enforces `dedup_hit NOT NULL` as
+scripts/10_document_content_hash.sql does.
+"""
+
+import asyncio
+import os
+import uuid
+from types import SimpleNamespace
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test-anon-key")
+
+from api.v1.dependencies import Session
+from api.v1.endpoints import document_process
+from src.storage.UploadSpool import SpooledUpload
+
+COLUMN_DEFAULTS = {"dedup_hit": False}
+NOT_NULL_COLUMNS = {"id", "user_id", "filename", "status", "dedup_hit"}
+
+
+class _ProcessingJobsTable:
+    def __init__(self):
+        self.rows = []
+
+    def insert(self, rows, *, default_to_null=True, **kwargs):
+        columns = set().union(*rows)
+        stored = [
+            {column: row[column] if column in row else (None if default_to_null else COLUMN_DEFAULTS.get(column))
+             for column in columns | set(COLUMN_DEFAULTS)}
+            for row in rows
+        ]
+
+        def execute():
+            for row in stored:
+                for column in NOT_NULL_COLUMNS:
+                    if row.get(column) is None:
+                        raise RuntimeError(f'null value in column "{column}" violates not-null constraint')
+            self.rows.extend(stored)
+            return SimpleNamespace(data=stored)
+
+        return SimpleNamespace(execute=execute)
+
+
+def _spool(content: bytes) -> SpooledUpload:
+    spool = SpooledUpload()
+    spool.write(content)
+    spool.finish()
+    return spool
+
+
+def test_batch_mixing_a_known_file_and_a_new_file(monkeypatch):
+    known, new = _spool(b"%PDF-1.4 known"), _spool(b"%PDF-1.4 new")
+    document_id = uuid.uuid4()
+    table = _ProcessingJobsTable()
+    supabase_client = SimpleNamespace(table=lambda name: table)
+    stored = []
+
+    class StubSupabaseService:
+        def __init__(self, client):
+            pass
+
+        def find_documents_by_hashes(self, user_id, content_hashes):
+            return {known.content_hash: {"id": document_id, "filename": "known.pdf"}}
+
+    async def store_and_enqueue(client, session, job_id, filename, spool, page_count, previous_document_id):
+        stored.append(filename)
+        spool.close()
+
+    monkeypatch.setattr(document_process, "SupabaseService", StubSupabaseService)
+    monkeypatch.setattr(document_process, "_store_and_enqueue", store_and_enqueue)
+    session = Session(user_id=str(uuid.uuid4()), token="token")
+
+    async def queue_batch():
+        result = await document_process._queue_spooled_batch(
+            supabase_client, session, [("known.pdf", known), ("new.pdf", new)]
+        )
+        await document_process.drain_background_uploads()
+        return result
+
+    result = asyncio.run(queue_batch())
+
+    assert result["success"]
+    rows = {row["filename"]: row for row in table.rows}
+    assert rows["known.pdf"]["dedup_hit"] is True
+    assert rows["known.pdf"]["document_id"] == str(document_id)
+    assert rows["new.pdf"]["dedup_hit"] is False
+    assert rows["new.pdf"]["status"] == "uploading"
+    assert [entry.get("deduplicated", False) for entry in result["files"]] == [True, False]
+    assert stored == ["new.pdf"]
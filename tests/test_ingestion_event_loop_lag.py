@@ -0,0 +1,200 @@
+# tests/test_ingestion_event_loop_lag.py
+"""The ingestion pipeline must never block the event loop it runs on.
+
+The pipeline ingests a many-page PDF as a new version of a stored document,
+with the real parser, sectioner, chunker and embedding service, so page
+fingerprinting, local page extraction, splitting the previous version's
+markdown and decoding its stored embeddings all really run. Only the network
+is stubbed: Gemini, OpenAI and supabase-py calls block with `time.sleep` (as
+the sync clients do) and their async variants sleep cooperatively. While the
+pipeline runs, a ticker coroutine measures how late the loop wakes it up.
+"""
+
+import asyncio
+import json
+import random
+import time
+import uuid
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import fitz as pymupdf
+
+from src.enums import FinancialDocSpecificType
+from src.models.metadata_models import FinancialDocumentMetadata
+from src.pipeline import IngestionPipeline
+from src.services.ChunkingService import ChunkingService
+from src.services.EmbeddingService import EmbeddingService
+from src.services.FinancialDocParser import FinancialDocParser
+from src.services.Sectioner import Sectioner
+
+BLOCKING_SECONDS = 0.2
+NETWORK_SECONDS = 0.02
+MAX_LAG_SECONDS = 0.05
+TICK_SECONDS = 0.005
+
+PAGE_COUNT = 120
+TABLE_PAGE_EVERY = 4  # every 4th page is a figures table, which the parser sends to Gemini
+PREVIOUS_CHUNK_COUNT = 1500
+EMBEDDING_DIMENSIONS = 1536
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def _blocking(result, seconds: float = NETWORK_SECONDS):
+    def call(*args, **kwargs):
+        time.sleep(seconds)
+        return result
+    return call
+
+
+def _awaiting(result, seconds: float = NETWORK_SECONDS):
+    async def call(*args, **kwargs):
+        await asyncio.sleep(seconds)
+        return result
+    return call
+
+
+def _write_report(path: str) -> None:
+    """A PAGE_COUNT-page annual report: narrative pages with a figures table every TABLE_PAGE_EVERY pages."""
+    rng = random.Random(7)
+    pdf_document = pymupdf.open()
+    for page_num in range(PAGE_COUNT):
+        page = pdf_document.new_page()
+        if page_num % TABLE_PAGE_EVERY == 0:
+            lines = [f"Segment {row}    {rng.randint(100, 9999):,}    {rng.randint(100, 9999):,}    {rng.randint(1, 99)}%" for row in range(30)]
+        else:
+            lines = [f"## Section {page_num + 1}"] + [
+                f"Management discussion paragraph {line} of page {page_num + 1} reviews operating trends and outlook."
+                for line in range(30)
+            ]
+        page.insert_text((48, 60), "\n".join(lines), fontsize=9)
+    pdf_document.save(path)
+    pdf_document.close()
+
+
+def _previous_version(path: str) -> dict:
+    """What `get_document_version_base` returns for the version being replaced: half its pages are unchanged."""
+    with pymupdf.open(path) as pdf_document:
+        page_hashes = {
+            page_num + 1: FinancialDocParser.page_fingerprint(pdf_document[page_num]) if page_num % 2 else f"changed-{page_num}"
+            for page_num in range(PAGE_COUNT)
+        }
+    rng = random.Random(11)
+    return {
+        "id": str(uuid.uuid4()),
+        "full_markdown_content": "".join(
+            f"\n\n--- Page {page_number} Start ---\n\n## Section {page_number}\n\n"
+            + "Previous wording of the page. " * 60
+            + f"\n\n--- Page {page_number} End ---\n\n"
+            for page_number in range(1, PAGE_COUNT + 1)
+        ),
+        "page_hashes": page_hashes,
+        "chunks": [
+            {
+                "chunk_text": f"Previous chunk {index}",
+                "section_heading": f"Section {index % PAGE_COUNT}",
+                "embedding_model": EMBEDDING_MODEL,
+                # pgvector values come back as text
+                "embedding": json.dumps([round(rng.random(), 6) for _ in range(EMBEDDING_DIMENSIONS)]),
+            }
+            for index in range(PREVIOUS_CHUNK_COUNT)
+        ],
+    }
+
+
+def _services(monkeypatch, pdf_path: str) -> dict:
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("PAGE_ANNOTATION_CACHE", "0")
+    metadata = FinancialDocumentMetadata(
+        doc_specific_type=FinancialDocSpecificType.ANNUAL_REPORT,
+        company_name="Acme",
+        doc_year=2024,
+    )
+    annotation = SimpleNamespace(text="| Segment | 2024 | 2023 |\n|---|---|---|\n| A | 1,000 | 900 |", usage_metadata=None)
+    gemini_client = SimpleNamespace(client=SimpleNamespace(models=SimpleNamespace(generate_content=_blocking(annotation))))
+
+    async def aget_embeddings(texts, **kwargs):
+        await asyncio.sleep(NETWORK_SECONDS)
+        return [[0.0] * EMBEDDING_DIMENSIONS for _ in texts]
+
+    openai_client = SimpleNamespace(embedding_model=EMBEDDING_MODEL, aget_embeddings=aget_embeddings)
+    return {
+        "financial_doc_parser": FinancialDocParser(gemini_client=gemini_client),
+        "metadata_extractor": SimpleNamespace(
+            aextract_metadata=_awaiting((metadata, False)),
+            aextract_income_statement_fields=_awaiting(None),
+        ),
+        "sectioner": Sectioner(),
+        "chunking_service": ChunkingService(),
+        "embedding_service": EmbeddingService(openai_client=openai_client),
+        "supabase_service": SimpleNamespace(
+            client=MagicMock(),
+            get_document_version_base=_blocking(_previous_version(pdf_path)),
+            get_page_checkpoints=_blocking({}),
+            delete_page_checkpoints=_blocking(True),
+            save_document_record=_blocking(uuid.uuid4()),
+            save_income_statement_summary=_blocking(uuid.uuid4()),
+            save_document_pages=_blocking(True),
+            save_sections_batch=lambda sections: time.sleep(NETWORK_SECONDS) or [uuid.uuid4() for _ in sections],
+            save_chunks_batch=_blocking(True),
+            swap_document_version=_blocking(True),
+            update_document_status=_blocking(True),
+            delete_document=_blocking(True),
+            delete_pdf_from_storage=_blocking(True),
+        ),
+    }
+
+
+async def _max_loop_lag(stop: asyncio.Event) -> float:
+    """Largest delay past its due time with which the loop resumed a TICK_SECONDS sleep."""
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(TICK_SECONDS)
+        worst = max(worst, loop.time() - started - TICK_SECONDS)
+    return worst
+
+
+async def _run_with_lag_probe(work) -> tuple:
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_max_loop_lag(stop))
+    await asyncio.sleep(0)
+    try:
+        result = await work()
+    finally:
+        stop.set()
+    return result, await probe
+
+
+def test_lag_probe_detects_blocking_calls():
+    async def block_loop():
+        time.sleep(BLOCKING_SECONDS)
+
+    _, lag = asyncio.run(_run_with_lag_probe(block_loop))
+    assert lag >= BLOCKING_SECONDS / 2
+
+
+def test_large_document_version_does_not_block_event_loop(monkeypatch, tmp_path):
+    pdf_path = str(tmp_path / "annual-report-2024.pdf")
+    _write_report(pdf_path)
+    pipeline = IngestionPipeline(**_services(monkeypatch, pdf_path))
+
+    async def ingest():
+        return await pipeline.run(
+            pdf_path,
+            user_id=uuid.uuid4(),
+            original_filename="annual-report-2024.pdf",
+            doc_type="pdf",
+            job_id=uuid.uuid4(),
+            storage_path="user/doc/annual-report-2024.pdf",
+            previous_document_id=uuid.uuid4(),
+        )
+
+    result, lag = asyncio.run(_run_with_lag_probe(ingest))
+
+    assert result["success"], result
+    assert result["parse_stats"]["pages_reused"] == PAGE_COUNT // 2  # fingerprints were really computed
+    assert result["chunk_count"] > 0
+    assert lag < MAX_LAG_SECONDS, f"event loop blocked for {lag * 1000:.0f} ms"